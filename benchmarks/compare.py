@@ -0,0 +1,56 @@
+import argparse
+import json
+import sys
+
+# Compares results from benchmarks.installation against a baseline from an earlier run, and exits non zero if any
+# case has lost more than the tolerance in frames/s. Baselines are only meaningful from the same machine:
+#   python -m benchmarks.installation --output benchmarks/baseline.json
+#   ... change things ...
+#   python -m benchmarks.installation --output results.json
+#   python -m benchmarks.compare benchmarks/baseline.json results.json [--tolerance 0.1]
+
+
+# returns the number of cases that got slower than the baseline by more than tolerance
+def compare(baseline_path, results_path, tolerance):
+    with open(baseline_path) as file:
+        baseline = dict(((result["case"], result["leds"]), result) for result in json.load(file)["results"])
+
+    with open(results_path) as file:
+        results = json.load(file)["results"]
+
+    regressions = 0
+
+    print("{:<40} {:>7} {:>10} {:>10} {:>8}".format("case", "leds", "base fps", "fps", "change"))
+
+    for result in results:
+        key = (result["case"], result["leds"])
+
+        if key not in baseline.keys():
+            print("{:<40} {:>7} {:>10} {:>10.1f} {:>8}".format(result["case"], result["leds"], "-", result["fps"], "new"))
+            continue
+
+        change = result["fps"] / baseline[key]["fps"] - 1.0
+        regressed = change < -tolerance
+        regressions += regressed
+
+        print("{:<40} {:>7} {:>10.1f} {:>10.1f} {:>+7.1f}%{}".format(result["case"], result["leds"], baseline[key]["fps"],
+                                                                    result["fps"], change * 100, "  SLOWER" if regressed else ""))
+
+    print("{} of {} cases slower than baseline by more than {:.0f}%".format(regressions, len(results), tolerance * 100))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare installation benchmark results against a stored baseline")
+    parser.add_argument("baseline")
+    parser.add_argument("results")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="fractional fps drop allowed")
+    args = parser.parse_args()
+
+    if compare(args.baseline, args.results, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
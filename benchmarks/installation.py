@@ -0,0 +1,366 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.stand_ins import OpcSink
+from common.profiler import profiler
+from emulators.device_host import DeviceHost
+from emulators.octo_ws2811_sender import OctoWs2811SenderEmulator
+from emulators.pty_device import default_port_name
+from emulators.usb_controller import UsbControllerEmulator
+from pyzzazz import Pyzzazz
+
+# Runs pyzzazz headless against a synthetic installation of dodecahedrons, cylinders and bunting, with emulated octo
+# sender boards and usb controller on ptys and a local tcp sink for opc. Every pattern and overlay is run in turn
+# and frames/s, per stage cost and bytes/s are written out as json. Run from the repo root:
+#   python -m benchmarks.installation [--leds 1000 10000 100000] [--cases fire flash] [--output results.json]
+#
+# frames are rendered back to back rather than at 30fps, so fps is how fast we could go, not how fast we do.
+
+
+patterns = ("smooth", "swirl", "sparkle", "fizzy_lifting_drink", "make_me_one_with_everything", "fire", "map_video")
+
+overlays = {"flash": {"decay_factor": 1.0},
+            "star_drive": {"decay_factor": 1.0},
+            "ripple": {"decay_factor": 1.0},
+            "spark_shower": {},
+            "hue_shift": {}}
+
+video_name = "bench.avi"
+controller_name = "BENCH_CONTROLLER_000"
+opc_sender_name = "bench_opc"
+
+
+def get_commands():
+    commands = dict()
+
+    for pattern in patterns:
+        command = {"type": "pattern", "name": pattern, "args": {}}
+
+        if pattern == "map_video":
+            command["video_name"] = video_name
+
+        commands["pattern/" + pattern] = command
+
+    for overlay, args in overlays.items():
+        commands["overlay/" + overlay] = {"type": "overlay", "name": overlay, "args": args}
+
+    return commands
+
+
+# a few dodecahedrons, and the rest of the leds split between cylinders and bunting of at most max_fixture_leds each
+def build_fixture_confs(total_leds, max_fixture_leds):
+    num_dodecahedrons = max(1, min(16, total_leds // 2000))
+    remaining = max(0, total_leds - num_dodecahedrons * 60)
+
+    fixture_confs = list()
+
+    for i in range(num_dodecahedrons):
+        fixture_confs.append({"name": "bench_dodecahedron_{}".format(i),
+                              "geometry": "dodecahedron",
+                              "radius": 0.25})
+
+    num_cylinders = max(1, math.ceil(remaining / 2 / max_fixture_leds))
+
+    for i in range(num_cylinders):
+        fixture_confs.append({"name": "bench_cylinder_{}".format(i),
+                              "geometry": "cylinder",
+                              "num_pixels": max(1, remaining // 2 // num_cylinders),
+                              "num_turns": 20,
+                              "radius": 0.5,
+                              "height": 2.0})
+
+    num_buntings = max(1, math.ceil(remaining / 2 / max_fixture_leds))
+
+    for i in range(num_buntings):
+        fixture_confs.append({"name": "bench_bunting_{}".format(i),
+                              "geometry": "bunting_polygon",
+                              "sides": 6,
+                              "leds_per_strand": max(1, remaining // 2 // num_buntings // 3),
+                              "length_per_strand": 2.5,
+                              "num_strands": 3,
+                              "radius": 1.0,
+                              "farthest_point": [3.0, 0.0, 0.0]})
+
+    # spread them out on a grid so spatial patterns and overlays have something to sweep across
+    grid_size = math.ceil(math.sqrt(len(fixture_confs)))
+
+    for i, fixture_conf in enumerate(fixture_confs):
+        fixture_conf["type"] = "led"
+        fixture_conf["channel_order"] = "grb"
+        fixture_conf["default_pattern"] = patterns[0]
+        fixture_conf["location"] = [(i % grid_size) * 3.0, (i // grid_size) * 3.0, 0.0]
+
+    return fixture_confs
+
+
+def build_config(fixture_confs, board_names, lines_per_board, opc_port, render_mode, video_track_dir=None):
+    senders = list({"name": name, "type": "usb_serial", "num_lines": lines_per_board} for name in board_names)
+
+    senders.append({"name": opc_sender_name,
+                    "type": "opc",
+                    "ip": "127.0.0.1",
+                    "port": str(opc_port),
+                    "num_lines": len(fixture_confs)})
+
+    for i, fixture_conf in enumerate(fixture_confs):
+        fixture_conf["senders"] = [[board_names[i // lines_per_board], i % lines_per_board], [opc_sender_name, i]]
+
+    buttons = list({"name": name,
+                    "id": i,
+                    "target_keyword": "bench_",
+                    "command": repr(command)} for i, (name, command) in enumerate(get_commands().items()))
+
+    sliders = list({"name": name,
+                    "id": i,
+                    "target_keyword": "master_settings",
+                    "command": repr({"type": "slider", "name": name}),
+                    "default": default} for i, (name, default) in enumerate((("smoothness", 50),
+                                                                            ("brightness", 100),
+                                                                            ("speed", 33),
+                                                                            ("space_per_palette", 50))))
+
+    config = {"Senders": senders,
+              "Fixtures": fixture_confs,
+              "Controllers": [{"name": controller_name, "type": "usb_serial", "port": 0, "buttons": buttons, "sliders": sliders}],
+              "Render": {"mode": render_mode},
+              "Profiler": {"enabled": True}}
+
+    # baked up front, so the video cases time playing tracks back rather than baking them
+    if video_track_dir:
+        config["VideoTracks"] = {"enabled": True, "cache_dir": video_track_dir, "bake_on_start": True}
+
+    return config
+
+
+def write_video(path, size=96, num_frames=90):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30.0, (size, size))
+
+    if not writer.isOpened():
+        raise Exception("installation: can't write a test video, is opencv built with video support?")
+
+    x, y = np.meshgrid(np.arange(size), np.arange(size))
+
+    for i in range(num_frames):
+        frame = np.stack(((x + i * 3) % 256, (y + i * 5) % 256, (x + y + i * 7) % 256), axis=-1).astype(np.uint8)
+        writer.write(frame)
+
+    writer.release()
+
+
+class Installation:
+    def __init__(self, total_leds, max_fixture_leds, lines_per_board, render_mode, verbose, video_tracks=False):
+        self.scratch_dir = tempfile.mkdtemp(prefix="pyzzazz_bench_")
+        self.device_dir = os.path.join(self.scratch_dir, "dev")
+        self.video_dir = os.path.join(self.scratch_dir, "videos")
+        os.mkdir(self.device_dir)
+        os.mkdir(self.video_dir)
+
+        write_video(os.path.join(self.video_dir, video_name))
+
+        self.fixture_confs = build_fixture_confs(total_leds, max_fixture_leds)
+        num_boards = math.ceil(len(self.fixture_confs) / lines_per_board)
+
+        # the fixtures here are far longer than a real board's strips, so don't hold the host back to a real board's pace
+        self.host = DeviceHost()
+        self.boards = list(self.host.add(OctoWs2811SenderEmulator("BENCH_SENDER_{:03d}".format(i), self.device_dir, default_port_name(i),
+                                                                  bytes_per_second=None))
+                           for i in range(num_boards))
+
+        # someone fiddling with the sliders keeps events flowing through the router
+        self.controller = self.host.add(UsbControllerEmulator(controller_name, self.device_dir, default_port_name(num_boards),
+                                                              sliders=(512, 1023, 340, 512), slider_moves_per_second=10))
+        self.sink = self.host.add(OpcSink(opc_sender_name))
+
+        config = build_config(self.fixture_confs, list(board.name for board in self.boards), lines_per_board, self.sink.port, render_mode,
+                              os.path.join(self.scratch_dir, "video_tracks") if video_tracks else None)
+        conf_path = os.path.join(self.scratch_dir, "conf.json")
+
+        with open(conf_path, "w") as file:
+            json.dump(config, file)
+
+        self.host.start()
+
+        # pyzzazz is chatty, keep its output out of the results unless asked
+        self._output = sys.stdout if verbose else io.StringIO()
+
+        with contextlib.redirect_stdout(self._output):
+            start = time.perf_counter()
+            self.app = Pyzzazz(conf_path, "palettes/", self.video_dir,
+                               device_dir=self.device_dir,
+                               port_cache_path=None,
+                               calibration_path=os.path.join(self.scratch_dir, "calibration.json"))
+
+            self.build_time = time.perf_counter() - start
+
+        self.num_leds = sum(fixture.num_pixels for fixture in self.app.fixtures)
+
+    def run_frames(self, num_frames):
+        with contextlib.redirect_stdout(self._output):
+            for _ in range(num_frames):
+                # always due, so we render flat out
+                self.app.frame_scheduler.next_deadline = time.time()
+                self.app.update()
+
+        # don't let a long run pile it all up in memory
+        if self._output is not sys.stdout:
+            self._output.seek(0)
+            self._output.truncate()
+
+    def wait_for_devices(self, timeout=10.0):
+        names = list(board.name for board in self.boards) + [controller_name]
+        deadline = time.time() + timeout
+
+        while not all(self.app.usb_serial_manager.is_connected(name) for name in names):
+            if time.time() > deadline:
+                missing = list(name for name in names if not self.app.usb_serial_manager.is_connected(name))
+                raise Exception("installation: emulated devices {} never connected".format(", ".join(missing)))
+
+            self.run_frames(1)
+            time.sleep(0.01)
+
+    def send_command(self, command):
+        # the same routes Pyzzazz.dispatch_events would take for a button press
+        render_pool = self.app.render_pool
+
+        if command["type"] == "overlay":
+            if render_pool:
+                render_pool.queue_overlay_command(command)
+            else:
+                self.app.overlay_handler.receive_command(command, self.app.effective_time)
+            return
+
+        if command["name"] == "map_video":
+            for video_handler in self.app.video_handlers.values():
+                if render_pool:
+                    render_pool.queue_video_command(video_handler, command)
+                else:
+                    video_handler.receive_command(command)
+
+        for fixture in self.app.fixtures:
+            if render_pool:
+                render_pool.queue_fixture_command(fixture, command, 1)
+            else:
+                fixture.receive_command(command, 1)
+
+    def run_case(self, name, command, num_frames, retrigger_interval):
+        if command["type"] == "pattern":
+            self.send_command(command)
+
+        else:
+            self.send_command(get_commands()["pattern/" + patterns[0]])
+
+        # settle into the case before we start measuring
+        self.run_frames(5)
+
+        profiler.configure({"enabled": True, "window": num_frames})
+        before = self.host.get_stats()
+        start = time.perf_counter()
+
+        for frame in range(num_frames):
+            if command["type"] == "overlay" and frame % retrigger_interval == 0:
+                self.send_command(command)
+
+            self.run_frames(1)
+
+        elapsed = time.perf_counter() - start
+        after = self.host.get_stats()
+
+        stats = profiler.get_stats()
+        frame_stats = stats.pop(("frame", "total"))
+
+        # per stage totals per frame, summed over everything in that stage
+        stages = dict()
+
+        for (category, _), stage in stats.items():
+            stages[category] = stages.get(category, 0.0) + stage["total"] * 1000 / num_frames
+
+        serial_bytes = sum(after[board.name]["bytes_received"] - before[board.name]["bytes_received"] for board in self.boards)
+        opc_bytes = after[self.sink.name]["bytes_received"] - before[self.sink.name]["bytes_received"]
+
+        return {"case": name,
+                "leds": self.num_leds,
+                "fixtures": len(self.app.fixtures),
+                "frames": num_frames,
+                "fps": num_frames / elapsed,
+                "frame_ms_p50": frame_stats["p50"] * 1000,
+                "frame_ms_p99": frame_stats["p99"] * 1000,
+                "stage_ms_per_frame": stages,
+                "serial_bytes_per_s": serial_bytes / elapsed,
+                "opc_bytes_per_s": opc_bytes / elapsed}
+
+    def shut_down(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.app.shut_down()
+
+        self.host.stop()
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+
+
+def run(args):
+    commands = get_commands()
+    cases = list(name for name in commands.keys() if not args.cases or any(case in name for case in args.cases))
+
+    results = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "python": platform.python_version(),
+                        "numpy": np.__version__,
+                        "machine": platform.machine(),
+                        "cpu_count": os.cpu_count(),
+                        "render_mode": args.render,
+                        "video_tracks": args.video_tracks},
+               "results": list()}
+
+    print("{:<40} {:>7} {:>8} {:>9} {:>9} {:>11} {:>11}".format("case", "leds", "fps", "p50 ms", "p99 ms", "serial kB/s", "opc kB/s"))
+
+    for total_leds in args.leds:
+        installation = Installation(total_leds, args.max_fixture_leds, args.lines_per_board, args.render, args.verbose, args.video_tracks)
+
+        try:
+            installation.wait_for_devices()
+
+            for name in cases:
+                result = installation.run_case(name, commands[name], args.frames, args.retrigger_interval)
+                results["results"].append(result)
+
+                print("{:<40} {:>7} {:>8.1f} {:>9.2f} {:>9.2f} {:>11.1f} {:>11.1f}".format(
+                      name, result["leds"], result["fps"], result["frame_ms_p50"], result["frame_ms_p99"],
+                      result["serial_bytes_per_s"] / 1000, result["opc_bytes_per_s"] / 1000))
+
+        finally:
+            installation.shut_down()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+        print("results written to {}".format(args.output))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pyzzazz against a synthetic installation")
+    parser.add_argument("--leds", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--cases", nargs="*", help="only run cases whose names contain one of these")
+    parser.add_argument("--render", choices=("serial", "threads", "processes"), default="serial")
+    parser.add_argument("--max-fixture-leds", type=int, default=2000)
+    parser.add_argument("--lines-per-board", type=int, default=8)
+    parser.add_argument("--video-tracks", action="store_true", help="play videos from baked per led tracks")
+    parser.add_argument("--retrigger-interval", type=int, default=15, help="frames between overlay triggers")
+    parser.add_argument("--output", help="write json results here, e.g. to compare with benchmarks.compare")
+    parser.add_argument("--verbose", action="store_true", help="show pyzzazz's own output")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
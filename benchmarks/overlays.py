@@ -0,0 +1,115 @@
+import argparse
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from fixtures.bunting_polygon import BuntingPolygon
+from handlers.calibration_handler import CalibrationHandler
+from overlays.overlay_handler import OverlayHandler
+from benchmarks.reference_overlays import references
+
+# Times each overlay on its own over bunting fixtures, from when it's triggered until it expires or --seconds of render
+# time have gone by, with the render clock stepped at 30fps. Only composing the overlay is timed, not the pattern under
+# it. With --fixtures, the leds are split between that many buntings spread out on a grid, as in an installation.
+# --reference also times the implementations in benchmarks/reference_overlays.py, from before overlays were sped up,
+# next to the current ones. Run from the repo root:
+#   python -m benchmarks.overlays [--leds 500 2000] [--fixtures 16] [--overlays spark_shower ripple] [--reference]
+
+
+overlays = {"flash": {"decay_factor": 1.0},
+            "star_drive": {"decay_factor": 1.0},
+            "ripple": {"decay_factor": 1.0},
+            "spark_shower": {},
+            "hue_shift": {}}
+
+frame_budget = 1.0 / 30
+
+
+def build_bunting(num_leds, calibration_handler, name="bench_bunting", location=(0.0, 0.0, 0.0)):
+    config = {"name": name,
+              "location": list(location),
+              "sender": None,
+              "geometry": "bunting_polygon",
+              "channel_order": "grb",
+              "default_pattern": "smooth",
+              "sides": 6,
+              "leds_per_strand": max(1, num_leds // 3),
+              "length_per_strand": 2.5,
+              "num_strands": 3,
+              "radius": 1.0,
+              "farthest_point": [3.0, 0.0, 0.0]}
+
+    return BuntingPolygon(config, [], None, None, calibration_handler)
+
+
+def build_buntings(num_leds, num_fixtures, calibration_handler):
+    grid_size = math.ceil(math.sqrt(num_fixtures))
+
+    return list(build_bunting(max(3, num_leds // num_fixtures), calibration_handler, "bench_bunting_{}".format(i),
+                              ((i % grid_size) * 3.0, (i // grid_size) * 3.0, 0.0)) for i in range(num_fixtures))
+
+
+def time_overlay(name, fixtures, max_seconds, args):
+    overlay_handler = OverlayHandler()
+    overlay_handler.receive_command({"type": "overlay", "name": name, "args": args}, 0.0)
+
+    rng = np.random.default_rng(0)
+    colours = list(rng.uniform(0, 255, (fixture.num_pixels, 3)).astype(np.float32) for fixture in fixtures)
+    outs = list(np.zeros_like(fixture_colours) for fixture_colours in colours)
+
+    frame_times = list()
+    effective_time = 0.0
+
+    while overlay_handler.active_overlays and effective_time < max_seconds:
+        start = time.perf_counter()
+
+        for fixture, fixture_colours, out in zip(fixtures, colours, outs):
+            overlay_handler.calculate_overlaid_colours(fixture.leds, fixture_colours, fixture.name, effective_time, out)
+
+        frame_times.append(time.perf_counter() - start)
+
+        overlay_handler.update(effective_time)
+        effective_time += frame_budget
+
+    return np.array(frame_times), effective_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each overlay over bunting fixtures")
+    parser.add_argument("--leds", type=int, nargs="+", default=[500, 2000, 10000])
+    parser.add_argument("--fixtures", type=int, default=1)
+    parser.add_argument("--overlays", nargs="+", default=list(overlays.keys()))
+    parser.add_argument("--seconds", type=float, default=30.0, help="most render time to run each overlay for")
+    parser.add_argument("--reference", action="store_true", help="also time the old implementations, where there are any")
+    args = parser.parse_args()
+
+    calibration_handler = CalibrationHandler(os.path.join(tempfile.mkdtemp(), "calibration.json"))
+
+    # (name to trigger, its args)
+    cases = list()
+
+    for name in args.overlays:
+        cases.append((name, overlays[name]))
+
+        if args.reference and name in references.keys():
+            cases.append((references[name], overlays[name]))
+
+    print("{:<22} {:>7} {:>8} {:>10} {:>10} {:>9}".format("overlay", "leds", "frames", "mean ms", "p99 ms", "budget"))
+
+    for num_leds in args.leds:
+        fixtures = build_buntings(num_leds, args.fixtures, calibration_handler)
+
+        for name, overlay_args in cases:
+            frame_times, _ = time_overlay(name, fixtures, args.seconds, overlay_args)
+
+            mean = np.mean(frame_times)
+            print("{:<22} {:>7} {:>8} {:>10.3f} {:>10.3f} {:>8.1f}%".format(name, sum(fixture.num_pixels for fixture in fixtures),
+                                                                      len(frame_times), mean * 1000,
+                                                                      np.percentile(frame_times, 99) * 1000, mean / frame_budget * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import random
+import time
+
+from handlers.packet_handler import CommHeader
+from handlers.packet_handler import CommPacketHandler
+from handlers.packet_handler import ControlUpdatePayload
+from handlers.packet_handler import NameReplyPayload
+from handlers.packet_handler import PreviewFramePayload
+from handlers.packet_handler import PreviewSubscribePayload
+from handlers.packet_handler import StateReplyPayload
+from handlers.packet_handler import SubscribePayload
+from handlers.connections.usb_serial_handler import SerialClientHandler
+
+# Fuzz and throughput checks for CommPacketHandler. Run from the repo root:
+#   python -m benchmarks.packet_parser [--iterations N] [--seed S]
+
+
+all_msgtypes = ("name_request", "name_reply", "state_request", "state_reply", "subscribe", "control_update",
+                "preview_subscribe", "preview_frame")
+
+
+def build_packet(rng, msgtypes=all_msgtypes):
+    msgtype = rng.choice(msgtypes)
+
+    if msgtype == "name_reply":
+        name = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ_0123456789") for _ in range(rng.randint(1, 24)))
+        payload = NameReplyPayload(name=name)
+
+    elif msgtype == "state_reply":
+        button_state = list(rng.randint(0, 1) for _ in range(8 * rng.randint(1, 4)))
+        slider_state = list(rng.randint(0, 1024) for _ in range(rng.randint(0, 16)))
+        payload = StateReplyPayload(button_state=button_state, slider_state=slider_state)
+
+    elif msgtype == "subscribe":
+        payload = SubscribePayload(keepalive_interval=rng.randint(0, 0xffff) / 1000.0)
+
+    elif msgtype == "control_update":
+        updates = list((rng.choice(("button", "slider")), rng.randrange(256), rng.randrange(0x10000)) for _ in range(rng.randint(1, 8)))
+        payload = ControlUpdatePayload(updates=updates)
+
+    elif msgtype == "preview_subscribe":
+        payload = PreviewSubscribePayload(fps=rng.randint(0, 0xff), bits=rng.randint(1, 8), max_pixels=rng.randint(1, 0xffff))
+
+    elif msgtype == "preview_frame":
+        fixtures = list(("fixture_{}".format(i), rng.randint(0, 0xffff)) for i in range(rng.randint(0, 4)))
+
+        # the odd one long enough to need an extended length header
+        data_len = rng.randint(0xffff, 0x10400) if rng.random() < 0.01 else rng.randint(0, 64)
+        data = rng.getrandbits(8 * data_len).to_bytes(data_len, byteorder="big") if data_len else b""
+
+        payload = PreviewFramePayload(seq=rng.randrange(0x10000), keyframe=rng.random() < 0.5, fixtures=fixtures, data=data)
+
+    else:
+        return CommHeader(msgtype=msgtype).get_bytes(), CommHeader(msgtype=msgtype).get_dict()
+
+    payload_bytes = payload.get_bytes()
+    return CommHeader(msgtype=msgtype, payload_len=len(payload_bytes)).get_bytes() + payload_bytes, payload.get_dict()
+
+
+def build_stream(rng, num_packets, msgtypes=all_msgtypes):
+    stream = bytearray()
+    expected = list()
+
+    for _ in range(num_packets):
+        packet_bytes, packet_dict = build_packet(rng, msgtypes)
+        stream.extend(packet_bytes)
+        expected.append(packet_dict)
+
+    return stream, expected
+
+
+def feed_in_chunks(handler, stream, rng, max_chunk):
+    offset = 0
+    while offset < len(stream):
+        chunk_len = rng.randint(1, max_chunk)
+        handler.add_bytes(stream[offset:offset + chunk_len])
+        offset += chunk_len
+
+
+def noise(rng, length, allow_signature):
+    values = list(rng.randrange(256) for _ in range(length))
+
+    if not allow_signature:
+        values = list(v if v != CommHeader.signature else v + 1 for v in values)
+
+    return bytearray(values)
+
+
+def fuzz_chunking(rng, iterations):
+    # arbitrary read boundaries must never change what comes out
+    for _ in range(iterations):
+        stream, expected = build_stream(rng, rng.randint(1, 50))
+        handler = CommPacketHandler(compact_threshold=rng.randint(0, 256))
+        feed_in_chunks(handler, stream, rng, 64)
+
+        assert handler.available_packets == expected, "chunked parse differs from packet stream"
+        assert handler.pending_bytes() == 0, "parser left {} bytes unconsumed".format(handler.pending_bytes())
+        assert handler.bytes_discarded == 0, "parser discarded bytes from a clean stream"
+
+
+def fuzz_unsigned_noise(rng, iterations):
+    # noise that contains no signature byte must be skipped without losing a single packet
+    for _ in range(iterations):
+        stream = bytearray()
+        expected = list()
+
+        for _ in range(rng.randint(1, 50)):
+            if rng.random() < 0.3:
+                stream.extend(noise(rng, rng.randint(1, 64), allow_signature=False))
+
+            packet_bytes, packet_dict = build_packet(rng)
+            stream.extend(packet_bytes)
+            expected.append(packet_dict)
+
+        handler = CommPacketHandler()
+        feed_in_chunks(handler, stream, rng, 64)
+
+        assert handler.available_packets == expected, "lost packets resyncing past unsigned noise"
+
+
+def fuzz_corruption(rng, iterations):
+    # with arbitrary corruption we can't promise every packet survives, but the parser must never raise,
+    # never emit malformed packets, and must lock back on once clean data resumes. only serial lines corrupt data,
+    # so this runs against the serial message set
+    recovered = 0
+    total = 0
+
+    for _ in range(iterations):
+        stream, _ = build_stream(rng, rng.randint(1, 30), SerialClientHandler.msgtypes)
+
+        for _ in range(rng.randint(1, 8)):
+            action = rng.randrange(3)
+            position = rng.randrange(len(stream) + 1)
+
+            if action == 0:
+                stream[position:position] = noise(rng, rng.randint(1, 32), allow_signature=True)
+            elif action == 1 and position < len(stream):
+                stream[position] = rng.randrange(256)
+            else:
+                del stream[position:position + rng.randint(1, 8)]
+
+        handler = CommPacketHandler(msgtypes=SerialClientHandler.msgtypes)
+        feed_in_chunks(handler, stream, rng, 64)
+
+        for packet in handler.available_packets:
+            assert packet["msgtype"] in CommHeader.ops_by_str, "malformed packet {}".format(packet)
+
+        # a false lock can swallow at most one maximum length payload, so a clean tail that long must get through
+        tail, tail_expected = build_stream(rng, 600, SerialClientHandler.msgtypes)
+        handler.available_packets.clear()
+        handler.add_bytes(tail)
+
+        total += len(tail_expected)
+        recovered += sum(1 for packet in tail_expected if packet in handler.available_packets)
+
+        assert handler.available_packets[-10:] == tail_expected[-10:], "parser failed to resync after corruption"
+
+    return recovered / max(total, 1)
+
+
+def benchmark(rng, num_packets, chunk_sizes):
+    stream, expected = build_stream(rng, num_packets)
+    results = list()
+
+    for chunk_size in chunk_sizes:
+        handler = CommPacketHandler()
+        chunks = list(bytes(stream[i:i + chunk_size]) for i in range(0, len(stream), chunk_size))
+
+        start = time.perf_counter()
+        for chunk in chunks:
+            handler.add_bytes(chunk)
+        elapsed = time.perf_counter() - start
+
+        assert len(handler.available_packets) == len(expected)
+        results.append((chunk_size, len(stream) / elapsed / 1e6, num_packets / elapsed))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz and benchmark the comm packet parser")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--packets", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    fuzz_chunking(rng, args.iterations)
+    print("fuzz: chunk boundaries ok ({} streams)".format(args.iterations))
+
+    fuzz_unsigned_noise(rng, args.iterations)
+    print("fuzz: unsigned noise ok ({} streams)".format(args.iterations))
+
+    recovery_rate = fuzz_corruption(rng, max(1, args.iterations // 10))
+    print("fuzz: arbitrary corruption ok, {:.2%} of post corruption packets recovered".format(recovery_rate))
+
+    for chunk_size, mb_per_s, packets_per_s in benchmark(rng, args.packets, (1, 64, 4096)):
+        print("bench: chunk {:5d} B  {:8.2f} MB/s  {:10.0f} packets/s".format(chunk_size, mb_per_s, packets_per_s))
+
+
+if __name__ == "__main__":
+    main()
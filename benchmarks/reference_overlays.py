@@ -0,0 +1,72 @@
+from overlays.overlay import Overlay, overlay_types
+import numpy as np
+import random
+import time
+
+# Overlays as they were before they were rewritten for speed, kept so benchmarks.overlays --reference can time the old
+# and new side by side. Only updated as far as the overlay interface has changed under them, the per led work is left
+# as it was.
+
+
+# spark_shower before it was vectorised: a python loop over the leds to spawn sparkles, a list comprehension for the
+# colours, and sparkle times from the wall clock rather than the render clock
+class SparkShower(Overlay):
+    blend = "max"
+
+    def __init__(self, args):
+        Overlay.__init__(self, args)
+        self.last_sparkles = {}
+        self._sparkle_probability = args.get("sparkle_probability", 0.025)
+        self.deltas = {}
+        self.colour_factors = {}
+
+        # furthest led of any fixture we've drawn on. it has no region, so the handler never works this out for it
+        self.max_delta = None
+
+    def get_layer(self, colours, leds, time_since_start, fixture_name):
+        if fixture_name not in self.last_sparkles.keys():
+            self.deltas[fixture_name] = np.array(list(led.coord.get_delta("global") for led in leds))
+            self.last_sparkles[fixture_name] = np.zeros(len(leds))
+            self.colour_factors[fixture_name] = np.random.normal(1.0, 0.1, (len(leds), 3))
+            self.max_delta = max(self.max_delta or 0.0, np.max(self.deltas[fixture_name], initial=0.0))
+
+        # determine sparkle front probability
+        front_speed = 1.0
+        head_start = 0.5
+        front_progress = front_speed * time_since_start + head_start
+
+        time_since_front = front_progress - self.deltas[fixture_name]
+        time_since_front = np.maximum(1, time_since_front)
+
+        front_intensity = 1.0 / (time_since_front * 0.5)
+
+        front_intensity[self.deltas[fixture_name] > front_progress] = 0
+
+        # spawn new sparkles
+        faded_probability = self._sparkle_probability * front_intensity
+
+        for i in range(len(leds)):
+            if random.random() < faded_probability[i]:
+                self.last_sparkles[fixture_name][i] = time.time()
+
+        time_since_sparkles = np.maximum(1.0, time.time() - self.last_sparkles[fixture_name])
+        sparkle_intensities = 1.0 / np.maximum(0.5, time_since_sparkles / 1.5)
+        sparkle_intensities *= (1.0 / np.maximum(1.0, time_since_front / 1))
+
+        sparkle_colours = np.array(list([246, 101 + 101 * (1.0 / max(1.0, time_since_front[i] / 2)), 74] for i in range(len(leds))))
+        sparkle_colours *= self.colour_factors[fixture_name]
+        sparkle_colours *= sparkle_intensities[:,np.newaxis]
+
+        return sparkle_colours
+
+    def get_envelope(self, time_since_start, max_delta):
+        if self.max_delta is None:
+            return 1.0
+
+        return 1.0 / max(1.0, time_since_start + 0.5 - self.max_delta)
+
+
+# overlay name -> the name its reference implementation is registered under
+references = {"spark_shower": "spark_shower_reference"}
+
+overlay_types.register("spark_shower_reference", SparkShower, requires=(), cost=2.0, batched=False)
@@ -0,0 +1,188 @@
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from common.frame_scheduler import FrameScheduler
+from emulators.device_host import DeviceHost
+from emulators.octo_ws2811_sender import OctoWs2811SenderEmulator
+from emulators.octo_ws2811_sender import add_checksum
+from emulators.pty_device import default_port_name
+from handlers.connections.usb_serial_handler import UsbSerialHandler
+from handlers.senders.usb_serial_sender_handler import UsbSerialSenderHandler
+
+# Soak tests UsbSerialHandler and UsbSerialSenderHandler against growing numbers of emulated octo sender boards, to
+# find how many one host can keep fed. Every frame carries a checksum the boards verify, and each board reports the
+# frames/s each of its lines actually showed. Run from the repo root:
+#   python -m benchmarks.soak [--boards 1 2 4 8 16 32] [--leds-per-line 200] [--fps 30] [--duration 5]
+#
+# no rendering happens here, the frames are canned, so this is purely the cost of getting bytes to the boards.
+
+
+def build_frames(num_lines, leds_per_line, num_variants, rng):
+    frames = list()
+
+    for _ in range(num_variants):
+        lines = list()
+
+        for _ in range(num_lines):
+            # the last led of each line carries the checksum
+            pixels = rng.integers(0, 256, (leds_per_line - 1) * 3, dtype=np.uint8)
+
+            # sentinels get bumped to the next value, as LedFixture.get_byte_values does
+            pixels[(pixels == ord("~")) | (pixels == ord("|"))] += 1
+
+            lines.append(add_checksum(pixels.tobytes()))
+
+        frames.append(lines)
+
+    return frames
+
+
+def soak(num_boards, args):
+    scratch_dir = tempfile.mkdtemp(prefix="pyzzazz_soak_")
+    host = DeviceHost()
+
+    try:
+        boards = list(host.add(OctoWs2811SenderEmulator("SOAK_SENDER_{:03d}".format(i), scratch_dir, default_port_name(i),
+                                                        leds_per_strip=args.leds_per_line,
+                                                        fps=args.board_fps,
+                                                        bytes_per_second=args.bandwidth or None,
+                                                        checksummed=True))
+                      for i in range(num_boards))
+
+        host.start()
+
+        serial_handler = UsbSerialHandler(device_dir=scratch_dir, name_cache_path=None)
+        sender_conf = {"type": "usb_serial", "num_lines": args.lines, "overload_policy": args.policy, "max_queued_frames": args.max_queued_frames}
+        senders = list(UsbSerialSenderHandler(dict(sender_conf, name=board.name), serial_handler) for board in boards)
+
+        deadline = time.time() + 10.0
+
+        while not all(sender.is_connected() for sender in senders):
+            if time.time() > deadline:
+                raise Exception("soak: boards never identified themselves")
+
+            serial_handler.update()
+            time.sleep(0.01)
+
+        frames = build_frames(args.lines, args.leds_per_line, 8, np.random.default_rng(0))
+        scheduler = FrameScheduler(args.fps, report_interval=0, manage_gc=False)
+
+        num_frames = 0
+        send_time = 0.0
+        max_backlog = 0
+
+        end = time.time() + args.duration
+
+        while time.time() < end:
+            scheduler.wait(serial_handler.get_fds(), serial_handler.get_write_fds())
+            serial_handler.update()
+
+            if not scheduler.frame_due():
+                continue
+
+            scheduler.start_frame()
+            start = time.perf_counter()
+
+            for sender in senders:
+                sender.start_frame()
+
+                for line, frame in enumerate(frames[num_frames % len(frames)]):
+                    sender.send(line, frame)
+
+            send_time += time.perf_counter() - start
+            num_frames += 1
+
+            max_backlog = max(max_backlog, sum(serial_handler.get_pending_bytes(sender.name) for sender in senders))
+            scheduler.end_frame()
+
+        # let whatever is still queued reach the boards
+        drain_end = time.time() + 1.0
+
+        while time.time() < drain_end and any(serial_handler.get_pending_bytes(sender.name) for sender in senders):
+            serial_handler.update()
+            time.sleep(0.001)
+
+        time.sleep(0.1)
+        stats = host.get_stats()
+        sender_stats = list(sender.get_stats() for sender in senders)
+
+    finally:
+        host.stop()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    lines = list(line for board in boards for line in stats[board.name]["lines"].values())
+    expected_lines = num_boards * args.lines
+
+    # a line that never got a good frame through counts as showing nothing
+    shown = list(line["shown_fps"] for line in lines) + [0.0] * (expected_lines - len(lines))
+    received = list(line["received_fps"] for line in lines) + [0.0] * (expected_lines - len(lines))
+
+    return {"boards": num_boards,
+            "lines": expected_lines,
+            "leds": expected_lines * args.leds_per_line,
+            "host_fps": num_frames / args.duration,
+            "overruns": scheduler.stats.num_overruns,
+            "send_ms_per_frame": send_time * 1000 / max(1, num_frames),
+            "max_backlog_bytes": max_backlog,
+            "bytes_per_s": sum(stats[board.name]["bytes_received"] for board in boards) / args.duration,
+            "received_fps_min": min(received),
+            "received_fps_mean": sum(received) / len(received),
+            "shown_fps_min": min(shown),
+            "shown_fps_mean": sum(shown) / len(shown),
+            "frames_dropped": sum(sender["frames_dropped"] for sender in sender_stats),
+            "link_kB_per_s_min": min((sender["link_bytes_per_s"] or 0) / 1000 for sender in sender_stats),
+            "checksum_failures": sum(line["checksum_failures"] for line in lines),
+            "interrupted_frames": sum(stats[board.name]["interrupted_frames"] for board in boards)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test serial output against emulated octo sender boards")
+    parser.add_argument("--boards", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--lines", type=int, default=8)
+    parser.add_argument("--leds-per-line", type=int, default=200)
+    parser.add_argument("--fps", type=float, default=30.0, help="frame rate the host sends at")
+    parser.add_argument("--board-fps", type=float, default=30.0, help="frame rate the boards show at")
+    parser.add_argument("--bandwidth", type=int, default=1000000, help="bytes/s each board can take, 0 for unlimited")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--policy", choices=UsbSerialSenderHandler.overload_policies, default="drop",
+                        help="what the senders do when a board's link can't keep up")
+    parser.add_argument("--max-queued-frames", type=float, default=2)
+    parser.add_argument("--output", help="write json results here")
+    args = parser.parse_args()
+
+    print("{:>6} {:>7} {:>9} {:>9} {:>10} {:>12} {:>8} {:>13} {:>13} {:>9}".format(
+          "boards", "leds", "host fps", "send ms", "backlog kB", "kB/s", "dropped", "recv fps min", "shown fps min", "bad sums"))
+
+    results = list()
+    limit = None
+
+    for num_boards in args.boards:
+        result = soak(num_boards, args)
+        results.append(result)
+
+        print("{:>6} {:>7} {:>9.1f} {:>9.2f} {:>10.1f} {:>12.1f} {:>8} {:>13.1f} {:>13.1f} {:>9}".format(
+              result["boards"], result["leds"], result["host_fps"], result["send_ms_per_frame"], result["max_backlog_bytes"] / 1000,
+              result["bytes_per_s"] / 1000, result["frames_dropped"], result["received_fps_min"], result["shown_fps_min"],
+              result["checksum_failures"]))
+
+        # every line should show close to whichever is slower, what we send or what the board can show
+        if limit is None and (result["shown_fps_min"] < 0.9 * min(args.fps, args.board_fps) or result["checksum_failures"]):
+            limit = num_boards
+
+    if limit is None:
+        print("every line kept up at every board count tried")
+    else:
+        print("lines started falling behind at {} boards".format(limit))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"args": vars(args), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
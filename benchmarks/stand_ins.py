@@ -0,0 +1,85 @@
+import selectors
+import socket
+import struct
+
+# A local stand-in for an open pixel control server, for running installations against without a simulator. The serial
+# boards and controllers have proper emulators in emulators/.
+
+
+# counts open pixel control messages and bytes from any number of clients
+class OpcSink:
+    header_struct = struct.Struct(">BBH")
+
+    def __init__(self, name, host="127.0.0.1"):
+        self.name = name
+
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, 0))
+        self._listener.listen(8)
+        self._listener.setblocking(False)
+
+        self.host = host
+        self.port = self._listener.getsockname()[1]
+
+        self._buffers = dict()
+
+        self.bytes_received = 0
+        self.messages = 0
+        self.pixels = 0
+
+    def register(self, selector):
+        selector.register(self._listener, selectors.EVENT_READ, self._accept)
+
+    def _accept(self, selector):
+        conn, _ = self._listener.accept()
+        conn.setblocking(False)
+        self._buffers[conn] = bytearray()
+        selector.register(conn, selectors.EVENT_READ, lambda selector: self._read(selector, conn))
+
+    def _read(self, selector, conn):
+        try:
+            data = conn.recv(1 << 16)
+
+        except BlockingIOError:
+            return
+
+        except ConnectionError:
+            data = b""
+
+        if not data:
+            selector.unregister(conn)
+            self._buffers.pop(conn)
+            conn.close()
+            return
+
+        self.bytes_received += len(data)
+
+        buffer = self._buffers[conn]
+        buffer.extend(data)
+
+        offset = 0
+
+        while offset + self.header_struct.size <= len(buffer):
+            _, command, length = self.header_struct.unpack_from(buffer, offset)
+
+            if offset + self.header_struct.size + length > len(buffer):
+                break
+
+            self.messages += 1
+
+            if command == 0:
+                self.pixels += length // 3
+
+            offset += self.header_struct.size + length
+
+        del buffer[:offset]
+
+    def tick(self, now):
+        pass
+
+    def get_stats(self):
+        return {"bytes_received": self.bytes_received, "messages": self.messages, "pixels": self.pixels}
+
+    def close(self):
+        self._listener.close()
@@ -0,0 +1,99 @@
+import argparse
+import os
+import tempfile
+import time
+
+from fixtures.cylinder import Cylinder
+from handlers.calibration_handler import CalibrationHandler
+from handlers.palette_handler import PaletteHandler
+from handlers.patch_map import PatchMap
+from handlers.render_pool import ThreadRenderPool
+from overlays.overlay_handler import OverlayHandler
+
+# Finds the LED count where rendering fixtures on a thread pool starts beating rendering them one after another.
+# Threads only win once numpy spends long enough in big array operations, where it drops the gil. Run from the repo root:
+#   python -m benchmarks.thread_render [--workers N] [--fixtures N] [--patterns a b ...]
+
+
+def build_fixtures(num_fixtures, total_leds, patterns, overlay_handler, calibration_handler):
+    fixtures = list()
+
+    for i in range(num_fixtures):
+        config = {"name": "bench_cylinder_{}".format(i),
+                  "location": [i * 2.0, 0.0, 0.0],
+                  "sender": None,
+                  "geometry": "cylinder",
+                  "channel_order": "grb",
+                  "default_pattern": patterns[0],
+                  "num_pixels": max(1, total_leds // num_fixtures),
+                  "num_turns": 20,
+                  "radius": 0.5,
+                  "height": 2.0}
+
+        fixture = Cylinder(config, [], overlay_handler, None, calibration_handler)
+
+        for pattern in patterns:
+            fixture.register_command({"type": "pattern", "name": pattern})
+
+        fixtures.append(fixture)
+
+    return fixtures
+
+
+def time_frames(render, num_frames):
+    # one frame to warm caches
+    render(0.0)
+
+    start = time.perf_counter()
+    for frame in range(num_frames):
+        render(frame / 30.0)
+
+    return (time.perf_counter() - start) / num_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare serial and thread pool fixture rendering across LED counts")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--fixtures", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--leds", type=int, nargs="+", default=[256, 1024, 4096, 16384, 65536])
+    parser.add_argument("--patterns", nargs="+", default=["fizzy_lifting_drink", "make_me_one_with_everything"])
+    args = parser.parse_args()
+
+    palette_handler = PaletteHandler("palettes/")
+    overlay_handler = OverlayHandler()
+    calibration_handler = CalibrationHandler(os.path.join(tempfile.mkdtemp(), "calibration.json"))
+
+    print("{} fixtures, {} threads, patterns {}".format(args.fixtures, args.workers, ", ".join(args.patterns)))
+    print("{:>8} {:>12} {:>12} {:>8}".format("leds", "serial ms", "threads ms", "speedup"))
+
+    crossover = None
+
+    for total_leds in args.leds:
+        fixtures = build_fixtures(args.fixtures, total_leds, args.patterns, overlay_handler, calibration_handler)
+        pool = ThreadRenderPool(fixtures, PatchMap(fixtures), overlay_handler, palette_handler, {}, num_workers=args.workers)
+
+        def render_serial(effective_time):
+            for fixture in fixtures:
+                fixture.update(effective_time, palette_handler, 0.5, 1.0)
+
+        def render_threaded(effective_time):
+            pool.render_fixtures(effective_time, 0.5, 1.0)
+
+        serial = time_frames(render_serial, args.frames)
+        threaded = time_frames(render_threaded, args.frames)
+        pool.shut_down()
+
+        print("{:>8} {:>12.2f} {:>12.2f} {:>7.2f}x".format(total_leds, serial * 1000, threaded * 1000, serial / threaded))
+
+        if crossover is None and threaded < serial:
+            crossover = total_leds
+
+    if crossover is None:
+        print("threads never won in this range")
+    else:
+        print("threads win from around {} leds".format(crossover))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+from common.lazy_loader import import_optional_module
+import numpy as np
+import math
+
+
+# Colour space conversions for whole fixtures at a time, done in place on (leds, 3) float arrays so a frame doesn't
+# allocate a fresh array per step. Colours are 0 to 255 throughout; in hsv, hue and saturation are 0 to 1 and value
+# keeps the 0 to 255 scale, same as common.utils, but nothing is rounded to bytes along the way.
+#
+# With numba installed the conversions are compiled loops over the leds, the first time they're used. Without it
+# they're numpy, which is slower but needs nothing.
+
+
+def _rgb_to_hsv_numpy(colours):
+    r, g, b = colours[..., 0], colours[..., 1], colours[..., 2]
+
+    maxc = np.maximum(np.maximum(r, g), b)
+    delta = maxc - np.minimum(np.minimum(r, g), b)
+    grey = delta == 0
+
+    # grey has no hue, divide by anything rather than zero
+    delta[grey] = 1.0
+
+    # blue's the biggest, unless green or red is
+    hue = r - g
+    hue += 4.0 * delta
+    np.copyto(hue, b - r + 2.0 * delta, where=g == maxc)
+    np.copyto(hue, g - b, where=r == maxc)
+
+    hue /= delta * 6.0
+    hue %= 1.0
+    hue[grey] = 0.0
+
+    delta[grey] = 0.0
+    np.divide(delta, maxc, out=delta, where=maxc > 0)
+    delta[maxc <= 0] = 0.0
+
+    colours[..., 0] = hue
+    colours[..., 1] = delta
+    colours[..., 2] = maxc
+
+    return colours
+
+
+# each channel is value less some of the chroma, depending on how far round the hue wheel it is from the channel's own
+# hue. no branching on sextants
+def _hsv_to_rgb_numpy(colours):
+    hue6 = colours[..., 0] * 6.0
+    value = colours[..., 2].copy()
+    chroma = colours[..., 1] * value
+
+    k = np.empty_like(hue6)
+    scratch = np.empty_like(hue6)
+
+    for channel, offset in enumerate((5.0, 3.0, 1.0)):
+        np.add(hue6, offset, out=k)
+        k %= 6.0
+        np.subtract(4.0, k, out=scratch)
+        np.minimum(k, scratch, out=k)
+        np.clip(k, 0.0, 1.0, out=k)
+        k *= chroma
+
+        np.subtract(value, k, out=colours[..., channel])
+
+    return colours
+
+
+# written for numba, but plain python runs them too, only slowly
+def _rgb_to_hsv_loop(colours):
+    for i in range(colours.shape[0]):
+        r = colours[i, 0]
+        g = colours[i, 1]
+        b = colours[i, 2]
+
+        maxc = max(r, g, b)
+        delta = maxc - min(r, g, b)
+        hue = 0.0
+        saturation = 0.0
+
+        if delta > 0:
+            if r == maxc:
+                hue = (g - b) / delta
+            elif g == maxc:
+                hue = 2.0 + (b - r) / delta
+            else:
+                hue = 4.0 + (r - g) / delta
+
+            hue = (hue / 6.0) % 1.0
+
+            if maxc > 0:
+                saturation = delta / maxc
+
+        colours[i, 0] = hue
+        colours[i, 1] = saturation
+        colours[i, 2] = maxc
+
+    return colours
+
+
+def _hsv_to_rgb_loop(colours):
+    for i in range(colours.shape[0]):
+        hue = colours[i, 0]
+        saturation = colours[i, 1]
+        value = colours[i, 2]
+
+        hue6 = hue * 6.0
+        sextant = math.floor(hue6)
+        fraction = hue6 - sextant
+        sextant = int(sextant) % 6
+
+        p = value * (1.0 - saturation)
+        q = value * (1.0 - saturation * fraction)
+        t = value * (1.0 - saturation * (1.0 - fraction))
+
+        if sextant == 0:
+            r, g, b = value, t, p
+        elif sextant == 1:
+            r, g, b = q, value, p
+        elif sextant == 2:
+            r, g, b = p, value, t
+        elif sextant == 3:
+            r, g, b = p, q, value
+        elif sextant == 4:
+            r, g, b = t, p, value
+        else:
+            r, g, b = value, p, q
+
+        colours[i, 0] = r
+        colours[i, 1] = g
+        colours[i, 2] = b
+
+    return colours
+
+
+_kernels = None
+
+
+def get_kernels():
+    global _kernels
+
+    if _kernels is None:
+        numba = import_optional_module("numba", "compiled colour kernels")
+
+        if numba is not None:
+            _kernels = (numba.njit(cache=True)(_rgb_to_hsv_loop), numba.njit(cache=True)(_hsv_to_rgb_loop))
+        else:
+            _kernels = (_rgb_to_hsv_numpy, _hsv_to_rgb_numpy)
+
+    return _kernels
+
+
+# colours is (leds, 3) floats, and is overwritten and returned
+def rgb_to_hsv_inplace(colours):
+    return get_kernels()[0](colours)
+
+
+def hsv_to_rgb_inplace(colours):
+    return get_kernels()[1](colours)
+
+
+# Turns hues round by amount, 0 to 1 being all the way round, by rotating about the grey diagonal of the rgb cube. It
+# isn't hsv's hue, which goes round a hexagon rather than a circle: it keeps each colour's r + g + b and its distance
+# from grey rather than its brightest channel, so saturated colours come out of the cube, e.g. red turned half way
+# round is (-85, 170, 170), and are darker once clipped back in. Colours times the transpose of this are the rotated
+# colours.
+def get_hue_rotation(amount):
+    angle = amount * 2.0 * math.pi
+    cos = math.cos(angle)
+    sin = math.sin(angle)
+
+    third = (1.0 - cos) / 3.0
+    root_third = math.sqrt(1.0 / 3.0) * sin
+
+    return np.array([[cos + third, third - root_third, third + root_third],
+                     [third + root_third, cos + third, third - root_third],
+                     [third - root_third, third + root_third, cos + third]], dtype=np.float32)
+
+
+# clipped back into 0 to 255, so overlays blended on after don't get negative or overbright channels
+def rotate_hue(colours, amount, out=None):
+    rotated = np.matmul(colours, get_hue_rotation(amount).T, out=out)
+
+    return np.clip(rotated, 0.0, 255.0, out=rotated)
@@ -0,0 +1,160 @@
+from collections import OrderedDict
+import select
+import time
+import gc
+
+
+class IdleTask:
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_run = time.time() + interval
+
+
+class FrameStats:
+    def __init__(self):
+        self.num_frames = 0
+        self.num_overruns = 0
+        self.num_skipped_deadlines = 0
+        self.min_slack = float("inf")
+        self.total_slack = 0.0
+        self.max_frame_time = 0.0
+        self.idle_tasks_run = 0
+
+    def add_frame(self, slack, skipped_deadlines, frame_time):
+        self.num_frames += 1
+        self.max_frame_time = max(self.max_frame_time, frame_time)
+        self.min_slack = min(self.min_slack, slack)
+        self.total_slack += slack
+        self.num_skipped_deadlines += skipped_deadlines
+
+        if slack < 0:
+            self.num_overruns += 1
+
+    def get_dict(self):
+        return {"frames": self.num_frames,
+                "overruns": self.num_overruns,
+                "skipped_deadlines": self.num_skipped_deadlines,
+                "min_slack": self.min_slack if self.num_frames else 0.0,
+                "mean_slack": self.total_slack / self.num_frames if self.num_frames else 0.0,
+                "max_frame_time": self.max_frame_time,
+                "idle_tasks_run": self.idle_tasks_run}
+
+
+# Sleeps between frames until either the next frame deadline or one of the given fds becomes readable,
+# and runs deferred work in whatever time is left over once a frame is done
+class FrameScheduler:
+    def __init__(self, fps, report_interval=10.0, min_idle_slack=0.002, manage_gc=True):
+        self.time_per_frame = 1.0 / fps
+        self.next_deadline = time.time()
+        self._frame_start = 0.0
+
+        # don't start deferred work with less than this left before the next deadline
+        self.min_idle_slack = min_idle_slack
+
+        self._manage_gc = manage_gc
+        self._deferred = OrderedDict()
+        self._idle_tasks = list()
+
+        self.stats = FrameStats()
+        self.last_report = FrameStats()
+
+        if report_interval:
+            self.add_idle_task("frame report", self.report, report_interval)
+
+        # collect garbage when we've got time for it, rather than whenever the allocator decides mid frame
+        if manage_gc:
+            gc.disable()
+            self.add_idle_task("young gc", lambda: gc.collect(0), 0.1)
+            self.add_idle_task("full gc", gc.collect, 30.0)
+
+    def time_until_deadline(self):
+        return self.next_deadline - time.time()
+
+    def frame_due(self):
+        return self.time_until_deadline() <= 0
+
+    def wait(self, fds, write_fds=()):
+        timeout = max(0.0, self.time_until_deadline())
+
+        if not fds and not write_fds:
+            time.sleep(timeout)
+            return list()
+
+        readable, _, _ = select.select(fds, write_fds, [], timeout)
+        return readable
+
+    def start_frame(self):
+        self._frame_start = time.time()
+
+    def end_frame(self):
+        self.next_deadline += self.time_per_frame
+        slack = self.time_until_deadline()
+
+        # we've fallen more than a whole frame behind. don't try to catch up with a burst of frames
+        skipped_deadlines = 0
+        if slack < -self.time_per_frame:
+            skipped_deadlines = int(-slack / self.time_per_frame)
+            self.next_deadline = time.time() + self.time_per_frame
+
+        self.stats.add_frame(slack, skipped_deadlines, time.time() - self._frame_start)
+
+        return slack
+
+    # queue a one off job for the next frame with slack to spare. jobs with the same key are only queued once
+    def defer(self, func, key=None):
+        if key is None:
+            key = func
+
+        if key not in self._deferred.keys():
+            self._deferred[key] = func
+
+    # run func roughly every interval seconds when there is slack. tasks that are starved for ten intervals run anyway
+    def add_idle_task(self, name, func, interval):
+        self._idle_tasks.append(IdleTask(name, func, interval))
+
+    def run_idle_tasks(self):
+        now = time.time()
+
+        for task in self._idle_tasks:
+            if task.next_run + task.interval * 10 < now:
+                self._run_task(task)
+
+        while self._deferred and self.time_until_deadline() > self.min_idle_slack:
+            _, func = self._deferred.popitem(last=False)
+            func()
+            self.stats.idle_tasks_run += 1
+
+        for task in self._idle_tasks:
+            if self.time_until_deadline() <= self.min_idle_slack:
+                break
+
+            if task.next_run < time.time():
+                self._run_task(task)
+
+    def _run_task(self, task):
+        task.next_run = time.time() + task.interval
+        task.func()
+        self.stats.idle_tasks_run += 1
+
+    def report(self):
+        self.last_report = self.stats
+        self.stats = FrameStats()
+
+        stats = self.last_report.get_dict()
+
+        if stats["frames"]:
+            print("FrameScheduler: {} frames, {} overruns, {} skipped deadlines, slack min {:.1f}ms mean {:.1f}ms, "
+                  "longest frame {:.1f}ms, {} idle jobs".format(stats["frames"], stats["overruns"], stats["skipped_deadlines"],
+                                                              stats["min_slack"] * 1000, stats["mean_slack"] * 1000,
+                                                              stats["max_frame_time"] * 1000, stats["idle_tasks_run"]))
+
+    def shut_down(self):
+        # anything still deferred, e.g. calibration saves, must not be lost
+        while self._deferred:
+            _, func = self._deferred.popitem(last=False)
+            func()
+
+        if self._manage_gc:
+            gc.enable()
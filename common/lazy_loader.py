@@ -0,0 +1,87 @@
+from time import perf_counter
+import importlib
+import importlib.util
+import sys
+
+
+# Keeps the slow or optional imports (opencv, imageio, pyserial, bitarray, the opc client) out of startup until
+# something actually needs them, and remembers what got loaded when and how long it took, so the boot report shows
+# what a config is costing us.
+class LoadReport:
+    def __init__(self):
+        # (module, seconds, why it was needed), in the order they were loaded
+        self.loads = list()
+        self._start = perf_counter()
+
+    def record(self, module_name, seconds, reason):
+        self.loads.append((module_name, seconds, reason))
+
+    def format_report(self):
+        lines = ["{:<50} {:>9}  {}".format("module", "ms", "needed for")]
+
+        for module_name, seconds, reason in self.loads:
+            lines.append("{:<50} {:>9.1f}  {}".format(module_name, seconds * 1000, reason))
+
+        lines.append("{} lazy imports took {:.0f}ms, {:.0f}ms since startup".format(
+                     len(self.loads), sum(seconds for _, seconds, _ in self.loads) * 1000, (perf_counter() - self._start) * 1000))
+
+        return "\n".join(lines)
+
+    def report(self):
+        print(self.format_report())
+
+
+load_report = LoadReport()
+
+
+def import_module(module_name, reason):
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    start = perf_counter()
+
+    try:
+        module = importlib.import_module(module_name)
+
+    except ImportError as e:
+        raise Exception("Pyzzazz: {} needs {}, which couldn't be imported: {}".format(reason, module_name, e))
+
+    load_report.record(module_name, perf_counter() - start, reason)
+
+    return module
+
+
+# for things we can do without, e.g. numba. None if the module isn't installed
+def import_optional_module(module_name, reason):
+    if module_name not in sys.modules and importlib.util.find_spec(module_name) is None:
+        return None
+
+    return import_module(module_name, reason)
+
+
+# types named in the config, e.g. senders, mapped to where they're defined as "module:attribute". a type's module is
+# only imported the first time a config asks for one
+class LazyRegistry:
+    def __init__(self, kind):
+        self.kind = kind
+        self._targets = dict()
+        self._loaded = dict()
+
+    def register(self, name, target):
+        if name in self._targets.keys():
+            raise Exception("LazyRegistry: {} type {} is already registered".format(self.kind, name))
+
+        self._targets[name] = target
+
+    def names(self):
+        return list(self._targets.keys())
+
+    def get(self, name):
+        if name not in self._loaded.keys():
+            if name not in self._targets.keys():
+                raise Exception("Unknown {} type {}".format(self.kind, name))
+
+            module_name, attribute = self._targets[name].split(":")
+            self._loaded[name] = getattr(import_module(module_name, "{} type {}".format(self.kind, name)), attribute)
+
+        return self._loaded[name]
@@ -0,0 +1,361 @@
+import argparse
+import copy
+import json
+import math
+
+# Lays fixtures out across the usb serial boards' lines so that no one board holds up the installation. An octo sender
+# board reads a frame over serial, then clocks all of its lines out in parallel, so its frame time is roughly
+#   (bytes of every line + packet overhead) / serial rate + bytes of its longest line * 8 / wire bit rate
+# and we want the worst board's time as low as it will go. Fixtures too long for a line, or long enough to hold up
+# their board, are split across lines where their wiring allows it.
+#
+#   python -m common.line_planner conf/elephant_conf.json --output conf/planned_conf.json
+
+packet_overhead = 4
+
+# what the octo sender firmware does, boards can override any of these in their sender config
+default_leds_per_line = 200
+default_bytes_per_second = 1000000
+default_bit_rate = 800000
+default_fps = 30
+
+
+def get_num_pixels(fixture_conf):
+    geometry = fixture_conf.get("geometry", "")
+
+    if geometry == "dodecahedron":
+        return 60
+
+    if geometry == "bunting_polygon":
+        return fixture_conf.get("leds_per_strand") * fixture_conf.get("num_strands")
+
+    return fixture_conf.get("num_pixels", 0)
+
+
+# the smallest run of pixels a fixture can be cut into, or 0 if its wiring can't be split at all. bunting can only be
+# cut between strands, a cylinder's strip can be cut anywhere and a dodecahedron is wired as one piece
+def get_split_step(fixture_conf):
+    if "split_step" in fixture_conf.keys():
+        return fixture_conf["split_step"]
+
+    geometry = fixture_conf.get("geometry", "")
+
+    if geometry == "bunting_polygon":
+        return fixture_conf.get("leds_per_strand")
+
+    if geometry == "cylinder":
+        return 1
+
+    return 0
+
+
+# fixtures' sender entries are lists or dicts, see handlers/patch_map.py
+def get_sender_name(entry):
+    return entry["sender"] if isinstance(entry, dict) else entry[0]
+
+
+class Segment:
+    def __init__(self, fixture_name, first_pixel, num_pixels, bytes_per_pixel, whole):
+        self.fixture_name = fixture_name
+        self.first_pixel = first_pixel
+        self.num_pixels = num_pixels
+        self.num_bytes = num_pixels * bytes_per_pixel
+        self.whole = whole
+
+
+class Board:
+    def __init__(self, sender_conf):
+        self.name = sender_conf["name"]
+        self.num_lines = sender_conf.get("num_lines", 8)
+        self.max_line_bytes = sender_conf.get("leds_per_line", default_leds_per_line) * 3
+        self.bytes_per_second = sender_conf.get("bytes_per_second", default_bytes_per_second)
+        self.bit_rate = sender_conf.get("bit_rate", default_bit_rate)
+        self.fps = sender_conf.get("fps", default_fps)
+
+        self.segments = list()
+
+    def has_free_line(self):
+        return len(self.segments) < self.num_lines
+
+    def get_frame_time(self, segments=None):
+        segments = self.segments if segments is None else segments
+
+        if not segments:
+            return 0.0
+
+        serial_time = sum(segment.num_bytes + packet_overhead for segment in segments) / self.bytes_per_second
+        show_time = max(segment.num_bytes for segment in segments) * 8 / self.bit_rate
+
+        return serial_time + show_time
+
+    # as fast as the link and wire allow, before the firmware's own frame rate caps it
+    def get_max_fps(self):
+        frame_time = self.get_frame_time()
+        return 1.0 / frame_time if frame_time else math.inf
+
+    def get_projected_fps(self):
+        return min(self.fps, self.get_max_fps())
+
+
+class LinePlan:
+    def __init__(self, boards, fixture_confs):
+        self.boards = boards
+        self.fixture_confs = fixture_confs
+
+
+def is_planned(fixture_conf, board_names):
+    return fixture_conf.get("type", "") == "led" and any(get_sender_name(entry) in board_names
+                                                         for entry in fixture_conf.get("senders", []))
+
+
+# cut a fixture into num_pieces runs as even as its split step allows, or None if it can't be
+def split_fixture(fixture_conf, num_pieces):
+    num_pixels = get_num_pixels(fixture_conf)
+    bytes_per_pixel = len(fixture_conf.get("channel_order", "rgb"))
+
+    if num_pieces == 1:
+        return [Segment(fixture_conf["name"], 0, num_pixels, bytes_per_pixel, True)]
+
+    step = get_split_step(fixture_conf)
+    num_units = math.ceil(num_pixels / step) if step else 1
+
+    if num_pieces > num_units:
+        return None
+
+    bounds = list(min(num_pixels, round(i * num_units / num_pieces) * step) for i in range(num_pieces + 1))
+
+    return list(Segment(fixture_conf["name"], start, end - start, bytes_per_pixel, False)
+                for start, end in zip(bounds[:-1], bounds[1:]))
+
+
+def assign(segments, boards):
+    for board in boards:
+        board.segments = list()
+
+    # longest first, each onto whichever board it slows down least
+    for segment in sorted(segments, key=lambda s: s.num_bytes, reverse=True):
+        candidates = list(board for board in boards if board.has_free_line() and segment.num_bytes <= board.max_line_bytes)
+
+        if not candidates:
+            raise Exception("LinePlanner: no free line for {} pixels {}-{}".format(segment.fixture_name, segment.first_pixel,
+                                                                                  segment.first_pixel + segment.num_pixels - 1))
+
+        best = min(candidates, key=lambda board: (board.get_frame_time(board.segments + [segment]), board.get_frame_time()))
+        best.segments.append(segment)
+
+    improve(boards)
+
+
+# greedy placement can leave the worst board with something another board could take. keep moving or swapping
+# segments off it while that brings the worst time down
+def improve(boards, max_passes=100):
+    for _ in range(max_passes):
+        worst = max(boards, key=lambda board: board.get_frame_time())
+        worst_time = worst.get_frame_time()
+        best_move = None
+
+        for other in boards:
+            if other is worst:
+                continue
+
+            for segment in worst.segments:
+                remaining = list(s for s in worst.segments if s is not segment)
+
+                if other.has_free_line() and segment.num_bytes <= other.max_line_bytes:
+                    new_time = max(worst.get_frame_time(remaining), other.get_frame_time(other.segments + [segment]))
+
+                    if new_time < worst_time and (best_move is None or new_time < best_move[0]):
+                        best_move = (new_time, other, segment, None)
+
+                for swap in other.segments:
+                    if segment.num_bytes > other.max_line_bytes or swap.num_bytes > worst.max_line_bytes:
+                        continue
+
+                    new_time = max(worst.get_frame_time(remaining + [swap]),
+                                   other.get_frame_time(list(s for s in other.segments if s is not swap) + [segment]))
+
+                    if new_time < worst_time and (best_move is None or new_time < best_move[0]):
+                        best_move = (new_time, other, segment, swap)
+
+        if best_move is None:
+            return
+
+        _, other, segment, swap = best_move
+        worst.segments.remove(segment)
+        other.segments.append(segment)
+
+        if swap is not None:
+            other.segments.remove(swap)
+            worst.segments.append(swap)
+
+
+def plan_lines(sender_confs, fixture_confs, split=True):
+    boards = list(Board(conf) for conf in sender_confs if conf.get("type", "") == "usb_serial")
+    board_names = set(board.name for board in boards)
+
+    if not boards:
+        raise Exception("LinePlanner: config has no usb_serial senders to plan for")
+
+    planned = list(conf for conf in fixture_confs if is_planned(conf, board_names))
+    total_lines = sum(board.num_lines for board in boards)
+    max_line_bytes = max(board.max_line_bytes for board in boards)
+
+    # as few pieces as fit a line
+    pieces = dict()
+
+    for conf in planned:
+        num_pieces = 1
+
+        while max(segment.num_bytes for segment in split_fixture(conf, num_pieces)) > max_line_bytes:
+            num_pieces += 1
+
+            if split_fixture(conf, num_pieces) is None:
+                raise Exception("LinePlanner: {} is too long for a line and can't be split further".format(conf["name"]))
+
+        pieces[conf["name"]] = num_pieces
+
+    def get_segments():
+        return list(segment for conf in planned for segment in split_fixture(conf, pieces[conf["name"]]))
+
+    segments = get_segments()
+
+    if len(segments) > total_lines:
+        raise Exception("LinePlanner: {} fixture runs won't fit on {} lines".format(len(segments), total_lines))
+
+    assign(segments, boards)
+
+    # then keep cutting the longest line while there are lines to spare and it brings the worst board down
+    while split and len(segments) < total_lines:
+        worst_time = max(board.get_frame_time() for board in boards)
+        confs_by_name = dict((conf["name"], conf) for conf in planned)
+
+        for longest in sorted(segments, key=lambda s: s.num_bytes, reverse=True):
+            if split_fixture(confs_by_name[longest.fixture_name], pieces[longest.fixture_name] + 1) is not None:
+                break
+        else:
+            break
+
+        pieces[longest.fixture_name] += 1
+        candidate = get_segments()
+
+        if len(candidate) > total_lines:
+            pieces[longest.fixture_name] -= 1
+            break
+
+        previous = dict((board.name, board.segments) for board in boards)
+        assign(candidate, boards)
+
+        if max(board.get_frame_time() for board in boards) >= worst_time * 0.99:
+            pieces[longest.fixture_name] -= 1
+
+            for board in boards:
+                board.segments = previous[board.name]
+
+            break
+
+        segments = candidate
+
+    return LinePlan(boards, get_fixture_confs(fixture_confs, boards, board_names))
+
+
+def get_fixture_confs(fixture_confs, boards, board_names):
+    entries = dict()
+
+    for board in boards:
+        order = list(conf.get("name") for conf in fixture_confs)
+        board.segments.sort(key=lambda s: (order.index(s.fixture_name), s.first_pixel))
+
+        for line, segment in enumerate(board.segments):
+            entry = [board.name, line] if segment.whole else [board.name, line, segment.first_pixel, segment.num_pixels]
+            entries.setdefault(segment.fixture_name, list()).append((segment.first_pixel, entry))
+
+    planned_confs = list()
+
+    for conf in fixture_confs:
+        conf = copy.deepcopy(conf)
+
+        if conf.get("name") in entries.keys():
+            kept = list(entry for entry in conf.get("senders", []) if get_sender_name(entry) not in board_names)
+            conf["senders"] = kept + list(entry for _, entry in sorted(entries[conf["name"]], key=lambda e: e[0]))
+
+        planned_confs.append(conf)
+
+    return planned_confs
+
+
+# what the config as written would manage, for comparison
+def project_current(sender_confs, fixture_confs):
+    boards = list(Board(conf) for conf in sender_confs if conf.get("type", "") == "usb_serial")
+    boards_by_name = dict((board.name, board) for board in boards)
+
+    for conf in fixture_confs:
+        num_pixels = get_num_pixels(conf)
+        bytes_per_pixel = len(conf.get("channel_order", "rgb"))
+
+        for entry in conf.get("senders", []):
+            if get_sender_name(entry) not in boards_by_name.keys():
+                continue
+
+            if isinstance(entry, dict):
+                first_pixel = entry.get("first_pixel", 0)
+                count = entry.get("num_pixels", None)
+            else:
+                first_pixel = entry[2] if len(entry) > 2 else 0
+                count = entry[3] if len(entry) > 3 else None
+
+            count = num_pixels - first_pixel if count is None else count
+            boards_by_name[get_sender_name(entry)].segments.append(Segment(conf["name"], first_pixel, count, bytes_per_pixel,
+                                                                           count == num_pixels))
+
+    return boards
+
+
+def format_report(boards):
+    lines = ["{:<20} {:>6} {:>11} {:>10} {:>9} {:>9} {:>9} {:>6}".format("board", "lines", "bytes/frame", "longest", "serial ms",
+                                                                          "show ms", "max fps", "fps")]
+
+    for board in boards:
+        serial_bytes = sum(segment.num_bytes + packet_overhead for segment in board.segments)
+        longest = max((segment.num_bytes for segment in board.segments), default=0)
+        overlong = " over line limit" if longest > board.max_line_bytes else ""
+
+        lines.append("{:<20} {:>3}/{:<2} {:>11} {:>10} {:>9.2f} {:>9.2f} {:>9.1f} {:>6.1f}{}".format(
+                     board.name, len(board.segments), board.num_lines, serial_bytes, longest,
+                     serial_bytes * 1000 / board.bytes_per_second, longest * 8000 / board.bit_rate, board.get_max_fps(),
+                     board.get_projected_fps(), overlong))
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Balance fixtures across usb serial boards' lines")
+    parser.add_argument("config")
+    parser.add_argument("--output", help="write the planned config here rather than to stdout")
+    parser.add_argument("--no-split", action="store_true", help="only split fixtures too long to fit a line")
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        config = json.load(file)
+
+    print("as configured:")
+    print(format_report(project_current(config.get("Senders", []), config.get("Fixtures", []))))
+
+    plan = plan_lines(config.get("Senders", []), config.get("Fixtures", []), split=not args.no_split)
+
+    print("\nplanned:")
+    print(format_report(plan.boards))
+
+    config["Fixtures"] = plan.fixture_confs
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(config, file, indent=2)
+
+        print("\nwrote {}".format(args.output))
+
+    else:
+        print(json.dumps(config, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+from common.lazy_loader import import_module
+import importlib.metadata
+
+
+# One implementation of a pattern or overlay. target is where it's defined, as "module:attribute", or the class itself
+# when it was registered with the plugin decorator. Metadata not given when registering is read off the class, which
+# means importing it, so built in implementations give theirs up front.
+class PluginInfo:
+    def __init__(self, kind, name, target, requires=None, cost=None, batched=None):
+        self.kind = kind
+        self.name = name
+        self.target = target
+        self._metadata = {"requires": requires, "cost": cost, "batched": batched}
+        self._loaded = None if isinstance(target, str) else target
+
+    def get_target_name(self):
+        if isinstance(self.target, str):
+            return self.target
+
+        return "{}:{}".format(self.target.__module__, self.target.__qualname__)
+
+    def load(self):
+        if self._loaded is None:
+            module_name, attribute = self.target.split(":")
+            self._loaded = getattr(import_module(module_name, "{} {}".format(self.kind, self.name)), attribute)
+
+        return self._loaded
+
+    def get(self, key):
+        if self._metadata[key] is None:
+            self._metadata[key] = getattr(self.load(), key)
+
+        return self._metadata[key]
+
+    # geometry features the fixture has to have, e.g. "video"
+    def get_requires(self):
+        return frozenset(self.get("requires"))
+
+    # rough microseconds per led per frame
+    def get_cost(self):
+        return self.get("cost")
+
+    # whether it works on all of a fixture's leds as arrays, rather than looping over them in python
+    def get_batched(self):
+        return self.get("batched")
+
+
+# Patterns and overlays by the name commands give them. A name can have more than one implementation, e.g. a faster
+# or experimental one next to the original, and each fixture gets the cheapest one it has the geometry for. Nothing is
+# imported until a config asks for it.
+#
+# Besides what's registered here, installed packages can add their own under the entry point group, e.g.
+#   [project.entry-points."pyzzazz.patterns"]
+#   lava = "pyzzazz_lava:Lava"
+# and modules imported some other way can use the plugin decorator.
+class PluginRegistry:
+    def __init__(self, kind, entry_point_group=None):
+        self.kind = kind
+        self.entry_point_group = entry_point_group
+        self._plugins = dict()
+        self._entry_points_loaded = entry_point_group is None
+
+    def register(self, name, target, requires=None, cost=None, batched=None):
+        plugin = PluginInfo(self.kind, name, target, requires=requires, cost=cost, batched=batched)
+        implementations = self._plugins.setdefault(name, list())
+
+        if any(existing.get_target_name() == plugin.get_target_name() for existing in implementations):
+            raise Exception("PluginRegistry: {} {} is already registered".format(self.kind, plugin.get_target_name()))
+
+        implementations.append(plugin)
+
+        return plugin
+
+    def plugin(self, name, requires=None, cost=None, batched=None):
+        def decorate(cls):
+            self.register(name, cls, requires=requires, cost=cost, batched=batched)
+            return cls
+
+        return decorate
+
+    def _load_entry_points(self):
+        if self._entry_points_loaded:
+            return
+
+        self._entry_points_loaded = True
+
+        try:
+            entry_points = importlib.metadata.entry_points(group=self.entry_point_group)
+
+        except TypeError:
+            # before python 3.10
+            entry_points = importlib.metadata.entry_points().get(self.entry_point_group, [])
+
+        for entry_point in entry_points:
+            self.register(entry_point.name, entry_point.value)
+
+    def names(self):
+        self._load_entry_points()
+
+        return list(self._plugins.keys())
+
+    def get_implementations(self, name):
+        self._load_entry_points()
+
+        if name not in self._plugins.keys():
+            raise Exception("Unknown {} type {}".format(self.kind, name))
+
+        return list(self._plugins[name])
+
+    # cheapest first, and anything that loops over leds in python after anything that doesn't
+    def choose(self, name, features=(), owner="the fixture"):
+        implementations = self.get_implementations(name)
+        candidates = list(plugin for plugin in implementations if plugin.get_requires() <= set(features))
+
+        if not candidates:
+            requirements = " or ".join(", ".join(sorted(plugin.get_requires())) for plugin in implementations)
+            raise Exception("{} {} needs {}, which {} doesn't have".format(self.kind.capitalize(), name, requirements, owner))
+
+        return min(candidates, key=lambda plugin: (plugin.get_cost(), not plugin.get_batched()))
+
+    def get(self, name, features=(), owner="the fixture"):
+        return self.choose(name, features, owner).load()
@@ -0,0 +1,168 @@
+from collections import deque
+import numpy as np
+import threading
+import json
+import time
+import os
+
+
+# Times stages of the frame (video decode, patterns, overlays, byte encoding, sends) and keeps the last few hundred
+# durations of each so we can see where a dropped frame went. Call sites look like
+#
+#     if profiler.enabled:
+#         profiler.timed("pattern", name, pattern.update, leds)
+#     else:
+#         pattern.update(leds)
+#
+# so turned off it costs one attribute check per stage and nothing else, not even formatting the name. Turning it on or off only
+# takes effect at the start of the next frame, so a stage can never see enabled change half way through.
+class Profiler:
+    def __init__(self, window=300, report_top=15, trace_frames=150, trace_dir="."):
+        self.enabled = False
+        self._enable_requested = False
+
+        # durations of the last window runs of each stage, keyed by (category, name)
+        self.window = window
+        self.report_top = report_top
+        self._stages = dict()
+
+        self._frame_start = 0.0
+
+        self.trace_frames = trace_frames
+        self.trace_dir = trace_dir
+        self._trace_events = None
+        self._trace_frames_left = 0
+        self._trace_path = None
+        self._trace_lock = threading.Lock()
+
+    def configure(self, settings):
+        self.window = settings.get("window", self.window)
+        self.report_top = settings.get("report_top", self.report_top)
+        self.trace_frames = settings.get("trace_frames", self.trace_frames)
+        self.trace_dir = settings.get("trace_dir", self.trace_dir)
+        self._stages = dict()
+
+        self.set_enabled(settings.get("enabled", False))
+
+    def set_enabled(self, enabled):
+        self._enable_requested = enabled
+
+    def toggle(self):
+        self.set_enabled(not self._enable_requested)
+        print("Profiler: {}".format("on from the next frame" if self._enable_requested else "off"))
+
+    # record chrome trace events for the next num_frames frames then write them to path, which can be opened in
+    # chrome://tracing or ui.perfetto.dev. turns the profiler on if it wasn't already
+    def capture_trace(self, num_frames=None, path=None):
+        if num_frames is None:
+            num_frames = self.trace_frames
+
+        if path is None:
+            path = os.path.join(self.trace_dir, "trace_{}.json".format(time.strftime("%Y%m%d_%H%M%S")))
+
+        with self._trace_lock:
+            self._trace_events = list()
+            self._trace_frames_left = num_frames
+            self._trace_path = path
+
+        self.set_enabled(True)
+        print("Profiler: tracing the next {} frames to {}".format(num_frames, path))
+
+    def start_frame(self):
+        self.enabled = self._enable_requested
+
+        if self.enabled:
+            self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+
+        self.record("frame", "total", self._frame_start)
+
+        if self._trace_events is not None:
+            self._trace_frames_left -= 1
+
+            if self._trace_frames_left <= 0:
+                self.write_trace()
+
+    # calls function(*args) and records how long it took, for call sites that have already checked enabled
+    def timed(self, category, name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.record(category, name, start)
+
+        return result
+
+    # start is a time.perf_counter() from just before the stage
+    def record(self, category, name, start):
+        end = time.perf_counter()
+        key = (category, name)
+
+        durations = self._stages.get(key, None)
+
+        if durations is None:
+            # setdefault so two render threads meeting a new stage at once share one deque
+            durations = self._stages.setdefault(key, deque(maxlen=self.window))
+
+        durations.append(end - start)
+
+        # take our own reference, write_trace may swap the list out from another thread
+        trace_events = self._trace_events
+
+        if trace_events is not None:
+            trace_events.append({"name": name,
+                                 "cat": category,
+                                 "ph": "X",
+                                 "ts": start * 1e6,
+                                 "dur": (end - start) * 1e6,
+                                 "pid": os.getpid(),
+                                 "tid": threading.get_ident()})
+
+    def get_stats(self):
+        stats = dict()
+
+        for key, durations in list(self._stages.items()):
+            samples = np.array(durations)
+
+            if len(samples):
+                p50, p99 = np.percentile(samples, [50, 99])
+                stats[key] = {"count": len(samples), "total": samples.sum(), "p50": p50, "p99": p99, "max": samples.max()}
+
+        return stats
+
+    def report(self):
+        if not self.enabled:
+            return
+
+        stats = self.get_stats()
+
+        if not stats:
+            return
+
+        print("Profiler: slowest stages over the last {} runs of each".format(self.window))
+        print("    {:<14} {:<40} {:>9} {:>9} {:>9}".format("stage", "name", "p50 ms", "p99 ms", "max ms"))
+
+        for (category, name), stage in sorted(stats.items(), key=lambda item: item[1]["p99"], reverse=True)[:self.report_top]:
+            print("    {:<14} {:<40} {:>9.3f} {:>9.3f} {:>9.3f}".format(category, name[:40], stage["p50"] * 1000,
+                                                                      stage["p99"] * 1000, stage["max"] * 1000))
+
+    def write_trace(self):
+        with self._trace_lock:
+            events = self._trace_events
+            path = self._trace_path
+
+            self._trace_events = None
+            self._trace_frames_left = 0
+
+        if events is None:
+            return
+
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+        print("Profiler: wrote {} trace events to {}".format(len(events), path))
+
+
+# one per process, so stages anywhere in the render path can be timed without threading it through every constructor
+profiler = Profiler()
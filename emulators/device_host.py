@@ -0,0 +1,85 @@
+import multiprocessing
+import selectors
+import signal
+import time
+
+
+# runs a set of emulated devices in one forked process, so they drain their ports as real hardware would rather than
+# whenever the process under test lets them. devices need register(selector), tick(now), get_stats() and close()
+class DeviceHost:
+    def __init__(self, tick_interval=0.002):
+        self.devices = list()
+        self.tick_interval = tick_interval
+
+        self._conn = None
+        self._process = None
+
+    def add(self, device):
+        self.devices.append(device)
+        return device
+
+    def start(self):
+        context = multiprocessing.get_context("fork")
+        self._conn, child_conn = context.Pipe()
+
+        self._process = context.Process(target=self._serve, args=(child_conn,), daemon=True)
+        self._process.start()
+
+    def _serve(self, conn):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        # drop our copy of the host's end, so we see eof and exit if the host dies without stopping us
+        self._conn.close()
+
+        selector = selectors.DefaultSelector()
+        selector.register(conn, selectors.EVENT_READ, None)
+
+        for device in self.devices:
+            device.register(selector)
+
+        while True:
+            for key, _ in selector.select(self.tick_interval):
+                if key.data is not None:
+                    key.data(selector)
+                    continue
+
+                try:
+                    message = conn.recv()
+
+                except EOFError:
+                    return
+
+                if message == "stats":
+                    conn.send(dict((device.name, device.get_stats()) for device in self.devices))
+
+                elif message == "stop":
+                    return
+
+            now = time.time()
+
+            for device in self.devices:
+                device.tick(now)
+
+    def get_stats(self):
+        self._conn.send("stats")
+        return self._conn.recv()
+
+    def stop(self):
+        if self._process is None:
+            return
+
+        try:
+            self._conn.send("stop")
+
+        except (BrokenPipeError, EOFError):
+            pass
+
+        self._process.join(timeout=1.0)
+
+        if self._process.is_alive():
+            self._process.terminate()
+
+        self._process = None
+
+        for device in self.devices:
+            device.close()
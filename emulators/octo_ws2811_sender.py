@@ -0,0 +1,206 @@
+from emulators.pty_device import PtyDevice
+from handlers.packet_handler import CommHeader
+from handlers.packet_handler import NameReplyPayload
+import numpy as np
+import zlib
+import re
+
+# Emulates firmwares/octo_ws2811_sender: eight strips of leds_per_strip leds, fed by frame_update packets of the form
+#   ~ 0x04 <strip> <r g b ...> |
+# with the pixel bytes kept clear of both sentinels. Like the firmware it only reads serial between shows, and a show
+# holds it up for as long as it takes to clock a full strip out at 800kHz.
+
+frame_start = ord("~")
+frame_end = ord("|")
+
+op_name_request = CommHeader.ops_by_str["name_request"]
+op_frame_update = CommHeader.ops_by_str["frame_update"]
+
+awaiting_strip_id = 0
+awaiting_opcode = 1
+reading_frame = 2
+between_frames = 3
+
+sentinels = re.compile(b"[~|]")
+
+
+# three 6 bit chunks of a crc, so they can never collide with either sentinel
+def frame_checksum(data):
+    crc = zlib.crc32(bytes(data))
+    return bytes(((crc >> 12) & 0x3f, (crc >> 6) & 0x3f, crc & 0x3f))
+
+
+# for hosts that want every frame checked, append the result to the pixel bytes as one extra led
+def add_checksum(data):
+    return bytes(data) + frame_checksum(data)
+
+
+class LineStats:
+    def __init__(self):
+        self.frames_received = 0
+        self.frames_shown = 0
+        self.checksum_failures = 0
+        self.overlong = 0
+        self.ragged = 0
+        self.first_frame = None
+        self.last_frame = None
+        self.pending = False
+
+    # rates are over the time frames were actually arriving, so they don't sag once the host stops sending
+    def get_dict(self):
+        elapsed = self.last_frame - self.first_frame if self.frames_received > 1 else 0.0
+
+        return {"frames_received": self.frames_received,
+                "frames_shown": self.frames_shown,
+                "received_fps": (self.frames_received - 1) / elapsed if elapsed > 0 else 0.0,
+                "shown_fps": self.frames_shown / elapsed if elapsed > 0 else 0.0,
+                "checksum_failures": self.checksum_failures,
+                "overlong": self.overlong,
+                "ragged": self.ragged}
+
+
+class OctoWs2811SenderEmulator(PtyDevice):
+    max_strip_id = 7
+
+    # a teensy 3 manages about 1MB/s over usb serial in practice
+    def __init__(self, name, device_dir, port_name, leds_per_strip=200, fps=30, bytes_per_second=1000000,
+                 bit_rate=800000, checksummed=False):
+        PtyDevice.__init__(self, name, device_dir, port_name, bytes_per_second)
+
+        self.leds_per_strip = leds_per_strip
+        self.checksummed = checksummed
+
+        self.show_interval = 1.0 / fps
+        self.show_time = leds_per_strip * 24 / bit_rate
+        self._next_show = None
+
+        self.strips = np.zeros((self.max_strip_id + 1, leds_per_strip, 3), dtype=np.uint8)
+        self.lines = dict()
+
+        self._state = between_frames
+        self._strip_id = 0
+        self._frame = bytearray()
+
+        self._name_reply = CommHeader(msgtype="name_reply", payload_len=len(name)).get_bytes() + NameReplyPayload(name=name).get_bytes()
+
+        self.name_requests = 0
+        self.bad_strip_ids = 0
+        self.interrupted_frames = 0
+
+    def handle_bytes(self, data, now):
+        index = 0
+
+        while index < len(data):
+            if self._state == reading_frame:
+                # pixel bytes can't be sentinels, so take everything up to the next one in one go
+                match = sentinels.search(data, index)
+                end = match.start() if match else len(data)
+
+                self._frame.extend(data[index:end])
+                index = end
+
+                if index == len(data):
+                    break
+
+            symbol = data[index]
+            index += 1
+
+            if symbol == frame_start:
+                if self._state == reading_frame:
+                    self.interrupted_frames += 1
+
+                self._state = awaiting_opcode
+                self._frame.clear()
+
+            elif symbol == frame_end:
+                if self._state == reading_frame:
+                    self._end_frame(now)
+
+                self._state = between_frames
+
+            elif self._state == awaiting_opcode:
+                if symbol == op_name_request:
+                    self.name_requests += 1
+                    self.write(self._name_reply)
+                    self._state = between_frames
+
+                elif symbol == op_frame_update:
+                    self._state = awaiting_strip_id
+
+                else:
+                    self._state = between_frames
+
+            elif self._state == awaiting_strip_id:
+                self._strip_id = symbol
+                self._state = reading_frame
+
+            else:
+                # between frames, skip straight to the next start
+                next_start = data.find(b"~", index)
+                index = next_start if next_start >= 0 else len(data)
+
+    def _end_frame(self, now):
+        # the firmware would happily write past its last strip, we just count it
+        if self._strip_id > self.max_strip_id:
+            self.bad_strip_ids += 1
+            return
+
+        line = self.lines.get(self._strip_id, None)
+
+        if line is None:
+            line = self.lines[self._strip_id] = LineStats()
+
+        data = self._frame
+
+        if self.checksummed:
+            if len(data) < 3 or frame_checksum(data[:-3]) != bytes(data[-3:]):
+                line.checksum_failures += 1
+                return
+
+            data = data[:-3]
+
+        if len(data) % 3:
+            line.ragged += 1
+
+        num_leds = len(data) // 3
+
+        if num_leds > self.leds_per_strip:
+            line.overlong += 1
+            num_leds = self.leds_per_strip
+
+        self.strips[self._strip_id, :num_leds] = np.frombuffer(bytes(data[:num_leds * 3]), dtype=np.uint8).reshape(-1, 3)
+
+        if line.first_frame is None:
+            line.first_frame = now
+
+        line.frames_received += 1
+        line.last_frame = now
+        line.pending = True
+
+    def tick(self, now):
+        if self._next_show is None:
+            self._next_show = now + self.show_interval
+
+        if now >= self._next_show:
+            self._next_show = max(self._next_show + self.show_interval, now)
+
+            # a line only shows a new frame if one finished arriving since the last show, any others were overwritten
+            for line in self.lines.values():
+                if line.pending:
+                    line.frames_shown += 1
+                    line.pending = False
+
+            # show waits for the last dma transfer, which is a whole strip of leds at the wire's bit rate
+            self.stall(now, self.show_time)
+
+        PtyDevice.tick(self, now)
+
+    def get_stats(self):
+        stats = PtyDevice.get_stats(self)
+        stats["name_requests"] = self.name_requests
+        stats["bad_strip_ids"] = self.bad_strip_ids
+        stats["interrupted_frames"] = self.interrupted_frames
+        stats["frames"] = sum(line.frames_received for line in self.lines.values())
+        stats["lines"] = dict((strip_id, line.get_dict()) for strip_id, line in sorted(self.lines.items()))
+
+        return stats
@@ -0,0 +1,127 @@
+import selectors
+import time
+import tty
+import pty
+import sys
+import os
+
+
+# named like the boards the kernel enumerates, so UsbSerialHandler's default port keyword picks them up
+def default_port_name(index):
+    return "{}{}".format("tty.usbmodem" if sys.platform == "darwin" else "ttyACM", index)
+
+
+# a pseudo terminal pretending to be a usb serial board. the slave end is linked into device_dir under port_name for
+# pyzzazz to find, and we play the board on the master end. bytes_per_second caps how fast we take bytes off the line,
+# so a host that writes faster than a real board could drain finds its writes backing up as they would for real
+class PtyDevice:
+    def __init__(self, name, device_dir, port_name, bytes_per_second=None):
+        self.name = name
+
+        self.master, self._slave = pty.openpty()
+
+        # no echo or line discipline, bytes go through untouched
+        tty.setraw(self._slave)
+        os.set_blocking(self.master, False)
+
+        self.port = os.path.join(device_dir, port_name)
+        os.symlink(os.ttyname(self._slave), self.port)
+
+        # about 10ms of line time can arrive in one go, the rest waits its turn
+        self.bytes_per_second = bytes_per_second
+        self._burst = max(512, bytes_per_second // 100) if bytes_per_second else 1 << 16
+        self._allowance = self._burst
+        self._last_refill = time.time()
+
+        # the board is busy doing something other than reading serial until then, e.g. clocking out leds
+        self._busy_until = 0.0
+
+        self._selector = None
+        self._reading = False
+
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._outbound = bytearray()
+
+    def register(self, selector):
+        self._selector = selector
+        self._set_reading(True)
+
+    def _set_reading(self, reading):
+        if reading == self._reading:
+            return
+
+        if reading:
+            self._selector.register(self.master, selectors.EVENT_READ, lambda selector: self.on_readable(time.time()))
+        else:
+            self._selector.unregister(self.master)
+
+        self._reading = reading
+
+    def _get_read_budget(self, now):
+        if now < self._busy_until:
+            return 0
+
+        if not self.bytes_per_second:
+            return 1 << 16
+
+        self._allowance = min(self._burst, self._allowance + (now - self._last_refill) * self.bytes_per_second)
+        self._last_refill = now
+
+        return int(self._allowance)
+
+    def stall(self, now, duration):
+        self._busy_until = max(self._busy_until, now + duration)
+
+    def on_readable(self, now):
+        budget = self._get_read_budget(now)
+
+        if budget <= 0:
+            # stop the host spinning on us until tick says we can take more
+            self._set_reading(False)
+            return
+
+        try:
+            data = os.read(self.master, budget)
+
+        except (BlockingIOError, OSError):
+            # EIO until pyzzazz has the slave open
+            return
+
+        self._allowance -= len(data)
+        self.bytes_received += len(data)
+        self.handle_bytes(data, now)
+
+    def write(self, data):
+        self._outbound.extend(data)
+        self.flush()
+
+    def flush(self):
+        if not self._outbound:
+            return
+
+        try:
+            written = os.write(self.master, self._outbound)
+
+        except (BlockingIOError, OSError):
+            return
+
+        self.bytes_sent += written
+        del self._outbound[:written]
+
+    def handle_bytes(self, data, now):
+        pass
+
+    def tick(self, now):
+        self._set_reading(self._get_read_budget(now) > 0)
+        self.flush()
+
+    def get_stats(self):
+        return {"bytes_received": self.bytes_received, "bytes_sent": self.bytes_sent}
+
+    def close(self):
+        try:
+            os.remove(self.port)
+
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,144 @@
+from emulators.pty_device import PtyDevice
+from handlers.packet_handler import CommHeader
+from handlers.packet_handler import ControlUpdatePayload
+from handlers.packet_handler import NameReplyPayload
+from handlers.packet_handler import StateReplyPayload
+import random
+
+# Emulates firmwares/usb_controller: a 4x4 button pad and four sliders. Answers name and state requests, and once
+# subscribed pushes button presses and slider moves as they happen plus a state snapshot every keepalive interval.
+# Nobody is pressing anything unless you call press() and move_slider(), or give it some random activity.
+
+
+class UsbControllerEmulator(PtyDevice):
+    header_len = 4
+    max_packet_len = 128
+    slider_update_threshold = 4
+
+    def __init__(self, name, device_dir, port_name, num_buttons=16, sliders=(0, 0, 0, 0),
+                 presses_per_second=0.0, slider_moves_per_second=0.0, seed=None):
+        PtyDevice.__init__(self, name, device_dir, port_name)
+
+        self.num_buttons = num_buttons
+        self.sliders = list(sliders)
+        self._last_sent_sliders = list(sliders)
+        self._pressed = set()
+
+        self.subscribed = False
+        self.keepalive_interval = 1.0
+        self._last_keepalive = 0.0
+
+        self.presses_per_second = presses_per_second
+        self.slider_moves_per_second = slider_moves_per_second
+        self._random = random.Random(seed)
+        self._last_activity = None
+
+        self._incoming = bytearray()
+        self._expected_payload_len = 0
+
+        self.name_requests = 0
+        self.state_replies = 0
+        self.control_updates = 0
+        self.dropped_packets = 0
+
+    def press(self, button):
+        self._pressed.add(button)
+
+    def move_slider(self, slider, value):
+        self.sliders[slider] = max(0, min(1023, value))
+
+    def handle_bytes(self, data, now):
+        for symbol in data:
+            # between packets, sync on the start byte
+            if not self._incoming and symbol != ord("~"):
+                continue
+
+            self._incoming.append(symbol)
+
+            if len(self._incoming) == self.header_len:
+                self._expected_payload_len = (self._incoming[2] << 8) | self._incoming[3]
+
+                # can't be one of ours, drop it and resync on the next start byte
+                if self._expected_payload_len > self.max_packet_len - self.header_len:
+                    self.dropped_packets += 1
+                    self._incoming.clear()
+                    continue
+
+            if len(self._incoming) >= self.header_len and len(self._incoming) == self.header_len + self._expected_payload_len:
+                self._parse_packet(now)
+                self._incoming.clear()
+
+    def _parse_packet(self, now):
+        op = self._incoming[1]
+
+        if op == CommHeader.ops_by_str["name_request"]:
+            self.name_requests += 1
+            payload = NameReplyPayload(name=self.name).get_bytes()
+            self.write(CommHeader(msgtype="name_reply", payload_len=len(payload)).get_bytes() + payload)
+
+        elif op == CommHeader.ops_by_str["state_request"]:
+            self._send_state_reply(now)
+
+        elif op == CommHeader.ops_by_str["subscribe"] and self._expected_payload_len == 2:
+            self.keepalive_interval = ((self._incoming[4] << 8) | self._incoming[5]) / 1000.0
+            self.subscribed = True
+
+            # snapshot straight away so the host knows where everything is
+            self._send_state_reply(now)
+
+    def _send_state_reply(self, now):
+        button_state = list(int(button in self._pressed) for button in range(self.num_buttons))
+        payload = StateReplyPayload(button_state=button_state, slider_state=self.sliders).get_bytes()
+        self.write(CommHeader(msgtype="state_reply", payload_len=len(payload)).get_bytes() + payload)
+
+        self._pressed.clear()
+        self._last_sent_sliders = list(self.sliders)
+        self._last_keepalive = now
+        self.state_replies += 1
+
+    def _send_control_updates(self):
+        updates = list(("button", button, 1) for button in sorted(self._pressed))
+
+        for slider, value in enumerate(self.sliders):
+            if abs(value - self._last_sent_sliders[slider]) >= self.slider_update_threshold:
+                updates.append(("slider", slider, value))
+                self._last_sent_sliders[slider] = value
+
+        self._pressed.clear()
+
+        if updates:
+            payload = ControlUpdatePayload(updates=updates).get_bytes()
+            self.write(CommHeader(msgtype="control_update", payload_len=len(payload)).get_bytes() + payload)
+            self.control_updates += 1
+
+    def _simulate_activity(self, now):
+        elapsed = now - self._last_activity if self._last_activity is not None else 0.0
+        self._last_activity = now
+
+        if self.presses_per_second and self._random.random() < self.presses_per_second * elapsed:
+            self.press(self._random.randrange(self.num_buttons))
+
+        if self.slider_moves_per_second and self._random.random() < self.slider_moves_per_second * elapsed:
+            slider = self._random.randrange(len(self.sliders))
+            step = self._random.randint(self.slider_update_threshold, self.slider_update_threshold * 4)
+            self.move_slider(slider, self.sliders[slider] + self._random.choice((-step, step)))
+
+    def tick(self, now):
+        self._simulate_activity(now)
+
+        if self.subscribed:
+            self._send_control_updates()
+
+            if now - self._last_keepalive > self.keepalive_interval:
+                self._send_state_reply(now)
+
+        PtyDevice.tick(self, now)
+
+    def get_stats(self):
+        stats = PtyDevice.get_stats(self)
+        stats["name_requests"] = self.name_requests
+        stats["state_replies"] = self.state_replies
+        stats["control_updates"] = self.control_updates
+        stats["dropped_packets"] = self.dropped_packets
+
+        return stats
@@ -9,6 +9,11 @@
 #define OP_NAME_REPLY (0x01)
 #define OP_STATE_REQUEST (0x02)
 #define OP_STATE_REPLY (0x03)
+#define OP_SUBSCRIBE (0x05)
+#define OP_CONTROL_UPDATE (0x06)
+
+#define CONTROL_KIND_BUTTON (0x00)
+#define CONTROL_KIND_SLIDER (0x01)
 
 #define MAX_INCOMING_PACKET_LEN (128)
 
@@ -18,6 +23,16 @@
 uint8_t incoming_buffer[MAX_INCOMING_PACKET_LEN];
 int buffer_write_index = 0;
 int header_len = 4;
+uint16_t expected_payload_len = 0;
+
+/********* SUBSCRIPTION VARIABLES **********/
+// once subscribed we push changes as they happen, plus a slider snapshot every keepalive interval
+bool subscribed = false;
+uint16_t keepalive_interval = 1000; // ms
+uint32_t last_keepalive = 0;
+
+// ignore slider jitter smaller than this when deciding whether to push an update
+const uint16_t slider_update_threshold = 4;
 
 const char board_id[] = "USB_CONTROLLER_000";
 const uint16_t board_id_len = 18;
@@ -41,6 +56,7 @@ uint16_t button_pressed_since_update = 0x0000;
 const int num_sliders = 4;
 const int slider_pins[] = {20, 21, 22, 23};
 uint16_t slider_vals[] = {0, 0, 0, 0};
+uint16_t last_sent_slider_vals[] = {0, 0, 0, 0};
 float slider_smoothing_factor = 0.7;
 
 uint8_t led_colours[NUM_COLUMNS][NUM_ROWS][NUM_COLOURS] = { { {0, 0, 0}, {0, 0, 0}, {0, 0, 0}, {0, 0, 0} },
@@ -96,6 +112,14 @@ void loop() {
   read_switches();
   read_sliders();
   handle_incoming();
+
+  if (subscribed) {
+    send_control_updates();
+
+    if (millis() - last_keepalive > keepalive_interval) {
+      send_state_reply();
+    }
+  }
 }
 
 void handle_incoming() {
@@ -106,19 +130,29 @@ void handle_incoming() {
     // if we are between packets, sync on SOP
     if (buffer_write_index != 0 || new_byte == SOP) {
       incoming_buffer[buffer_write_index++] = new_byte;
+
       if (buffer_write_index == header_len) {
+        expected_payload_len = (incoming_buffer[2]<<8) | incoming_buffer[3];
+
+        // can't be one of ours, drop it and resync on the next SOP
+        if (expected_payload_len > MAX_INCOMING_PACKET_LEN - header_len) {
+          buffer_write_index = 0;
+          continue;
+        }
+      }
+
+      if (buffer_write_index >= header_len && buffer_write_index == header_len + expected_payload_len) {
         digitalWrite(LED_BUILTIN, HIGH);
-        parse_header();
+        parse_packet();
         buffer_write_index = 0;
       }
     }
   }
 }
 
-void parse_header() {
+void parse_packet() {
   uint8_t sop = incoming_buffer[0];
   uint8_t op = incoming_buffer[1];
-  uint8_t payload_len = (incoming_buffer[2]<<8) | incoming_buffer[3];
 
   if (sop != SOP) {
     return;
@@ -131,6 +165,14 @@ void parse_header() {
   else if (op == OP_STATE_REQUEST) {
     send_state_reply();
   }
+
+  else if (op == OP_SUBSCRIBE && expected_payload_len == 2) {
+    keepalive_interval = (incoming_buffer[header_len]<<8) | incoming_buffer[header_len + 1];
+    subscribed = true;
+
+    // snapshot straight away so the host knows where everything is
+    send_state_reply();
+  }
 }
 
 void send_name_reply() {
@@ -143,6 +185,57 @@ void send_name_reply() {
   digitalWrite(LED_BUILTIN, LOW);
 }
 
+// only called while subscribed. buttons go out as soon as they're pressed, sliders once they've moved
+void send_control_updates() {
+  uint8_t num_updates = 0;
+  uint16_t num_buttons = sizeof(button_pressed_since_update) * 8;
+
+  for (uint16_t i = 0; i < num_buttons; i++) {
+    if ((button_pressed_since_update >> (num_buttons-1 - i)) & 1) {
+      num_updates++;
+    }
+  }
+
+  for (int i = 0; i < num_sliders; i++) {
+    if (abs((int)slider_vals[i] - (int)last_sent_slider_vals[i]) >= slider_update_threshold) {
+      num_updates++;
+    }
+  }
+
+  if (num_updates == 0) {
+    return;
+  }
+
+  uint16_t len = 1 + num_updates*4;
+
+  Serial.write("~");
+  Serial.write(OP_CONTROL_UPDATE);
+  Serial.write(len >> 8);
+  Serial.write(len & 0xff);
+  Serial.write(num_updates);
+
+  for (uint16_t i = 0; i < num_buttons; i++) {
+    if ((button_pressed_since_update >> (num_buttons-1 - i)) & 1) {
+      Serial.write(CONTROL_KIND_BUTTON);
+      Serial.write((uint8_t)i);
+      Serial.write((uint8_t)0);
+      Serial.write((uint8_t)1);
+    }
+  }
+
+  for (int i = 0; i < num_sliders; i++) {
+    if (abs((int)slider_vals[i] - (int)last_sent_slider_vals[i]) >= slider_update_threshold) {
+      Serial.write(CONTROL_KIND_SLIDER);
+      Serial.write((uint8_t)i);
+      Serial.write(slider_vals[i] >> 8);
+      Serial.write(slider_vals[i] & 0xff);
+      last_sent_slider_vals[i] = slider_vals[i];
+    }
+  }
+
+  button_pressed_since_update = 0x0000;
+}
+
 void send_state_reply() {
   Serial.write("~");
   Serial.write(OP_STATE_REPLY);
@@ -163,9 +256,11 @@ void send_state_reply() {
   for (int i = 0; i < num_sliders; i++) {
     Serial.write(slider_vals[i] >> 8);
     Serial.write(slider_vals[i] & 0xff);
+    last_sent_slider_vals[i] = slider_vals[i];
   }
 
   button_pressed_since_update = 0x0000;
+  last_keepalive = millis();
 }
 
 
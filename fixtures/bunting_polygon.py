@@ -8,12 +8,12 @@ import math
 
 
 class BuntingPolygon(LedFixture):
-    def __init__(self, config, senders, overlay_handler, video_handler, calibration_handler):
+    def __init__(self, config, patches, overlay_handler, video_handler, calibration_handler):
         self.validate_config(config)
 
         config["num_pixels"] = config.get("leds_per_strand") * config.get("num_strands")
 
-        LedFixture.__init__(self, config, senders, overlay_handler, video_handler, calibration_handler)
+        LedFixture.__init__(self, config, patches, overlay_handler, video_handler, calibration_handler)
 
         self.pattern_map_by_polar = True
 
@@ -64,14 +64,14 @@ class BuntingPolygon(LedFixture):
             led_coord = Coordinate(local_origin=fixture_origin, local_cartesian=Cartesian(x, y, z))
             leds.append(Led(led_coord))
 
-        # add farthest point for sampling purposes
-        if "farthest_point" in config.keys():
-            leds.append(Led(Coordinate(local_origin=fixture_origin, local_cartesian=Cartesian(*config.get("farthest_point")))))
-
         self.leds = np.array(leds)
 
-        max_x_offset = max((math.fabs(led.coord.get("global", "cartesian").x) for led in self.leds))
-        max_y_offset = max((math.fabs(led.coord.get("global", "cartesian").y) for led in self.leds))
+        # the farthest point isn't an led, but bunting sharing one also share a scale when sampling
+        if "farthest_point" in config.keys():
+            self.reference_leds.append(Led(Coordinate(local_origin=fixture_origin, local_cartesian=Cartesian(*config.get("farthest_point")))))
+
+        max_x_offset = max((math.fabs(led.coord.get("global", "cartesian").x) for led in list(self.leds) + self.reference_leds))
+        max_y_offset = max((math.fabs(led.coord.get("global", "cartesian").y) for led in list(self.leds) + self.reference_leds))
 
         for led in self.leds:
             # between 0 and 1
@@ -8,13 +8,13 @@ import numpy as np
 import math
 
 class Dodecahedron(LedFixture):
-    def __init__(self, config, senders, overlay_handler, video_handler, calibration_handler):
+    def __init__(self, config, patches, overlay_handler, video_handler, calibration_handler):
         # dodecahedrons always have 60 pixels
         config["num_pixels"] = 60
 
         self.validate_config(config)
 
-        LedFixture.__init__(self, config, senders, overlay_handler, video_handler, calibration_handler)
+        LedFixture.__init__(self, config, patches, overlay_handler, video_handler, calibration_handler)
 
         led_spherical_local_coords = ((60,   6),  (20,  30),  (45,  48),  (75,  18), (100, 348),
                                      (300,   6), (260, 348), (285,  18), (315,  48), (340,  30),
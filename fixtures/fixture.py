@@ -11,6 +11,9 @@ class Fixture:
         self.calibration_angle = 0
         self.calibrate = False
 
+        # set by the owner to push slow housekeeping out of the render path
+        self.scheduler = None
+
         self.calibration_handler.register_fixture(self.name)
 
     def validate_config(self, config):
@@ -37,3 +40,9 @@ class Fixture:
 
     def update(self, time, palette, smoothness, master_brightness):
         pass
+
+    def get_cost_hint(self):
+        return 0.0
+
+    def get_preview_colours(self):
+        return None
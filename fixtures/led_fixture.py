@@ -1,11 +1,6 @@
 from fixtures.fixture import Fixture
-from patterns.sparkle import Sparkle
-from patterns.fizzy_lifting_drink import FizzyLiftingDrink
-from patterns.make_me_one_with_everything import MakeMeOneWithEverything
-from patterns.fire import Fire
-from patterns.smooth import Smooth
-from patterns.swirl import Swirl
-from patterns.map_video import MapVideo
+from patterns.pattern import pattern_types
+from common.profiler import profiler
 import numpy as np
 import math
 
@@ -16,14 +11,8 @@ class Led:
         self.flat_mapping = flat_mapping
 
 
-class SenderInfo:
-    def __init__(self, sender, line):
-        self.sender = sender
-        self.line = line
-
-
 class LedFixture(Fixture):
-    def __init__(self, config, senders, overlay_handler, video_handler, calibration_handler):
+    def __init__(self, config, patches, overlay_handler, video_handler, calibration_handler):
         self.validate_config(config)
 
         Fixture.__init__(self, config, overlay_handler, video_handler, calibration_handler)
@@ -31,7 +20,10 @@ class LedFixture(Fixture):
         self.geometry = config.get("geometry", "No geometry present in fixture definition")
         self.channel_order = config.get("channel_order", "No channel_order present in fixture definition")
         self.num_pixels = config.get("num_pixels", 0)
-        self.senders_info = list(SenderInfo(sender[0], sender[1]) for sender in senders)
+        self.patches = patches
+
+        # set by the owner, fixtures encode into it and it sends the lines
+        self.patch_map = None
 
         self.power_budget = config.get("power_budget", None) # watts
 
@@ -39,7 +31,13 @@ class LedFixture(Fixture):
 
         self.patterns = {}
 
+        # microseconds per led per frame, from the registry
+        self.pattern_costs = {}
+
         self.leds = np.array([])
+
+        # points patterns should count when measuring the fixture, that aren't leds, e.g. to share a scale with others
+        self.reference_leds = list()
         self.colours = np.zeros((self.num_pixels, 3), dtype=np.float32)
         self.overlaid_colours = np.zeros((self.num_pixels, 3), dtype=np.float32)
 
@@ -72,29 +70,9 @@ class LedFixture(Fixture):
     def register_command(self, command):
         if command["type"] == "pattern":
             if command["name"] not in self.patterns:
-                if command["name"] == "smooth":
-                    self.patterns["smooth"] = Smooth(self.leds)
-
-                elif command["name"] == "swirl":
-                    self.patterns["swirl"] = Swirl(self.leds)
-
-                elif command["name"] == "sparkle":
-                    self.patterns["sparkle"] = Sparkle(self.leds)
-
-                elif command["name"] == "fizzy_lifting_drink":
-                    self.patterns["fizzy_lifting_drink"] = FizzyLiftingDrink(self.leds)
-
-                elif command["name"] == "make_me_one_with_everything":
-                    self.patterns["make_me_one_with_everything"] = MakeMeOneWithEverything(self.leds)
-
-                elif command["name"] == "fire":
-                    self.patterns["fire"] = Fire(self.leds, self.pattern_map_by_polar)
-
-                elif command["name"] == "map_video":
-                    self.patterns["map_video"] = MapVideo(self.leds, self.video_handler)
-
-                else:
-                    raise Exception("LedFixture: unknown pattern {}".format(command["name"]))
+                plugin = pattern_types.choose(command["name"], self.get_features(), "fixture {}".format(self.name))
+                self.patterns[command["name"]] = plugin.load().from_fixture(self)
+                self.pattern_costs[command["name"]] = plugin.get_cost()
 
         elif command["type"] == "palette":
             # handled, but nothing to do
@@ -103,44 +81,87 @@ class LedFixture(Fixture):
         else:
             raise Exception("LedFixture: unknown command type {}".format(command["type"]))
 
-    def send(self):
-        if len(self.leds) > 0:
-            for sender_info in self.senders_info:
-                sender_info.sender.send(sender_info.line, self.get_pixels(force_rgb=sender_info.sender.is_simulator))
+    # what patterns can ask for when they're registered, see patterns/pattern.py
+    def get_features(self):
+        features = set()
 
-    def update(self, time, palette, smoothness, master_brightness):
-        if self.calibration_handler.get_angle(self.name) != self.calibration_angle:
-            angle_delta = self.calibration_handler.get_angle(self.name) - self.calibration_angle
+        if self.video_handler is not None:
+            features.add("video")
 
-            for led in self.leds:
-                led.coord.rotate("theta", "local", angle_delta)
+        if self.pattern_map_by_polar:
+            features.add("polar")
 
-            for pattern in self.patterns.values():
-                pattern.cache_positions(self.leds)
+        return features
 
-            self.calibration_angle = self.calibration_handler.get_angle(self.name)
+    # a guess at seconds per frame from the pattern's cost hint, until the render pool has measured us
+    def get_cost_hint(self):
+        return self.num_pixels * self.pattern_costs.get(self.pattern, 1.0) * 1e-6
+
+    # the patch map sends every line once all the fixtures on it are encoded
+    def send(self):
+        if len(self.leds) > 0 and self.patch_map is not None:
+            self.patch_map.encode(self)
+
+    def update(self, time, palette, smoothness, master_brightness):
+        if self.calibration_handler.get_angle(self.name) != self.calibration_angle:
+            # recalculating every led position is slow, so do it between frames when we can
+            if self.scheduler:
+                self.scheduler.defer(self.apply_calibration)
+            else:
+                self.apply_calibration()
 
         if self.pattern not in self.patterns.keys():
             raise Exception("LedFixture: unknown pattern {}".format(self.pattern))
 
         # update all patterns so they are in a sensible state when we switch
-        for pattern in self.patterns.values():
-            pattern.update(self.leds, time, palette, self.palette_name)
+        for name, pattern in self.patterns.items():
+            if profiler.enabled:
+                profiler.timed("pattern update", "{} {}".format(self.name, name), pattern.update, self.leds, time, palette, self.palette_name)
+            else:
+                pattern.update(self.leds, time, palette, self.palette_name)
 
         if smoothness < 0 or smoothness > 1:
             raise Exception("illegal smoothness value of {}".format(smoothness))
 
         if self.calibrate:
-            self.overlaid_colours = self.get_calibration_colours()
+            self.overlaid_colours[:] = self.get_calibration_colours()
 
         else:
-            new_colours = self.patterns[self.pattern].get_pixel_colours(self.leds, time, palette, self.palette_name)
-            new_colours = new_colours[:len(self.colours)]
-            self.colours = self.colours * smoothness + new_colours * (1.0 - smoothness)
+            if profiler.enabled:
+                profiler.timed("pattern", "{} {}".format(self.name, self.pattern), self.blend_pattern, time, palette, smoothness)
+            else:
+                self.blend_pattern(time, palette, smoothness)
 
-            self.overlaid_colours = self.overlay_handler.calculate_overlaid_colours(self.leds, self.colours, self.name)
+            # in place, overlaid_colours may be memory the render pool shares
+            self.overlay_handler.calculate_overlaid_colours(self.leds, self.colours, self.name, time, self.overlaid_colours)
             self.overlaid_colours *= master_brightness
 
+    # eases colours towards the current pattern's, more slowly the smoother
+    def blend_pattern(self, time, palette, smoothness):
+        new_colours = self.patterns[self.pattern].get_pixel_colours(self.leds, time, palette, self.palette_name)
+        self.colours *= smoothness
+        self.colours += new_colours * (1.0 - smoothness)
+
+    def apply_calibration(self):
+        angle_delta = self.calibration_handler.get_angle(self.name) - self.calibration_angle
+
+        if angle_delta == 0:
+            return
+
+        for led in list(self.leds) + self.reference_leds:
+            led.coord.rotate("theta", "local", angle_delta)
+
+        for pattern in self.patterns.values():
+            pattern.cache_positions(self.leds)
+
+        if self.overlay_handler is not None:
+            self.overlay_handler.invalidate_bounds(self.name)
+
+        self.calibration_angle = self.calibration_handler.get_angle(self.name)
+
+    def get_preview_colours(self):
+        return self.overlaid_colours
+
     def get_pixels(self, force_rgb=False):
         if force_rgb:
             return self.get_byte_values("rgb", self.overlaid_colours)
@@ -152,7 +173,6 @@ class LedFixture(Fixture):
 
         if self.calibration_handler.get_selection() == self.name:
             thetas = np.array(list(led.coord.get("local", "spherical").theta for led in self.leds))
-            thetas = thetas[:len(self.overlaid_colours)]
             thetas %= (2*math.pi)
             thetas -= math.pi
             thetas = np.abs(thetas)
@@ -161,7 +181,6 @@ class LedFixture(Fixture):
             thetas = np.maximum(0, thetas)
 
             deltas = np.array(list(led.coord.get_delta("global") for led in self.leds))
-            deltas = deltas[:len(self.overlaid_colours)]
             min_delta = np.min(deltas)
             max_delta = np.max(deltas)
             delta_range = max_delta - min_delta
@@ -200,7 +219,7 @@ class LedFixture(Fixture):
         sentinel_map += output_values == ord('|')
 
         safe_output_values = output_values + sentinel_map
-        safe_output_values = np.clip(255.0, 0.0, safe_output_values)
+        safe_output_values = np.clip(safe_output_values, 0, 255)
 
         if self.power_budget:
             safe_output_values = self.power_limit(channel_order, safe_output_values)
@@ -225,7 +244,8 @@ class LedFixture(Fixture):
         if total_draw > self.power_budget:
             downscale_factor = self.power_budget / total_draw
 
-            byte_values *= downscale_factor
+            # not in place, byte_values are ints and the scaled values aren't
+            byte_values = byte_values * downscale_factor
 
         return byte_values
 
@@ -253,4 +273,4 @@ class LedFixture(Fixture):
             led.coord.rotate_theta_local(angle)
 
     def has_sender(self, name):
-        return name in list(sender_info.sender.name for sender_info in self.senders_info)
+        return name in list(patch.sender.name for patch in self.patches)
@@ -2,7 +2,11 @@ from tkinter import *
 from handlers.connections.socket_client import SocketClient
 from handlers.packet_handler import CommHeader
 from handlers.packet_handler import StateReplyPayload
+from handlers.packet_handler import ControlUpdatePayload
+from handlers.packet_handler import PreviewSubscribePayload
+from handlers.preview_handler import PreviewDecoder
 from handlers.controllers.controller_handler import Control
+import time
 
 
 class GuiControllerWindow:
@@ -18,6 +22,9 @@ class GuiControllerWindow:
         self._buttons = dict()
         self._sliders = dict()
 
+        # latest value per control since the last flush, keyed by (kind, id)
+        self._pending_updates = dict()
+
         for butt in buttons:
             self._buttons[butt["id"]] = Control(butt["name"], butt["id"], butt["target_keyword"], butt["command"], butt.get("default, 0"))
 
@@ -38,6 +45,58 @@ class GuiControllerWindow:
 
             new_slider.pack({'fill': 'x', 'expand': 1, 'padx': 5, 'pady': 3})
 
+        # built when the first preview frame arrives
+        self._preview_canvas = None
+        self._preview_layout = None
+        self._preview_cells = list()
+        self._preview_fills = list()
+        self._preview_cell_size = 6
+
+    def show_preview(self, fixture_colours):
+        layout = list((name, len(colours)) for name, colours in fixture_colours)
+
+        if layout != self._preview_layout:
+            self._build_preview(layout)
+
+        index = 0
+
+        for _, colours in fixture_colours:
+            for r, g, b in colours.tolist():
+                fill = "#{:02x}{:02x}{:02x}".format(r, g, b)
+
+                # reconfiguring canvas items is slow, only touch the ones that changed
+                if fill != self._preview_fills[index]:
+                    self._preview_canvas.itemconfig(self._preview_cells[index], fill=fill)
+                    self._preview_fills[index] = fill
+
+                index += 1
+
+    def _build_preview(self, layout):
+        if self._preview_canvas is None:
+            self._preview_canvas = Canvas(self._window, bg=self._bg_colour, highlightthickness=0)
+            self._preview_canvas.pack({'fill': 'x', 'expand': 1, 'padx': 5, 'pady': 3})
+
+        self._preview_canvas.delete("all")
+        self._preview_layout = layout
+        self._preview_cells = list()
+        self._preview_fills = list()
+
+        size = self._preview_cell_size
+        label_width = 100
+
+        # one row of cells per fixture
+        for row, (name, num_pixels) in enumerate(layout):
+            y = row * (size + 4)
+            self._preview_canvas.create_text(0, y + size / 2, text=name, fill="#FFFFFF", anchor="w")
+
+            for pixel in range(num_pixels):
+                x = label_width + pixel * size
+                self._preview_cells.append(self._preview_canvas.create_rectangle(x, y, x + size, y + size, fill="#000000", width=0))
+                self._preview_fills.append("#000000")
+
+        width = label_width + max((num_pixels for _, num_pixels in layout), default=0) * size
+        self._preview_canvas.configure(width=width, height=len(layout) * (size + 4))
+
     def start(self):
         self._window.call('wm', 'attributes', '.', '-topmost', '1')
         self._window.mainloop()
@@ -47,11 +106,23 @@ class GuiControllerWindow:
 
     def button_pressed(self, id):
         self._buttons[id].set_state(1)
+        self._pending_updates[("button", id)] = 1
         print("button: {}".format(id))
 
     def slider_moved(self, value, id):
         self._sliders[id].set_state(int(value))
 
+        # only the last position of a drag matters
+        self._pending_updates[("slider", id)] = self._get_slider_value(id)
+
+    def _get_slider_value(self, id):
+        return int(self._sliders[id].state / 100.0 * 1024)
+
+    def take_pending_updates(self):
+        updates = list((kind, id, value) for (kind, id), value in self._pending_updates.items())
+        self._pending_updates.clear()
+        return updates
+
     def get_button_state(self):
         button_state = list()
 
@@ -69,8 +140,7 @@ class GuiControllerWindow:
         slider_state = list()
         for i in range(len(self._sliders.keys())):
             try:
-                slider_val = int(self._sliders[i].state / 100.0 * 1024)
-                slider_state.append(slider_val)
+                slider_state.append(self._get_slider_value(i))
             except KeyError:
                 slider_state.append(0)
 
@@ -93,29 +163,99 @@ class GuiController:
         self.last_update = 0.0
         self.update_interval = 5.0
 
-    def poll(self):
-        # if self.last_update + self.update_interval < time.time():
-        #     print("sending update")
-        #     self.last_update = time.time()
-        #     self.send_state_response()
+        self._subscribed = False
+        self._keepalive_interval = 1.0
+        self._last_keepalive = 0.0
+
+        # optional live view of the installation, e.g. {"fps": 10, "bits": 5, "max_pixels": 48}
+        self._preview_conf = config.get("preview", None)
+        self._preview_requested = False
+        self._preview_decoder = PreviewDecoder()
+        self._awaiting_keyframe = False
 
+    def poll(self):
         self.socket.poll()
 
+        if not self.socket.is_connected():
+            self._subscribed = False
+            self._preview_requested = False
+
+        elif self._preview_conf and not self._preview_requested:
+            self.send_preview_subscribe()
+
         for packet in self.socket.get_packets():
             if packet["msgtype"] == "state_request":
                 self.send_state_reply()
 
+            elif packet["msgtype"] == "subscribe":
+                print("subscribed with keepalive interval {}s".format(packet["keepalive_interval"]))
+                self._subscribed = True
+                self._keepalive_interval = packet["keepalive_interval"]
+
+                # anything pending is covered by the snapshot
+                self.window.take_pending_updates()
+                self.send_state_reply(include_buttons=False)
+
+            elif packet["msgtype"] == "preview_frame":
+                if packet["keyframe"]:
+                    self._awaiting_keyframe = False
+
+                fixture_colours = self._preview_decoder.decode(packet)
+
+                if fixture_colours is not None:
+                    self.window.show_preview(fixture_colours)
+
+                elif not self._awaiting_keyframe:
+                    # lost track of the deltas, start again from a keyframe
+                    self.send_preview_subscribe()
+
+        if self._subscribed:
+            self.send_control_updates()
+
+            if self._last_keepalive + self._keepalive_interval < time.time():
+                self.send_state_reply(include_buttons=False)
+
         self.window.set_after(5, self.poll)
 
-    def send_state_reply(self):
+    def send_control_updates(self):
+        updates = self.window.take_pending_updates()
+
+        if not updates:
+            return
+
+        # presses have gone out as updates, don't repeat them in the next state reply
+        self.window.clear_button_state()
+
+        payload = ControlUpdatePayload(updates=updates).get_bytes()
+        header = CommHeader(msgtype="control_update", payload_len=len(payload)).get_bytes()
+
+        self.socket.send_bytes(header + payload)
+
+    def send_preview_subscribe(self):
+        payload = PreviewSubscribePayload(fps=self._preview_conf.get("fps", 10),
+                                          bits=self._preview_conf.get("bits", 5),
+                                          max_pixels=self._preview_conf.get("max_pixels", 48)).get_bytes()
+        header = CommHeader(msgtype="preview_subscribe", payload_len=len(payload)).get_bytes()
+
+        self.socket.send_bytes(header + payload)
+        self._preview_decoder.reset()
+        self._preview_requested = True
+        self._awaiting_keyframe = True
+
+    def send_state_reply(self, include_buttons=True):
         button_state = self.window.get_button_state()
         slider_state = self.window.get_slider_state()
         self.window.clear_button_state()
 
+        # buttons are momentary, so when subscribed a snapshot only carries sliders. presses go out as updates
+        if not include_buttons:
+            button_state = [0] * len(button_state)
+
         payload = StateReplyPayload(button_state=button_state, slider_state=slider_state).get_bytes()
         header = CommHeader(msgtype="state_reply", payload_len=len(payload)).get_bytes()
 
         self.socket.send_bytes(header + payload)
+        self._last_keepalive = time.time()
 
     def run(self):
         self.window.start()
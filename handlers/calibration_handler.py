@@ -3,7 +3,8 @@ import os
 
 
 class CalibrationHandler:
-    def __init__(self, conf_path):
+    def __init__(self, conf_path, scheduler=None):
+        self.scheduler = scheduler
         self.conf_path = os.path.join(os.getcwd(), conf_path)
 
         if os.path.isfile(self.conf_path):
@@ -30,11 +31,18 @@ class CalibrationHandler:
 
     def set_angle(self, fixture, angle):
         self.config[fixture] = angle
-        self.save_conf()
+        self.request_save()
 
     def add_angle_to_selection(self, angle):
         self.config[self.get_selection()] += angle
-        self.save_conf()
+        self.request_save()
+
+    def request_save(self):
+        # writing the file can take a while on an sd card, so leave it for a frame with time to spare
+        if self.scheduler:
+            self.scheduler.defer(self.save_conf)
+        else:
+            self.save_conf()
 
     def increment_selection(self):
         self.current_selection += 1
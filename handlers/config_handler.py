@@ -20,8 +20,23 @@ class ConfigHandler:
     def get_fixtures(self):
         return self.config.get("Fixtures", [])
 
+    def set_fixtures(self, fixture_confs):
+        self.config["Fixtures"] = fixture_confs
+
     def get_controllers(self):
         return self.config.get("Controllers", [])
 
     def get_senders(self):
         return self.config.get("Senders", [])
+
+    def get_render_settings(self):
+        return self.config.get("Render", {})
+
+    def get_profiler_settings(self):
+        return self.config.get("Profiler", {})
+
+    def get_line_plan_settings(self):
+        return self.config.get("LinePlan", {})
+
+    def get_video_track_settings(self):
+        return self.config.get("VideoTracks", {})
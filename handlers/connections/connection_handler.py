@@ -1,5 +1,6 @@
 from handlers.packet_handler import CommPacketHandler
 from handlers.packet_handler import CommHeader
+from collections import deque
 from enum import Enum
 import time
 
@@ -11,13 +12,59 @@ class ClientState(Enum):
     ERRORED = 3
 
 
+class OutboundQueue:
+    # queued chunks are sent straight out of the caller's buffers. a partial write just moves an offset into the
+    # head chunk, so nothing is copied to trim off what has already gone
+    def __init__(self):
+        self._chunks = deque()
+        self._head_offset = 0
+        self._num_bytes = 0
+
+    def __len__(self):
+        return self._num_bytes
+
+    def append(self, data):
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+
+        if len(data):
+            self._chunks.append(memoryview(data))
+            self._num_bytes += len(data)
+
+    # the next contiguous run of unsent bytes
+    def peek(self):
+        if not self._chunks:
+            return memoryview(b"")
+
+        return self._chunks[0][self._head_offset:]
+
+    def consume(self, num_bytes):
+        self._num_bytes -= num_bytes
+
+        while num_bytes > 0:
+            remaining_in_head = len(self._chunks[0]) - self._head_offset
+
+            if num_bytes < remaining_in_head:
+                self._head_offset += num_bytes
+                return
+
+            num_bytes -= remaining_in_head
+            self._chunks.popleft()
+            self._head_offset = 0
+
+    def clear(self):
+        self._chunks.clear()
+        self._head_offset = 0
+        self._num_bytes = 0
+
+
 class ClientHandler:
     def __init__(self, address):
         self.address = address
         self.state = ClientState.NEW
         self.name = None
         self.packet_handler = CommPacketHandler()
-        self.outbound_byte_buffer = bytearray()
+        self.outbound_queue = OutboundQueue()
         self.inbound_packet_buffer = list()
         self.found_time = time.time()
 
@@ -26,56 +73,71 @@ class ClientHandler:
         self.send_bytes(bytes)
 
     def send_bytes(self, bytes):
-        if len(self.outbound_byte_buffer) == 0:
-            self.outbound_byte_buffer = bytes
-        else:
-            self.outbound_byte_buffer.extend(bytes)
+        self.outbound_queue.append(bytes)
 
 
 class ConnectionHandler:
     def __init__(self):
         self._client_dict = dict()
+        self._clients_by_name = dict()
 
-    def is_connected(self, client_name):
-        for client in self._client_dict.values():
-            if client.name == client_name and client.state == ClientState.INITIALISED:
-                return True
+    def _set_client_name(self, client, name):
+        if client.name is not None and self._clients_by_name.get(client.name, None) is client:
+            self._clients_by_name.pop(client.name)
 
-        return False
+        client.name = name
+        self._clients_by_name[name] = client
+
+    def _remove_client(self, key):
+        client = self._client_dict.pop(key)
+
+        if client.name is not None and self._clients_by_name.get(client.name, None) is client:
+            self._clients_by_name.pop(client.name)
+
+        return client
+
+    # called whenever bytes are queued for a client, for handlers that need to arrange for them to be written
+    def _on_output_pending(self, client):
+        pass
+
+    def is_connected(self, client_name):
+        client = self._clients_by_name.get(client_name, None)
+        return client is not None and client.state == ClientState.INITIALISED
 
     def get_packets(self, client_name):
         # just drop bytes for unknown clients for now
-        for client in self._client_dict.values():
-            if client.name == client_name:
-                return client.inbound_packet_buffer
-
-        return list()
+        client = self._clients_by_name.get(client_name, None)
+        return client.inbound_packet_buffer if client else list()
 
     def clear_packets(self, client_name):
         # just drop bytes for unknown clients for now
-        for client in self._client_dict.values():
-            if client.name == client_name:
-                client.inbound_packet_buffer.clear()
-                break
+        client = self._clients_by_name.get(client_name, None)
+
+        if client:
+            client.inbound_packet_buffer.clear()
+
+    def get_pending_bytes(self, client_name):
+        client = self._clients_by_name.get(client_name, None)
+        return len(client.outbound_queue) if client else 0
 
     def send_request(self, client_name, request):
         # just drop request for unknown clients for now
-        for client in self._client_dict.values():
-            if client.name == client_name:
-                client.send_bytes(CommHeader(msgtype=request).get_bytes())
+        self.send_bytes(client_name, CommHeader(msgtype=request).get_bytes())
 
     def send_bytes(self, client_name, bytes):
         # just drop bytes for unknown clients for now
-        for client in self._client_dict.values():
-            if client.name == client_name:
-                client.send_bytes(bytes)
+        client = self._clients_by_name.get(client_name, None)
+
+        if client:
+            client.send_bytes(bytes)
+            self._on_output_pending(client)
 
     def handle_received_packets(self):
         for client in self._client_dict.values():
-            for packet in client.inbound_packet_buffer:
+            for packet in list(client.inbound_packet_buffer):
                 if packet["msgtype"] == "name_reply":
                     if client.state == ClientState.AWAITING_NAME:
-                        client.name = packet["name"]
+                        self._set_client_name(client, packet["name"])
                         print("Client at {} identified as {}".format(client.address, client.name))
                         client.state = ClientState.INITIALISED
 
@@ -86,5 +148,3 @@ class ConnectionHandler:
                             print("Multiple conflicting name replies received from client {}. Old name = {} new name = {}".format(client.address, client.name, packet["name"]))
 
                     client.inbound_packet_buffer.remove(packet)
-
-    # handle client available packets
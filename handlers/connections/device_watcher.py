@@ -0,0 +1,157 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import time
+
+
+# tracks device nodes in a directory whose names contain a keyword, by rescanning it on an interval
+class DeviceWatcher:
+    def __init__(self, device_dir, keyword, poll_interval=1.0):
+        self.device_dir = device_dir
+        self.keyword = keyword
+        self.poll_interval = poll_interval
+
+        self._present = set()
+        self._last_poll = 0.0
+
+    def fileno(self):
+        # nothing to wait on, callers must poll
+        return None
+
+    def _scan(self):
+        try:
+            return set(os.path.join(self.device_dir, dev) for dev in os.listdir(self.device_dir) if self.keyword in dev)
+
+        except OSError as e:
+            print("DeviceWatcher: failed to list {}: {}".format(self.device_dir, e))
+            return set(self._present)
+
+    def _diff(self, present):
+        added = present - self._present
+        removed = self._present - present
+        self._present = present
+        return sorted(added), sorted(removed), list()
+
+    # returns (added, removed, changed) lists of device paths since the last call
+    def poll(self):
+        if self._last_poll + self.poll_interval > time.time():
+            return list(), list(), list()
+
+        self._last_poll = time.time()
+        return self._diff(self._scan())
+
+    def close(self):
+        pass
+
+
+# same as DeviceWatcher, but driven by inotify events so new devices are seen as soon as they appear
+class InotifyDeviceWatcher(DeviceWatcher):
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+
+    _event_struct = struct.Struct("iIII")
+
+    def __init__(self, device_dir, keyword):
+        DeviceWatcher.__init__(self, device_dir, keyword)
+
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise Exception("InotifyDeviceWatcher: libc not found")
+
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        if not hasattr(libc, "inotify_init1"):
+            raise Exception("InotifyDeviceWatcher: inotify not supported on this platform")
+
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        mask = self.IN_CREATE | self.IN_DELETE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_ATTRIB
+
+        if libc.inotify_add_watch(self._fd, os.fsencode(device_dir), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, "inotify_add_watch failed on {}".format(device_dir))
+
+        # report whatever is already plugged in on the first poll
+        self._initial_scan = True
+
+    def fileno(self):
+        return self._fd
+
+    def _read_events(self):
+        data = bytearray()
+
+        while True:
+            try:
+                data.extend(os.read(self._fd, 4096))
+
+            except BlockingIOError:
+                break
+
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+        return data
+
+    def poll(self):
+        if self._initial_scan:
+            self._initial_scan = False
+            return self._diff(self._scan())
+
+        data = self._read_events()
+
+        if not data:
+            return list(), list(), list()
+
+        present = set(self._present)
+        changed = set()
+        deleted = set()
+        cycled = set()
+        offset = 0
+
+        while offset + self._event_struct.size <= len(data):
+            _, mask, _, name_len = self._event_struct.unpack_from(data, offset)
+            offset += self._event_struct.size
+            name = os.fsdecode(bytes(data[offset:offset + name_len]).rstrip(b"\0"))
+            offset += name_len
+
+            if mask & self.IN_Q_OVERFLOW:
+                # we've missed events, fall back to a full rescan
+                return self._diff(self._scan())
+
+            if self.keyword not in name:
+                continue
+
+            path = os.path.join(self.device_dir, name)
+
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                present.add(path)
+
+                # a quick unplug and replug can land in one read. report it as both so the old handle gets closed
+                if path in deleted and path in self._present:
+                    cycled.add(path)
+
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                present.discard(path)
+                deleted.add(path)
+
+            elif mask & self.IN_ATTRIB:
+                # udev fixing up permissions after creation, worth retrying a failed open
+                changed.add(path)
+
+        cycled &= present
+        added, removed, _ = self._diff(present)
+        return sorted(set(added) | cycled), sorted(set(removed) | cycled), sorted(changed & present)
+
+    def close(self):
+        os.close(self._fd)
@@ -6,6 +6,7 @@ from copy import deepcopy
 from handlers.packet_handler import CommPacketHandler
 from handlers.packet_handler import CommHeader
 from handlers.packet_handler import NameReplyPayload
+from handlers.connections.connection_handler import OutboundQueue
 
 
 class SocketClient:
@@ -14,7 +15,7 @@ class SocketClient:
         self._packet_handler = CommPacketHandler()
         self._socket = socket.socket()
         self._timeout = timeout
-        self._outbound_byte_buffer = bytearray()
+        self._outbound_queue = OutboundQueue()
         self._connected = False
         self._inout = []
         self._address = (host, port)
@@ -69,7 +70,7 @@ class SocketClient:
 
         if len(readable) > 0:
             try:
-                self._packet_handler.add_bytes(self._socket.recv(4096))
+                self._packet_handler.add_bytes(self._socket.recv(65536))
 
             except socket.error as e:
                 if e.errno != errno.EAGAIN:
@@ -87,10 +88,10 @@ class SocketClient:
                 print("Lost connection on {}".format(self._address))
 
         if len(writeable) > 0:
-                if len(self._outbound_byte_buffer) > 0:
+                if len(self._outbound_queue) > 0:
                     try:
-                        sent = self._socket.send(self._outbound_byte_buffer)
-                        self._outbound_byte_buffer = self._outbound_byte_buffer[sent:]
+                        sent = self._socket.send(self._outbound_queue.peek())
+                        self._outbound_queue.consume(sent)
 
                     except socket.error as e:
                         if e.errno != errno.EAGAIN:
@@ -100,7 +101,7 @@ class SocketClient:
                             print(e)
                             print("Lost connection on {}".format(self._address))
 
-                        print('Blocking with', len(self._outbound_byte_buffer), 'remaining')
+                        print('Blocking with', len(self._outbound_queue), 'remaining')
 
                     except Exception as e:
                         self._socket.close()
@@ -130,10 +131,7 @@ class SocketClient:
                 self._packet_handler.available_packets.remove(packet)
 
     def send_bytes(self, bytes):
-        if len(self._outbound_byte_buffer) == 0:
-            self._outbound_byte_buffer = bytes
-        else:
-            self._outbound_byte_buffer.extend(bytes)
+        self._outbound_queue.append(bytes)
 
     def get_packets(self):
         packets = deepcopy(self._packet_handler.available_packets)
@@ -1,11 +1,21 @@
 from handlers.connections.connection_handler import ConnectionHandler
 from handlers.connections.connection_handler import ClientHandler
 from handlers.connections.connection_handler import ClientState
+import selectors
 import socket
-import select
 import errno
 
 
+class SocketClientHandler(ClientHandler):
+    def __init__(self, client_socket, address):
+        ClientHandler.__init__(self, address)
+        self.socket = client_socket
+        self.writing = False
+
+        # latest preview subscription we haven't handed over yet
+        self.preview_request = None
+
+
 class SocketServer(ConnectionHandler):
     def __init__(self, port, host='', timeout=0.001):
         ConnectionHandler.__init__(self)
@@ -13,88 +23,127 @@ class SocketServer(ConnectionHandler):
         self._timeout = timeout
         self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self._server_socket.settimeout(self._timeout)
+        self._server_socket.setblocking(False)
         self._server_socket.bind((host, port))
         self._server_socket.listen()
 
+        # epoll where we have it. clients are only registered for writing while they have something queued
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server_socket, selectors.EVENT_READ)
+
+        self._recv_size = 65536
+
         print("SocketServer: listening on {}:{}".format(host, port))
 
-        self.send_buffer = bytearray()
+    def get_fds(self):
+        # an epoll selector is itself readable when any registered socket is ready
+        if hasattr(self._selector, "fileno"):
+            return [self._selector]
+
+        return list(self._client_dict.keys()) + [self._server_socket]
+
+    def _on_output_pending(self, client):
+        if not client.writing:
+            client.writing = True
+            self._selector.modify(client.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+
+    def _stop_writing(self, client):
+        client.writing = False
+        self._selector.modify(client.socket, selectors.EVENT_READ, client)
 
     def poll(self):
-        readable, writeable, errored = select.select(list(self._client_dict.keys()) + [self._server_socket],
-                                                     list(self._client_dict.keys()),
-                                                     list(self._client_dict.keys()),
-                                                     self._timeout)
-
-        for s in readable:
-            if s is self._server_socket:
-                client_socket, address = self._server_socket.accept()
-                self._client_dict[client_socket] = ClientHandler(address)
-                print("Connection from {}".format(address))
-
-            else:
-                if s in self._client_dict.keys():
-                    try:
-                        new_bytes = bytearray(s.recv(4096))
-                        self._client_dict[s].packet_handler.add_bytes(new_bytes)
-
-                        for packet in self._client_dict[s].packet_handler.available_packets:
-                            self._client_dict[s].inbound_packet_buffer.append(packet)
-
-                        self._client_dict[s].packet_handler.available_packets.clear()
-
-                    except socket.error as e:
-                        if e.errno != errno.EAGAIN:
-                            print("Lost connection with client {}".format(self._client_dict[s].name))
-                            s.close()
-                            self._client_dict.pop(s)
-
-                    except Exception as e:
-                        print("Lost connection with client {}".format(self._client_dict[s].name))
-                        s.close()
-                        self._client_dict.pop(s)
-
-                else:
-                    print("ignoring bytes read from unknown client {}".format(s))
-
-        for s in writeable:
-            if s in self._client_dict.keys():
-                # don't do anything else until we have a name
-                if self._client_dict[s].state == ClientState.NEW:
-                    print("sending name request to client at {}".format(self._client_dict[s].address))
-                    self._client_dict[s].send_request("name_request")
-                    self._client_dict[s].state = ClientState.AWAITING_NAME
-
-                if len(self._client_dict[s].outbound_byte_buffer) > 0:
-                    try:
-                        sent = s.send(self._client_dict[s].outbound_byte_buffer)
-                        self._client_dict[s].outbound_byte_buffer = self._client_dict[s].outbound_byte_buffer[sent:]
-
-                    except socket.error as e:
-                        if e.errno != errno.EAGAIN:
-                            print("Lost connection with client {}".format(self._client_dict[s].name))
-                            s.close()
-                            self._client_dict.pop(s)
-
-                        else:
-                            print('Blocking with', len(self._client_dict[s].outbound_byte_buffer), 'remaining')
-
-                    except Exception as e:
-                        print("Lost connection with client {}".format(self._client_dict[s].name))
-                        s.close()
-                        self._client_dict.pop(s)
-
-            else:
-                print("ignoring bytes read from unknown client {}".format(s))
-
-        for s in errored:
-            if s in self._client_dict.keys():
-                print("closing errored client {} on address {}".format(self._client_dict[s].name, self._client_dict[s].address))
-                self._client_dict.pop(s)
-                s.close()
-            else:
-                # ignore unknown errored clients. Is this even possible?
-                pass
+        for key, events in self._selector.select(self._timeout):
+            if key.fileobj is self._server_socket:
+                self._accept()
+                continue
+
+            client = key.data
+
+            if events & selectors.EVENT_READ:
+                self._read(client)
+
+            # the read may have dropped the client
+            if events & selectors.EVENT_WRITE and client.socket in self._client_dict.keys():
+                self._write(client)
 
         self.handle_received_packets()
+
+    def _accept(self):
+        try:
+            client_socket, address = self._server_socket.accept()
+
+        except BlockingIOError:
+            return
+
+        client_socket.setblocking(False)
+        client = SocketClientHandler(client_socket, address)
+        self._client_dict[client_socket] = client
+        self._selector.register(client_socket, selectors.EVENT_READ, client)
+        print("Connection from {}".format(address))
+
+        # don't do anything else until we have a name
+        print("sending name request to client at {}".format(address))
+        client.send_request("name_request")
+        client.state = ClientState.AWAITING_NAME
+        self._on_output_pending(client)
+
+    def _read(self, client):
+        try:
+            new_bytes = client.socket.recv(self._recv_size)
+
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._drop(client, e)
+            return
+
+        # orderly shutdown from the other end
+        if not new_bytes:
+            self._drop(client, None)
+            return
+
+        client.packet_handler.add_bytes(new_bytes)
+        client.inbound_packet_buffer.extend(client.packet_handler.available_packets)
+        client.packet_handler.available_packets.clear()
+
+    def _write(self, client):
+        try:
+            while len(client.outbound_queue) > 0:
+                sent = client.socket.send(client.outbound_queue.peek())
+                client.outbound_queue.consume(sent)
+
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._drop(client, e)
+            return
+
+        self._stop_writing(client)
+
+    def _drop(self, client, error):
+        if error:
+            print(error)
+
+        print("Lost connection with client {} at {}".format(client.name, client.address))
+
+        self._selector.unregister(client.socket)
+        self._remove_client(client.socket)
+        client.socket.close()
+
+    def handle_received_packets(self):
+        for client in self._client_dict.values():
+            for packet in list(client.inbound_packet_buffer):
+                if packet["msgtype"] == "preview_subscribe":
+                    client.preview_request = packet
+                    client.inbound_packet_buffer.remove(packet)
+
+        ConnectionHandler.handle_received_packets(self)
+
+    # preview subscriptions received since the last call, by client name. held back until the client has a name
+    def take_preview_requests(self):
+        requests = dict()
+
+        for client in self._client_dict.values():
+            if client.preview_request is not None and client.state == ClientState.INITIALISED:
+                requests[client.name] = client.preview_request
+                client.preview_request = None
+
+        return requests
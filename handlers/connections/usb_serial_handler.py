@@ -1,116 +1,323 @@
 from handlers.connections.connection_handler import ClientHandler
 from handlers.connections.connection_handler import ClientState
 from handlers.connections.connection_handler import ConnectionHandler
-import serial
+from handlers.connections.device_watcher import DeviceWatcher
+from handlers.connections.device_watcher import InotifyDeviceWatcher
+from handlers.packet_handler import CommPacketHandler
+from common.lazy_loader import import_module
 import time
-from sys import platform
+import json
 import os
+from sys import platform
+
+
+# estimates how fast a board takes bytes off us from how much got written while there was a backlog to write. while
+# the queue keeps running dry we'd only learn how fast we're feeding it, so those stretches don't count. time we spend
+# rendering while the kernel's buffer sits empty does count, so if anything this errs low
+class ThroughputEstimator:
+    min_window = 0.1
+    smoothing = 0.3
+
+    def __init__(self):
+        self.bytes_per_second = None
+        self.bytes_written = 0
+
+        self._backlogged_since = None
+        self._window_bytes = 0
+        self._window_time = 0.0
+
+    def record(self, now, written, backlogged):
+        self.bytes_written += written
+
+        if self._backlogged_since is not None:
+            self._window_bytes += written
+            self._window_time += now - self._backlogged_since
+
+            if self._window_time >= self.min_window:
+                sample = self._window_bytes / self._window_time
+
+                if self.bytes_per_second is None:
+                    self.bytes_per_second = sample
+                else:
+                    self.bytes_per_second += (sample - self.bytes_per_second) * self.smoothing
+
+                self._window_bytes = 0
+                self._window_time = 0.0
+
+        self._backlogged_since = now if backlogged else None
 
 
 class SerialClientHandler(ClientHandler):
-    def __init__(self, port):
+    min_name_request_interval = 0.05
+    max_name_request_interval = 2.0
+
+    # previews are socket only, so their long payloads are never legal on a serial line
+    msgtypes = ("name_request", "name_reply", "state_request", "state_reply", "subscribe", "control_update")
+
+    def __init__(self, port, srl):
         ClientHandler.__init__(self, port)
-        self.srl = None
+        self.srl = srl
+        self.packet_handler = CommPacketHandler(msgtypes=self.msgtypes)
+        self.name_verified = False
+        self.next_name_request = 0.0
+        self.name_request_interval = self.min_name_request_interval
+        self.throughput = ThroughputEstimator()
+
+    def schedule_name_request(self):
+        # boards can miss bytes while they enumerate, so keep asking, backing off until they answer
+        self.next_name_request = time.time() + self.name_request_interval
+        self.name_request_interval = min(self.name_request_interval * 2, self.max_name_request_interval)
+
+
+class PortNameCache:
+    def __init__(self, cache_path):
+        self.cache_path = os.path.join(os.getcwd(), cache_path) if cache_path else None
+        self.names = dict()
+
+        if self.cache_path and os.path.isfile(self.cache_path):
+            with open(self.cache_path) as file:
+                try:
+                    self.names = json.load(file)
+
+                except json.JSONDecodeError:
+                    # it's only a cache, we'll rebuild it as boards identify themselves
+                    print("PortNameCache: ignoring invalid cache file {}".format(self.cache_path))
+
+    def get(self, port):
+        return self.names.get(port, None)
+
+    def set(self, port, name):
+        if self.names.get(port, None) == name:
+            return
+
+        # a board can only live on one port
+        for stale_port in list(p for p, n in self.names.items() if n == name):
+            self.names.pop(stale_port)
+
+        self.names[port] = name
+        self.save()
+
+    def save(self):
+        if not self.cache_path:
+            return
+
+        try:
+            with open(self.cache_path, 'w') as outfile:
+                json.dump(self.names, outfile, indent=2)
+
+        except EnvironmentError as e:
+            print("PortNameCache: failed to save {}: {}".format(self.cache_path, e))
 
 
 class UsbSerialHandler(ConnectionHandler):
-    def __init__(self):
+    min_port_retry_interval = 0.05
+    max_port_retry_interval = 2.0
+
+    def __init__(self, device_dir="/dev/", port_keyword=None, name_cache_path=None):
         ConnectionHandler.__init__(self)
 
-        self.stale_ports = list()
-        self.last_dev_poll = 0.0
-        self.port_poll_interval = 1.0
+        if port_keyword is None:
+            port_keyword = "tty.usbmodem" if platform == "darwin" else "ttyACM"
 
-    def update(self):
-        if self.last_dev_poll + self.port_poll_interval < time.time():
-            self.last_dev_poll = time.time()
+        try:
+            self._device_watcher = InotifyDeviceWatcher(device_dir, port_keyword)
+
+        except Exception as e:
+            print("UsbSerialHandler: inotify unavailable ({}), polling {} for devices instead".format(e, device_dir))
+            self._device_watcher = DeviceWatcher(device_dir, port_keyword)
+
+        self._name_cache = PortNameCache(name_cache_path)
 
-            # available_ports = list(port[0] for port in list_ports_posix.comports() if port[1] == 'USB Serial')
-            port_keyword = "ttyACM"
+        self._present_ports = set()
+        self._next_port_retry = dict()
+        self._port_retry_intervals = dict()
 
-            if platform == "darwin":
-                port_keyword = "tty.usbmodem"
+    def get_fds(self):
+        fds = list(client_handler.srl for client_handler in self._client_dict.values())
 
-            available_ports = list(os.path.join("/dev/", dev) for dev in os.listdir("/dev/") if str(dev).find(port_keyword) != -1)
+        if self._device_watcher.fileno() is not None:
+            fds.append(self._device_watcher.fileno())
 
-            # close absent ports
-            for port in self._client_dict.keys():
-                if port not in available_ports:
-                    if self._client_dict[port].state == ClientState.INITIALISED:
-                        print("Lost connection with sender {} on port {}".format(self._client_dict[port].name, port))
-                    else:
-                        print("Serial USB device disappeared on {}".format(port))
+        return fds
 
-                    if self._client_dict[port].srl:
-                        self._client_dict[port].srl.close()
+    # ports with a backlog, so we wake to keep them fed rather than leaving them idle until the next frame
+    def get_write_fds(self):
+        return list(client_handler.srl for client_handler in self._client_dict.values() if len(client_handler.outbound_queue))
 
-                    self.stale_ports.append(port)
+    def get_throughput(self, client_name):
+        client = self._clients_by_name.get(client_name, None)
+        return client.throughput.bytes_per_second if client else None
 
-            for port in self.stale_ports:
-                self._client_dict.pop(port)
-                self.stale_ports.clear()
+    def get_bytes_written(self, client_name):
+        client = self._clients_by_name.get(client_name, None)
+        return client.throughput.bytes_written if client else 0
 
-            # register present ports
-            for port in available_ports:
-                if port not in self._client_dict.keys():
-                    print("Serial USB device detected on {}".format(port))
-                    self._client_dict[port] = SerialClientHandler(port)
+    # polling watchers rescan the device directory, which is slow enough to belong between frames
+    def scan_ports(self):
+        if self._device_watcher.fileno() is None:
+            self._update_present_ports()
 
-        # connect and get names
+    def update(self):
+        # inotify events are cheap to read, and we want to see new devices as soon as they appear
+        if self._device_watcher.fileno() is not None:
+            self._update_present_ports()
+
+        # connect to any present ports we don't have open
+        for port in self._present_ports:
+            if port not in self._client_dict.keys() and self._next_port_retry.get(port, 0.0) <= time.time():
+                self._open_port(port)
+
+        # get names, immediately on open and then with backoff until we hear back
         for port, client_handler in self._client_dict.items():
-            if not client_handler.srl:
-                try:
-                    client_handler.srl = serial.Serial(port,
-                                                       parity=serial.PARITY_NONE,
-                                                       stopbits=serial.STOPBITS_ONE,
-                                                       bytesize=serial.EIGHTBITS,
-                                                       writeTimeout=0,
-                                                       timeout=0,
-                                                       rtscts=False,
-                                                       dsrdtr=False,
-                                                       xonxoff=False)
-
-                except:
-                    client_handler.errored = True
-
-            elif client_handler.state == ClientState.NEW and time.time() > client_handler.found_time + 2.0:
-                try:
-                    print("sending name request to client at {}".format(port))
-                    client_handler.send_request("name_request")
+            if not client_handler.name_verified and time.time() >= client_handler.next_name_request:
+                client_handler.send_request("name_request")
+                client_handler.schedule_name_request()
+
+                if client_handler.state == ClientState.NEW:
                     client_handler.state = ClientState.AWAITING_NAME
 
-                except Exception as e:
-                    print(e)
-                    client_handler.state = ClientState.ERRORED
+        # write pending data and read data from ports into packet handlers
+        now = time.time()
 
-        # Read data from ports and put into packet handlers
-        for port, client_handler in self._client_dict.items():
-            if client_handler.state != ClientState.NEW and client_handler.srl.isOpen():
-                if len(client_handler.outbound_byte_buffer) > 0:
-                    try:
-                        client_handler.srl.write(client_handler.outbound_byte_buffer)
-                        client_handler.outbound_byte_buffer = bytearray()
-
-                    except Exception as e:
-                        print(e)
-                        print("Sender {} lost connection on port {}".format(client_handler.name, port))
-                        client_handler.srl.close()
-                        self.stale_ports.append(port)
+        for port, client_handler in list(self._client_dict.items()):
+            if len(client_handler.outbound_queue) > 0:
+                pending = len(client_handler.outbound_queue)
 
                 try:
-                    while client_handler.srl.in_waiting:
-                        new_bytes = client_handler.srl.read()
-                        client_handler.packet_handler.add_bytes(new_bytes)
+                    # the port is non blocking, so this may only take part of what we have
+                    while len(client_handler.outbound_queue) > 0:
+                        # straight to the fd, as pyserial retries EAGAIN forever even with a zero write timeout
+                        try:
+                            written = os.write(client_handler.srl.fileno(), client_handler.outbound_queue.peek())
 
-                        for packet in client_handler.packet_handler.available_packets:
-                            client_handler.inbound_packet_buffer.append(packet)
+                        except BlockingIOError:
+                            written = 0
 
-                        client_handler.packet_handler.available_packets.clear()
+                        client_handler.outbound_queue.consume(written)
+
+                        if not written:
+                            break
 
                 except Exception as e:
                     print(e)
-                    print("Sender {} lost connection on port {}".format(client_handler.name, port))
-                    client_handler.srl.close()
-                    self.stale_ports.append(port)
+                    self._drop_port(port, retry=True)
+                    continue
+
+                written = pending - len(client_handler.outbound_queue)
+                client_handler.throughput.record(now, written, len(client_handler.outbound_queue) > 0)
+
+            try:
+                # hand everything waiting to the parser in one go rather than a byte at a time
+                num_waiting = client_handler.srl.in_waiting
+
+                if num_waiting:
+                    client_handler.packet_handler.add_bytes(client_handler.srl.read(num_waiting))
+
+                    client_handler.inbound_packet_buffer.extend(client_handler.packet_handler.available_packets)
+                    client_handler.packet_handler.available_packets.clear()
+
+            except Exception as e:
+                print(e)
+                self._drop_port(port, retry=True)
 
         self.handle_received_packets()
+
+    def _update_present_ports(self):
+        added, removed, changed = self._device_watcher.poll()
+
+        for port in removed:
+            self._present_ports.discard(port)
+            self._next_port_retry.pop(port, None)
+            self._port_retry_intervals.pop(port, None)
+
+            if port in self._client_dict.keys():
+                self._drop_port(port, retry=False)
+            else:
+                print("Serial USB device disappeared on {}".format(port))
+
+        for port in added:
+            print("Serial USB device detected on {}".format(port))
+            self._present_ports.add(port)
+
+        # usually udev finishing with the device node, so try a failed port again straight away
+        for port in changed:
+            self._next_port_retry.pop(port, None)
+
+    def _open_port(self, port):
+        serial = import_module("serial", "usb serial ports")
+
+        try:
+            srl = serial.Serial(port,
+                                parity=serial.PARITY_NONE,
+                                stopbits=serial.STOPBITS_ONE,
+                                bytesize=serial.EIGHTBITS,
+                                writeTimeout=0,
+                                timeout=0,
+                                rtscts=False,
+                                dsrdtr=False,
+                                xonxoff=False)
+
+        except Exception as e:
+            retry_interval = self._port_retry_intervals.get(port, self.min_port_retry_interval)
+
+            if retry_interval == self.min_port_retry_interval:
+                print("Failed to open serial USB device on {}, retrying: {}".format(port, e))
+
+            self._next_port_retry[port] = time.time() + retry_interval
+            self._port_retry_intervals[port] = min(retry_interval * 2, self.max_port_retry_interval)
+            return
+
+        self._next_port_retry.pop(port, None)
+        self._port_retry_intervals.pop(port, None)
+
+        client_handler = SerialClientHandler(port, srl)
+        self._client_dict[port] = client_handler
+
+        # boards we've seen on this port before go live straight away, the name handshake confirms it
+        cached_name = self._name_cache.get(port)
+
+        if cached_name:
+            self._set_client_name(client_handler, cached_name)
+            client_handler.state = ClientState.INITIALISED
+            print("Serial USB device on {} assumed to be {} from port cache".format(port, cached_name))
+
+    def _drop_port(self, port, retry):
+        client_handler = self._remove_client(port)
+
+        if client_handler.state == ClientState.INITIALISED:
+            print("Lost connection with {} on port {}".format(client_handler.name, port))
+        else:
+            print("Serial USB device disappeared on {}".format(port))
+
+        try:
+            client_handler.srl.close()
+
+        except Exception:
+            pass
+
+        if retry:
+            self._next_port_retry[port] = time.time() + self.min_port_retry_interval
+
+    def handle_received_packets(self):
+        for port, client_handler in self._client_dict.items():
+            for packet in list(client_handler.inbound_packet_buffer):
+                if packet["msgtype"] != "name_reply":
+                    continue
+
+                # name requests are resent until one's answered, so replies to the earlier ones can still turn up
+                # after we've verified the name. those are dropped here rather than reported as duplicates
+                if not client_handler.name_verified:
+                    if client_handler.name is None:
+                        print("Client at {} identified as {}".format(port, packet["name"]))
+
+                    elif client_handler.name != packet["name"]:
+                        print("Client at {} identified as {}, not cached name {}".format(port, packet["name"], client_handler.name))
+
+                    self._set_client_name(client_handler, packet["name"])
+                    client_handler.name_verified = True
+                    client_handler.state = ClientState.INITIALISED
+                    self._name_cache.set(port, client_handler.name)
+
+                client_handler.inbound_packet_buffer.remove(packet)
+
+        ConnectionHandler.handle_received_packets(self)
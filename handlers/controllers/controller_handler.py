@@ -1,3 +1,6 @@
+from handlers.packet_handler import CommHeader
+from handlers.packet_handler import SubscribePayload
+import time
 import ast
 
 
@@ -20,9 +23,10 @@ class Control:
 
 
 class Event:
-    def __init__(self, target_keyword, command, value):
-        self.target_keyword = target_keyword
-        self.command = command
+    def __init__(self, control, value):
+        self.control = control
+        self.target_keyword = control.target_keyword
+        self.command = control.command
         self.value = value
 
     def is_overlay(self):
@@ -40,6 +44,26 @@ class ControllerHandler():
         self._sliders = dict()
         self._events = list()
 
+        # slider events not yet collected, so a drag only delivers its latest value each frame
+        self._pending_slider_events = dict()
+
+        # "push" controllers stream change only control updates plus a periodic keepalive snapshot once subscribed.
+        # "poll" is the old request/reply behaviour, for controllers running older firmware
+        self.mode = config.get("mode", "push")
+
+        if self.mode not in ("push", "poll"):
+            raise Exception("ControllerHandler: unknown mode {}".format(self.mode))
+
+        self._request_timeout = 0.5
+        self._request_interval = 1.0 / 120
+        self._last_request = 0
+        self._waiting_reply = False
+
+        self._keepalive_interval = 1.0
+        self._last_subscribe = 0
+        self._last_packet = 0
+        self._subscribed = False
+
         for button in config.get("buttons", ""):
             self._buttons[button["id"]] = Control(name=button["name"],
                                                   id=button["id"],
@@ -67,14 +91,98 @@ class ControllerHandler():
     def update(self):
         pass
 
-    def _add_event(self, control):
-        self._events.append(Event(target_keyword=control.target_keyword, command=control.command, value=control.state))
+    def _update_from_connection(self, connection):
+        if not connection.is_connected(self.name):
+            self._waiting_reply = False
+            self._subscribed = False
+            return
+
+        if self.mode == "push":
+            # we've heard nothing for several keepalives, assume the controller lost our subscription
+            if self._subscribed and self._last_packet + self._keepalive_interval * 3 < time.time():
+                self._subscribed = False
+
+            if not self._subscribed and self._last_subscribe + self._request_timeout < time.time():
+                self._last_subscribe = time.time()
+                payload = SubscribePayload(keepalive_interval=self._keepalive_interval).get_bytes()
+                header = CommHeader(msgtype="subscribe", payload_len=len(payload)).get_bytes()
+                connection.send_bytes(self.name, header + payload)
+
+        else:
+            if self._waiting_reply and self._last_request + self._request_timeout < time.time():
+                self._waiting_reply = False
+
+            if not self._waiting_reply and self._last_request + self._request_interval < time.time():
+                self._last_request = time.time()
+                connection.send_request(self.name, "state_request")
+                self._waiting_reply = True
+
+        for packet in connection.get_packets(self.name):
+            self._last_packet = time.time()
+
+            if packet["msgtype"] == "state_reply":
+                self._waiting_reply = False
+                self._subscribed = self.mode == "push"
+                self._handle_state_reply(packet)
+
+            elif packet["msgtype"] == "control_update":
+                self._subscribed = self.mode == "push"
+                self._handle_control_update(packet)
+
+            else:
+                raise Exception("ControllerHandler {}: unhandled packet type {}".format(self.name, packet["msgtype"]))
+
+        connection.clear_packets(self.name)
+
+    def _handle_state_reply(self, packet):
+        buttons = packet["button_state"]
+        sliders = packet["slider_state"]
+
+        for i in range(len(buttons)):
+            self._set_button(i, buttons[i])
+
+        for i in range(len(sliders)):
+            self._set_slider(i, sliders[i])
+
+    def _handle_control_update(self, packet):
+        for kind, id, value in packet["updates"]:
+            if kind == "button":
+                self._set_button(id, value)
+
+            else:
+                self._set_slider(id, value)
+
+    def _set_button(self, id, value):
+        if id in self._buttons.keys():
+            self._buttons[id].set_state(value)
+
+            if value:
+                self._add_event(self._buttons[id])
+
+    def _set_slider(self, id, value):
+        if id in self._sliders.keys():
+            self._sliders[id].set_state(value)
+
+            if self._sliders[id].changed():
+                self._add_event(self._sliders[id], coalesce=True)
+
+    def _add_event(self, control, coalesce=False):
+        if coalesce and control in self._pending_slider_events.keys():
+            self._pending_slider_events[control].value = control.state
+            return
+
+        event = Event(control=control, value=control.state)
+        self._events.append(event)
+
+        if coalesce:
+            self._pending_slider_events[control] = event
 
     def get_events(self):
         return self._events
 
     def clear_events(self):
         self._events.clear()
+        self._pending_slider_events.clear()
 
     def get_controls(self):
         return list(self._buttons.values()) + list(self._sliders.values())
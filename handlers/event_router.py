@@ -0,0 +1,40 @@
+class Route:
+    def __init__(self, command):
+        self.command = command
+        self.is_overlay = command["type"] == "overlay"
+        self.fixtures = list()
+        self.video_handlers = list()
+        self.setting_handlers = list()
+
+
+# works out which fixtures, video handlers and settings each control drives once up front, rather than
+# matching target keywords against every one of them for every event
+class EventRouter:
+    def __init__(self):
+        self._routes = dict()
+
+    # call again whenever fixtures, handlers or controls are added or removed
+    def build(self, controllers, fixtures, video_handlers, setting_handlers):
+        self._routes = dict()
+
+        for controller in controllers:
+            for control in controller.get_controls():
+                route = Route(control.command)
+
+                if not route.is_overlay:
+                    route.fixtures = list(fixture for fixture in fixtures if control.target_keyword in fixture.name)
+
+                    route.setting_handlers = list(handler for name, handler in setting_handlers.items()
+                                                  if control.target_keyword in name)
+
+                    if control.command["type"] == "pattern" and control.command["name"] == "map_video":
+                        route.video_handlers = list(handler for name, handler in video_handlers.items()
+                                                    if control.target_keyword in name)
+
+                self._routes[control] = route
+
+    def get_routes(self):
+        return self._routes.items()
+
+    def get_route(self, control):
+        return self._routes[control]
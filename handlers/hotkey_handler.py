@@ -1,3 +1,4 @@
+from common.profiler import profiler
 import math
 import sys
 import select
@@ -13,6 +14,10 @@ class HotKeyHandler:
         while self.is_data():
             c = sys.stdin.read(1)
 
+            # stdin closed, nothing more to read
+            if not c:
+                break
+
             if c == "c":
                 for fixture in self.fixtures:
                     fixture.toggle_calibrate()
@@ -26,6 +31,12 @@ class HotKeyHandler:
             elif c == "l":
                 self.calibration_handler.add_angle_to_selection(math.pi/6.0)
 
+            elif c == "p":
+                profiler.toggle()
+
+            elif c == "t":
+                profiler.capture_trace()
+
             elif c == 'q':
                 self.exit = True
 
@@ -1,7 +1,7 @@
-from bitarray import bitarray
+from common.lazy_loader import import_module
+import struct
 
 
-# FIXME probably make this less fragile. strict mode?
 class CommHeader:
     signature = ord("~")
 
@@ -9,15 +9,30 @@ class CommHeader:
                    0x01: "name_reply",
                    0x02: "state_request",
                    0x03: "state_reply",
-                   0x04: "frame_update"}
+                   0x04: "frame_update",
+                   0x05: "subscribe",
+                   0x06: "control_update",
+                   0x07: "preview_subscribe",
+                   0x08: "preview_frame"}
 
     ops_by_str = {"name_request": 0x00,
                   "name_reply": 0x01,
                   "state_request": 0x02,
                   "state_reply": 0x03,
-                  "frame_update": 0x04}
+                  "frame_update": 0x04,
+                  "subscribe": 0x05,
+                  "control_update": 0x06,
+                  "preview_subscribe": 0x07,
+                  "preview_frame": 0x08}
 
-    header_len = 4
+    # signature, opcode, big endian payload length
+    header_struct = struct.Struct(">BBH")
+    header_len = header_struct.size
+
+    # payloads of 0xffff bytes or more put this in the length field and follow the header with a 32 bit length
+    extended_len_marker = 0xffff
+    extended_len_struct = struct.Struct(">I")
+    extended_header_len = header_len + extended_len_struct.size
 
     def __init__(self, payload_len=0, msgtype=None, bytes=None):
         if bytes:
@@ -26,35 +41,39 @@ class CommHeader:
 
         else:
             assert msgtype is not None, "Header must be instantiated with either a bytestream or a type"
-            self.signature = self.signature
             self.payload_len = payload_len
             self.opcode = self.ops_by_str[msgtype]
 
     def set_bytes(self, raw_bytes):
-        assert len(raw_bytes) == self.header_len, \
-            "selfHeader: invalid header length {}".format(len(raw_bytes))
+        if len(raw_bytes) not in (self.header_len, self.extended_header_len):
+            raise Exception("CommHeader: invalid header length {}".format(len(raw_bytes)))
+
+        signature, self.opcode, self.payload_len = self.header_struct.unpack_from(raw_bytes)
+
+        if signature != CommHeader.signature:
+            raise Exception("CommHeader: invalid signature {:02X}".format(signature))
+
+        if self.opcode not in self.ops_by_byte.keys():
+            raise Exception("CommHeader: invalid opcode {:02X}".format(self.opcode))
 
-        self.signature = int(raw_bytes[0])
-        assert self.signature == self.signature, \
-            "selfHeader: invalid signature {:04X}".format(self.signature)
+        if self.payload_len == self.extended_len_marker:
+            if len(raw_bytes) != self.extended_header_len:
+                raise Exception("CommHeader: extended length marker without extended length")
 
-        self.opcode = raw_bytes[1]
-        assert self.opcode in self.ops_by_byte.keys(), \
-            "selfHeader: invalid opcode {:02X}".format(self.opcode)
+            self.payload_len = self.extended_len_struct.unpack_from(raw_bytes, self.header_len)[0]
 
-        self.payload_len = raw_bytes[2] << 8 | raw_bytes[3]
+    def get_len(self):
+        return self.extended_header_len if self.payload_len >= self.extended_len_marker else self.header_len
 
     def get_bytes(self):
-        assert min(self.signature, self.opcode, self.payload_len) >= 0, \
-            "selfHeader: get_bytes called with uninitialised fields"
+        assert min(self.opcode, self.payload_len) >= 0, \
+            "CommHeader: get_bytes called with uninitialised fields"
 
-        header_bytes = bytearray()
-        header_bytes.append(self.signature)
-        header_bytes.append(self.opcode)
-        header_bytes.append(self.payload_len >> 8)
-        header_bytes.append(self.payload_len & 0xff)
+        if self.payload_len >= self.extended_len_marker:
+            return bytearray(self.header_struct.pack(self.signature, self.opcode, self.extended_len_marker) +
+                             self.extended_len_struct.pack(self.payload_len))
 
-        return header_bytes
+        return bytearray(self.header_struct.pack(self.signature, self.opcode, self.payload_len))
 
     def get_dict(self):
         return {"msgtype": self.ops_by_byte[self.opcode],
@@ -72,7 +91,8 @@ class NameReplyPayload:
             self.name = name
 
     def set_bytes(self, raw_bytes):
-        self.name = raw_bytes.decode('ascii')
+        # works for bytes, bytearrays and memoryviews alike
+        self.name = str(raw_bytes, 'ascii')
 
     def get_bytes(self):
         return bytes(map(ord, self.name))
@@ -98,48 +118,37 @@ class StateReplyPayload:
             self.slider_state = slider_state
 
     def set_bytes(self, raw_bytes):
-        assert len(raw_bytes) >= 1, \
-            "remaining length of packet is less than button bitfield width field"
-
-        button_bitfield_width = int(raw_bytes[0])
-
-        del(raw_bytes[0])
-
-        assert len(raw_bytes) >= button_bitfield_width, \
-            "remaining length of packet {} is less than specified button bitfield width {}".format(len(raw_bytes), button_bitfield_width)
-
-        for chunk in raw_bytes[0:button_bitfield_width]:
-            for bit in range(8):
-                self.button_state.append((chunk >> (7-bit)) & 1)
+        # read by offset rather than deleting from the front, so raw_bytes can be a read only memoryview
+        if len(raw_bytes) < 1:
+            raise Exception("StateReplyPayload: packet is shorter than button bitfield width field")
 
-        del(raw_bytes[0:button_bitfield_width])
+        button_bitfield_width = raw_bytes[0]
+        offset = 1
 
-        assert len(raw_bytes) >= 1, \
-            "remaining length of packet is less than num sliders field"
+        if len(raw_bytes) < offset + button_bitfield_width + 1:
+            raise Exception("StateReplyPayload: packet of length {} is shorter than specified button bitfield width {}".format(len(raw_bytes), button_bitfield_width))
 
-        num_sliders = int(raw_bytes[0])
+        button_bitfield = int.from_bytes(raw_bytes[offset:offset + button_bitfield_width], byteorder="big")
+        num_buttons = button_bitfield_width * 8
+        self.button_state = list((button_bitfield >> (num_buttons - 1 - bit)) & 1 for bit in range(num_buttons))
+        offset += button_bitfield_width
 
-        assert len(raw_bytes) >= num_sliders*2, \
-            "remaining length of packet is less than specified button bitfield width"
+        num_sliders = raw_bytes[offset]
+        offset += 1
 
-        del(raw_bytes[0])
+        if len(raw_bytes) < offset + num_sliders * 2:
+            raise Exception("StateReplyPayload: packet of length {} is shorter than specified number of sliders {}".format(len(raw_bytes), num_sliders))
 
-        for _ in range(num_sliders):
-            self.slider_state.append(raw_bytes[0] << 8 | raw_bytes[1])
-            del(raw_bytes[0:2])
+        self.slider_state = list(struct.unpack_from(">{}H".format(num_sliders), raw_bytes, offset))
 
     def get_bytes(self):
         state_bytes = bytearray()
 
-        button_bitfield = bitarray(endian='big')
+        button_bitfield = import_module("bitarray", "button state packets").bitarray(endian='big')
 
         for state in self.button_state:
             button_bitfield.append(state)
 
-        # fill out to whole bytes
-        # while len(button_bitfield) % 8 != 0:
-        #     button_bitfield.append(False)
-
         # button bitfield width
         bitfield_width = len(button_bitfield.tobytes())
         state_bytes.extend(bitfield_width.to_bytes(1, signed=False, byteorder="big"))
@@ -151,9 +160,7 @@ class StateReplyPayload:
         state_bytes.extend(len(self.slider_state).to_bytes(1, signed=False, byteorder="big"))
 
         # slider vals
-        for slider_val in self.slider_state:
-            state_bytes.append(slider_val >> 8)
-            state_bytes.append(slider_val & 0xff)
+        state_bytes.extend(struct.pack(">{}H".format(len(self.slider_state)), *self.slider_state))
 
         return state_bytes
 
@@ -163,46 +170,330 @@ class StateReplyPayload:
                 "button_state": self.button_state}
 
 
+class SubscribePayload:
+    payload_struct = struct.Struct(">H")
+
+    def __init__(self, keepalive_interval=None, bytes=None):
+        if bytes is not None:
+            assert keepalive_interval is None, "Payload must be initialised with either values or a bytestream"
+            self.set_bytes(bytes)
+
+        else:
+            assert keepalive_interval is not None, "Payload must be initialised with either values or a bytestream"
+            self.keepalive_interval = keepalive_interval
+
+    def set_bytes(self, raw_bytes):
+        if len(raw_bytes) != self.payload_struct.size:
+            raise Exception("SubscribePayload: invalid payload length {}".format(len(raw_bytes)))
+
+        # milliseconds on the wire
+        self.keepalive_interval = self.payload_struct.unpack_from(raw_bytes)[0] / 1000.0
+
+    def get_bytes(self):
+        return bytearray(self.payload_struct.pack(min(0xffff, int(round(self.keepalive_interval * 1000)))))
+
+    def get_dict(self):
+        return {"msgtype": "subscribe",
+                "keepalive_interval": self.keepalive_interval}
+
+
+class ControlUpdatePayload:
+    # control kind, control id, big endian value
+    update_struct = struct.Struct(">BBH")
+
+    kinds_by_byte = {0x00: "button",
+                     0x01: "slider"}
+
+    kinds_by_str = {"button": 0x00,
+                    "slider": 0x01}
+
+    def __init__(self, updates=None, bytes=None):
+        if bytes is not None:
+            assert updates is None, "Payload must be initialised with either values or a bytestream"
+            self.set_bytes(bytes)
+
+        else:
+            assert updates is not None, "Payload must be initialised with either values or a bytestream"
+            # list of (kind, id, value) tuples
+            self.updates = updates
+
+    def set_bytes(self, raw_bytes):
+        if len(raw_bytes) < 1:
+            raise Exception("ControlUpdatePayload: packet is shorter than num updates field")
+
+        num_updates = raw_bytes[0]
+
+        if len(raw_bytes) != 1 + num_updates * self.update_struct.size:
+            raise Exception("ControlUpdatePayload: packet of length {} does not hold {} updates".format(len(raw_bytes), num_updates))
+
+        self.updates = list()
+
+        for kind, id, value in self.update_struct.iter_unpack(raw_bytes[1:]):
+            if kind not in self.kinds_by_byte.keys():
+                raise Exception("ControlUpdatePayload: invalid control kind {:02X}".format(kind))
+
+            self.updates.append((self.kinds_by_byte[kind], id, value))
+
+    def get_bytes(self):
+        assert len(self.updates) <= 0xff, "ControlUpdatePayload: too many updates for one packet"
+
+        update_bytes = bytearray(len(self.updates).to_bytes(1, signed=False, byteorder="big"))
+
+        for kind, id, value in self.updates:
+            update_bytes.extend(self.update_struct.pack(self.kinds_by_str[kind], id, value))
+
+        return update_bytes
+
+    def get_dict(self):
+        return {"msgtype": "control_update",
+                "updates": self.updates}
+
+
+class PreviewSubscribePayload:
+    # frames per second (0 to unsubscribe), bits kept per colour channel, most pixels to send per fixture
+    payload_struct = struct.Struct(">BBH")
+
+    def __init__(self, fps=None, bits=8, max_pixels=0xffff, bytes=None):
+        if bytes is not None:
+            assert fps is None, "Payload must be initialised with either values or a bytestream"
+            self.set_bytes(bytes)
+
+        else:
+            assert fps is not None, "Payload must be initialised with either values or a bytestream"
+            self.fps = fps
+            self.bits = bits
+            self.max_pixels = max_pixels
+
+    def set_bytes(self, raw_bytes):
+        if len(raw_bytes) != self.payload_struct.size:
+            raise Exception("PreviewSubscribePayload: invalid payload length {}".format(len(raw_bytes)))
+
+        self.fps, self.bits, self.max_pixels = self.payload_struct.unpack_from(raw_bytes)
+
+        if not 1 <= self.bits <= 8:
+            raise Exception("PreviewSubscribePayload: invalid bits per channel {}".format(self.bits))
+
+        if self.max_pixels == 0:
+            raise Exception("PreviewSubscribePayload: max pixels must be nonzero")
+
+    def get_bytes(self):
+        return bytearray(self.payload_struct.pack(min(0xff, int(round(self.fps))), self.bits, min(0xffff, self.max_pixels)))
+
+    def get_dict(self):
+        return {"msgtype": "preview_subscribe",
+                "fps": self.fps,
+                "bits": self.bits,
+                "max_pixels": self.max_pixels}
+
+
+class PreviewFramePayload:
+    # sequence number, flags, number of fixtures
+    frame_struct = struct.Struct(">HBB")
+    keyframe_flag = 0x01
+
+    # followed by the fixture name, then its number of preview pixels
+    fixture_struct = struct.Struct(">H")
+
+    def __init__(self, seq=None, keyframe=False, fixtures=None, data=None, bytes=None):
+        if bytes is not None:
+            assert seq is None and fixtures is None and data is None, \
+                "Payload must be initialised with either values or a bytestream"
+            self.set_bytes(bytes)
+
+        else:
+            assert seq is not None and fixtures is not None and data is not None, \
+                "Payload must be initialised with either values or a bytestream"
+            self.seq = seq
+            self.keyframe = keyframe
+            # list of (name, num_pixels) tuples, in the order their pixels appear in data
+            self.fixtures = fixtures
+            # compressed rgb bytes, either whole or as a delta from the previous frame
+            self.data = data
+
+    def set_bytes(self, raw_bytes):
+        if len(raw_bytes) < self.frame_struct.size:
+            raise Exception("PreviewFramePayload: packet is shorter than frame header")
+
+        self.seq, flags, num_fixtures = self.frame_struct.unpack_from(raw_bytes)
+        self.keyframe = bool(flags & self.keyframe_flag)
+        offset = self.frame_struct.size
+
+        self.fixtures = list()
+
+        for _ in range(num_fixtures):
+            if len(raw_bytes) < offset + 1:
+                raise Exception("PreviewFramePayload: packet of length {} is too short for {} fixtures".format(len(raw_bytes), num_fixtures))
+
+            name_len = raw_bytes[offset]
+            offset += 1
+
+            if len(raw_bytes) < offset + name_len + self.fixture_struct.size:
+                raise Exception("PreviewFramePayload: packet of length {} is too short for {} fixtures".format(len(raw_bytes), num_fixtures))
+
+            name = str(raw_bytes[offset:offset + name_len], 'ascii')
+            offset += name_len
+
+            num_pixels = self.fixture_struct.unpack_from(raw_bytes, offset)[0]
+            offset += self.fixture_struct.size
+
+            self.fixtures.append((name, num_pixels))
+
+        self.data = bytes(raw_bytes[offset:])
+
+    def get_bytes(self):
+        assert len(self.fixtures) <= 0xff, "PreviewFramePayload: too many fixtures for one packet"
+
+        frame_bytes = bytearray(self.frame_struct.pack(self.seq & 0xffff, self.keyframe_flag if self.keyframe else 0, len(self.fixtures)))
+
+        for name, num_pixels in self.fixtures:
+            frame_bytes.extend(len(name).to_bytes(1, signed=False, byteorder="big"))
+            frame_bytes.extend(map(ord, name))
+            frame_bytes.extend(self.fixture_struct.pack(num_pixels))
+
+        frame_bytes.extend(self.data)
+
+        return frame_bytes
+
+    def get_dict(self):
+        return {"msgtype": "preview_frame",
+                "seq": self.seq,
+                "keyframe": self.keyframe,
+                "fixtures": self.fixtures,
+                "data": self.data}
+
+
 class CommPacketHandler:
-    def __init__(self):
+    # opcodes that never carry a payload. A nonzero length on one of these means we locked onto a stray signature
+    empty_ops = (CommHeader.ops_by_str["name_request"],
+                 CommHeader.ops_by_str["state_request"])
+
+    # opcodes we can receive. frame_update only ever flows host -> board
+    payload_types = {CommHeader.ops_by_str["name_reply"]: NameReplyPayload,
+                     CommHeader.ops_by_str["state_reply"]: StateReplyPayload,
+                     CommHeader.ops_by_str["subscribe"]: SubscribePayload,
+                     CommHeader.ops_by_str["control_update"]: ControlUpdatePayload,
+                     CommHeader.ops_by_str["preview_subscribe"]: PreviewSubscribePayload,
+                     CommHeader.ops_by_str["preview_frame"]: PreviewFramePayload}
+
+    # longest legal payload per opcode, so a false lock can't stall the parser waiting on a bogus length
+    max_payload_lens = {CommHeader.ops_by_str["name_reply"]: 0xff,
+                        CommHeader.ops_by_str["state_reply"]: 1 + 0xff + 1 + 0xff * 2,
+                        CommHeader.ops_by_str["subscribe"]: SubscribePayload.payload_struct.size,
+                        CommHeader.ops_by_str["control_update"]: 1 + 0xff * ControlUpdatePayload.update_struct.size,
+                        CommHeader.ops_by_str["preview_subscribe"]: PreviewSubscribePayload.payload_struct.size,
+                        CommHeader.ops_by_str["preview_frame"]: 1 << 22}
+
+    def __init__(self, compact_threshold=4096, msgtypes=None):
         self.available_packets = []
+
+        # links that can corrupt data should only accept what they expect to see, so a false lock on a stray
+        # signature can't stall the parser waiting on one of the huge payloads another link carries
+        if msgtypes is not None:
+            opcodes = set(CommHeader.ops_by_str[msgtype] for msgtype in msgtypes)
+            self.empty_ops = tuple(op for op in self.empty_ops if op in opcodes)
+            self.max_payload_lens = dict((op, max_len) for op, max_len in self.max_payload_lens.items() if op in opcodes)
+
+        # consumed bytes are skipped with a read offset and only dropped from the front of the buffer
+        # once they outweigh the unread ones, so trimming is amortised O(1) per byte
         self.buffer = bytearray()
-        self.header = None
+        self._read_offset = 0
+        self._compact_threshold = compact_threshold
+
+        # diagnostics
+        self.bytes_discarded = 0
+        self.resync_count = 0
 
     def add_bytes(self, new_bytes):
-        for new_byte in new_bytes:
-            self.buffer.append(new_byte)
+        self.buffer.extend(new_bytes)
+        self._parse()
+        self._compact()
 
-            if self.header is None and len(self.buffer) == CommHeader.header_len:
-                self.header = CommHeader(bytes=self.buffer)
+    def _parse(self):
+        header_len = CommHeader.header_len
+        signature = CommHeader.signature
 
-                # delete as we go for easier indexing
-                del(self.buffer[0:CommHeader.header_len])
+        with memoryview(self.buffer) as view:
+            while True:
+                # sync on the next signature, dropping anything before it
+                sync_index = self.buffer.find(signature, self._read_offset)
 
-            if self.header is not None and len(self.buffer) == self.header.payload_len:
-                if CommHeader.ops_by_byte[self.header.opcode] == "name_request":
-                    self.available_packets.append(self.header.get_dict())
+                if sync_index == -1:
+                    self._discard(len(self.buffer) - self._read_offset)
+                    return
 
-                elif CommHeader.ops_by_byte[self.header.opcode] == "name_reply":
-                    payload = NameReplyPayload(bytes=self.buffer)
-                    self.available_packets.append(payload.get_dict())
+                if sync_index != self._read_offset:
+                    self._discard(sync_index - self._read_offset)
 
-                elif CommHeader.ops_by_byte[self.header.opcode] == "state_request":
-                    # print("received state request")
-                    self.available_packets.append(self.header.get_dict())
+                if len(self.buffer) - self._read_offset < header_len:
+                    return
 
-                elif CommHeader.ops_by_byte[self.header.opcode] == "state_reply":
-                    # print("received state reply")
-                    payload = StateReplyPayload(bytes=self.buffer)
-                    self.available_packets.append(payload.get_dict())
+                _, opcode, payload_len = CommHeader.header_struct.unpack_from(view, self._read_offset)
+                packet_header_len = header_len
+
+                if payload_len == CommHeader.extended_len_marker:
+                    if len(self.buffer) - self._read_offset < CommHeader.extended_header_len:
+                        return
+
+                    payload_len = CommHeader.extended_len_struct.unpack_from(view, self._read_offset + header_len)[0]
+                    packet_header_len = CommHeader.extended_header_len
+
+                    # senders only use the extended form when they have to
+                    valid = payload_len >= CommHeader.extended_len_marker
+                else:
+                    valid = True
+
+                if opcode in self.empty_ops:
+                    valid = valid and payload_len == 0
+                else:
+                    valid = valid and payload_len <= self.max_payload_lens.get(opcode, -1)
+
+                if not valid:
+                    self._resync()
+                    continue
+
+                payload_start = self._read_offset + packet_header_len
+                payload_end = payload_start + payload_len
+
+                if payload_end > len(self.buffer):
+                    return
+
+                if opcode in self.empty_ops:
+                    self.available_packets.append({"msgtype": CommHeader.ops_by_byte[opcode],
+                                                   "payload_len": 0})
 
                 else:
-                    raise Exception("StatePacketHandler: unhandled opcode {}".format(self.header.opcode))
+                    try:
+                        payload = self.payload_types[opcode](bytes=view[payload_start:payload_end])
+
+                    except Exception:
+                        self._resync()
+                        continue
+
+                    self.available_packets.append(payload.get_dict())
+
+                self._read_offset = payload_end
+
+    def _discard(self, num_bytes):
+        self._read_offset += num_bytes
+        self.bytes_discarded += num_bytes
+
+    def _resync(self):
+        # skip this signature byte, the next scan picks up the following one
+        self.resync_count += 1
+        self._discard(1)
+
+    def _compact(self):
+        if self._read_offset == len(self.buffer):
+            self.buffer.clear()
+            self._read_offset = 0
 
-                del(self.buffer[0:self.header.payload_len])
+        elif self._read_offset > self._compact_threshold and self._read_offset * 2 > len(self.buffer):
+            del self.buffer[:self._read_offset]
+            self._read_offset = 0
 
-                self.header = None
+    def pending_bytes(self):
+        return len(self.buffer) - self._read_offset
 
     def clear(self):
         self.buffer = bytearray()
-        self.header = None
+        self._read_offset = 0
@@ -1,9 +1,14 @@
 import os
-import imageio
 from common.utils import nonzero
+from common.lazy_loader import import_module
+from collections import namedtuple
 import numpy as np
 
 
+# swapped out whole by the setters, so a sample taken on a render thread never sees half an update
+PaletteSettings = namedtuple("PaletteSettings", ["master_palette_name", "palette_space_factor", "palette_time_factor"])
+
+
 class PaletteHandler:
     def __init__(self, palette_path):
         self.palette_path = os.path.join(os.getcwd(), palette_path)
@@ -19,9 +24,33 @@ class PaletteHandler:
 
         assert len(self.palettes) > 0, "No parsable palette files present!"
 
-        self.palette_space_factor = 3.0
-        self.palette_time_factor = 1.0
-        self.master_palette_name = self.palette_names[0]
+        self._settings = PaletteSettings(master_palette_name=self.palette_names[0],
+                                         palette_space_factor=3.0,
+                                         palette_time_factor=1.0)
+
+    @property
+    def master_palette_name(self):
+        return self._settings.master_palette_name
+
+    @master_palette_name.setter
+    def master_palette_name(self, name):
+        self._settings = self._settings._replace(master_palette_name=name)
+
+    @property
+    def palette_space_factor(self):
+        return self._settings.palette_space_factor
+
+    @palette_space_factor.setter
+    def palette_space_factor(self, value):
+        self._settings = self._settings._replace(palette_space_factor=value)
+
+    @property
+    def palette_time_factor(self):
+        return self._settings.palette_time_factor
+
+    @palette_time_factor.setter
+    def palette_time_factor(self, value):
+        self._settings = self._settings._replace(palette_time_factor=value)
 
     def set_master_palette_name(self, name):
         self.master_palette_name = name
@@ -32,7 +61,7 @@ class PaletteHandler:
         for filename in os.listdir(self.palette_path):
             if filename.endswith(".bmp"):
                 try:
-                    image = imageio.imread(os.path.join(self.palette_path, filename))
+                    image = import_module("imageio", "palette images").imread(os.path.join(self.palette_path, filename))
                     indices = list(int(i * (len(image[0]) - 1) / self.standard_palette_len) for i in range(self.standard_palette_len))
 
                     rgb_buffer = np.array(image[0])[indices].astype(np.float32)
@@ -56,10 +85,12 @@ class PaletteHandler:
         self.palette_time_factor = value * 2.0  # expect 0 to 1
 
     def sample_positional(self, position, palette_name):
+        settings = self._settings
+
         palette_to_use = palette_name
 
         if not palette_name:
-            palette_to_use = self.master_palette_name
+            palette_to_use = settings.master_palette_name
 
         palette_index = self.palette_names.index(palette_to_use)
 
@@ -69,10 +100,12 @@ class PaletteHandler:
         return self.palettes[palette_index][index]
 
     def sample_positional_all(self, positions, palette_name):
+        settings = self._settings
+
         palette_to_use = palette_name
 
         if not palette_name:
-            palette_to_use = self.master_palette_name
+            palette_to_use = settings.master_palette_name
 
         palette_index = self.palette_names.index(palette_to_use)
 
@@ -82,22 +115,24 @@ class PaletteHandler:
         return self.palettes[palette_index][list(indices.astype(int))].astype(np.float32)
 
     def sample_radial(self, space_delta, time_delta, space_factor, time_factor, palette_name):
+        settings = self._settings
+
         assert 0 <= time_factor <= 1.0, "Time factor must be between 0 and 1"
         assert 0 <= space_factor <= 1.0, "Space factor must be between 0 and 1"
 
         palette_to_use = palette_name
 
         if not palette_name:
-            palette_to_use = self.master_palette_name
+            palette_to_use = settings.master_palette_name
 
         palette_index = self.palette_names.index(palette_to_use)
 
         if palette_index == -1:
             raise Exception("unknown palette name ", palette_to_use)
 
-        time_delta *= self.palette_time_factor * time_factor
+        time_delta *= settings.palette_time_factor * time_factor
 
-        total_progress = space_delta * self.palette_space_factor * space_factor
+        total_progress = space_delta * settings.palette_space_factor * space_factor
         total_progress -= time_delta
         total_progress *= self.standard_palette_len
 
@@ -109,22 +144,23 @@ class PaletteHandler:
         return self.palettes[palette_index][int(total_progress)]
 
     def sample_radial_all(self, space_deltas, time_delta, space_factor, time_factor, palette_name):
+        settings = self._settings
 
         assert 0 <= time_factor <= 1.0, "Time factor must be between 0 and 1"
         assert 0 <= space_factor <= 1.0, "Space factor must be between 0 and 1"
         palette_to_use = palette_name
 
         if not palette_name:
-            palette_to_use = self.master_palette_name
+            palette_to_use = settings.master_palette_name
 
         palette_index = self.palette_names.index(palette_to_use)
 
         if palette_index == -1:
             raise Exception("unknown palette name ", palette_to_use)
 
-        time_delta *= self.palette_time_factor * time_factor
+        time_delta *= settings.palette_time_factor * time_factor
 
-        total_progress = np.array((space_deltas * (self.palette_space_factor * space_factor)))
+        total_progress = np.array((space_deltas * (settings.palette_space_factor * space_factor)))
         total_progress -= time_delta
         total_progress %= 1
         total_progress *= self.standard_palette_len
@@ -0,0 +1,175 @@
+from common.profiler import profiler
+import numpy as np
+
+
+# where one run of a fixture's pixels goes: num_pixels pixels from first_pixel on, landing offset pixels into the
+# sender's line, last pixel first if reverse. in the config a fixture's "senders" entries are either lists,
+#   [sender, line] or [sender, line, first_pixel, num_pixels]
+# or, for everything else, dicts with sender and line plus any of first_pixel, num_pixels, offset and reverse
+class Patch:
+    def __init__(self, sender, line, first_pixel=0, num_pixels=None, offset=0, reverse=False):
+        self.sender = sender
+        self.line = line
+        self.first_pixel = first_pixel
+        self.num_pixels = num_pixels
+        self.offset = offset
+        self.reverse = reverse
+
+    @staticmethod
+    def get_sender_name(entry):
+        return entry["sender"] if isinstance(entry, dict) else entry[0]
+
+    @staticmethod
+    def from_conf(entry, senders):
+        if isinstance(entry, dict):
+            return Patch(senders[entry["sender"]], entry["line"], entry.get("first_pixel", 0), entry.get("num_pixels", None),
+                         entry.get("offset", 0), entry.get("reverse", False))
+
+        return Patch(senders[entry[0]], *entry[1:])
+
+
+class PatchLine:
+    def __init__(self, sender, line, rgb, indices):
+        self.sender = sender
+        self.line = line
+        self.rgb = rgb
+        self.indices = indices
+
+
+# compiles every fixture's patches into one gather index array per sender line. each frame the fixtures encode into
+# slots of a flat byte buffer, one buffer for senders that take fixtures' own channel orders and one for simulators
+# that always take rgb, and each line is then a single take() from its buffer. a spare zero byte at the end of each
+# buffer is what gaps in a line gather from
+class PatchMap:
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+
+        # (fixture name, rgb) -> (start, end) of that fixture's encoded bytes
+        self._slots = dict()
+        self._sizes = {False: 0, True: 0}
+
+        for fixture in fixtures:
+            for patch in fixture.patches:
+                rgb = patch.sender.is_simulator
+
+                if (fixture.name, rgb) not in self._slots.keys():
+                    size = fixture.num_pixels * self.get_channels(fixture, rgb)
+                    self._slots[(fixture.name, rgb)] = (self._sizes[rgb], self._sizes[rgb] + size)
+                    self._sizes[rgb] += size
+
+        self._buffers = dict((rgb, np.zeros(size + 1, dtype=np.uint8)) for rgb, size in self._sizes.items())
+
+        # what each fixture has to encode each frame
+        self._encodings = dict((fixture.name, list((rgb, start, end) for (name, rgb), (start, end) in self._slots.items()
+                                                   if name == fixture.name))
+                               for fixture in fixtures)
+
+        self.lines = self.compile()
+
+    @staticmethod
+    def get_channels(fixture, rgb):
+        return 3 if rgb else len(fixture.channel_order)
+
+    def _get_line_patches(self):
+        line_patches = dict()
+
+        for fixture in self.fixtures:
+            for patch in fixture.patches:
+                num_pixels = fixture.num_pixels - patch.first_pixel if patch.num_pixels is None else patch.num_pixels
+
+                if patch.first_pixel < 0 or num_pixels < 0 or patch.first_pixel + num_pixels > fixture.num_pixels:
+                    raise Exception("PatchMap: {} line {} takes pixels {}-{} of {}, which only has {}".format(
+                                    patch.sender.name, patch.line, patch.first_pixel, patch.first_pixel + num_pixels - 1,
+                                    fixture.name, fixture.num_pixels))
+
+                line_patches.setdefault((patch.sender.name, patch.line), list()).append((fixture, patch, num_pixels))
+
+        return line_patches
+
+    def compile(self):
+        lines = list()
+
+        for (sender_name, line), patches in self._get_line_patches().items():
+            sender = patches[0][1].sender
+            rgb = sender.is_simulator
+            channels = set(self.get_channels(fixture, rgb) for fixture, _, _ in patches)
+
+            if len(channels) > 1:
+                raise Exception("PatchMap: {} line {} mixes fixtures with different channel counts".format(sender_name, line))
+
+            channels = channels.pop()
+            line_length = max(patch.offset + num_pixels for _, patch, num_pixels in patches)
+
+            # byte offset of each of the line's pixels in the buffer, gaps pointing at the spare zero
+            pixel_sources = np.full(line_length, -1, dtype=np.intp)
+
+            for fixture, patch, num_pixels in patches:
+                start, _ = self._slots[(fixture.name, rgb)]
+                sources = start + (patch.first_pixel + np.arange(num_pixels, dtype=np.intp)) * channels
+
+                if patch.reverse:
+                    sources = sources[::-1]
+
+                destination = pixel_sources[patch.offset:patch.offset + num_pixels]
+
+                if np.any(destination >= 0):
+                    raise Exception("PatchMap: {} overlaps another fixture on {} line {}".format(fixture.name, sender_name, line))
+
+                destination[:] = sources
+
+            gaps = pixel_sources < 0
+            indices = pixel_sources[:, np.newaxis] + np.arange(channels, dtype=np.intp)
+            indices[gaps] = len(self._buffers[rgb]) - 1
+
+            lines.append(PatchLine(sender, line, rgb, indices.reshape(-1)))
+
+        return lines
+
+    # move the buffers into memory forked render workers can fill for us
+    def share(self, allocate):
+        for rgb, buffer in self._buffers.items():
+            shared = allocate(buffer.dtype, buffer.shape)
+            shared[:] = buffer
+            self._buffers[rgb] = shared
+
+    def encode(self, fixture):
+        if profiler.enabled:
+            profiler.timed("encode", fixture.name, self._encode, fixture)
+        else:
+            self._encode(fixture)
+
+    def _encode(self, fixture):
+        for rgb, start, end in self._encodings[fixture.name]:
+            self._buffers[rgb][start:end] = fixture.get_pixels(force_rgb=rgb)
+
+    def send(self):
+        for patch_line in self.lines:
+            if profiler.enabled:
+                profiler.timed("send", "{} line {}".format(patch_line.sender.name, patch_line.line), self._send_line, patch_line)
+            else:
+                self._send_line(patch_line)
+
+    def _send_line(self, patch_line):
+        patch_line.sender.send(patch_line.line, np.take(self._buffers[patch_line.rgb], patch_line.indices))
+
+    # where each of a sender's lines' pixels are, gaps at the origin, for simulators that need a layout
+    def get_line_coords(self, sender_name):
+        line_coords = dict()
+
+        for (name, line), patches in self._get_line_patches().items():
+            if name != sender_name:
+                continue
+
+            coords = [[0.0, 0.0, 0.0]] * max(patch.offset + num_pixels for _, patch, num_pixels in patches)
+
+            for fixture, patch, num_pixels in patches:
+                fixture_coords = fixture.get_coords()[patch.first_pixel:patch.first_pixel + num_pixels]
+
+                if patch.reverse:
+                    fixture_coords.reverse()
+
+                coords[patch.offset:patch.offset + num_pixels] = fixture_coords
+
+            line_coords[line] = coords
+
+        return line_coords
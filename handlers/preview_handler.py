@@ -0,0 +1,187 @@
+from handlers.packet_handler import CommHeader
+from handlers.packet_handler import PreviewFramePayload
+import numpy as np
+import time
+import zlib
+
+
+class PreviewStream:
+    def __init__(self, fps, bits, max_pixels):
+        self.interval = 1.0 / fps
+        self.bits = bits
+        self.max_pixels = max_pixels
+        self.next_send = 0.0
+        self.seq = 0
+
+        # what we last queued for this client. deltas are always against this, so a dropped frame costs nothing
+        self.reference = None
+        self.layout = None
+
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+    def encode(self, layout, frame, compress_level):
+        keyframe = self.reference is None or layout != self.layout
+
+        # xor against the last frame leaves mostly zeros for zlib to squash
+        data = frame if keyframe else np.bitwise_xor(frame, self.reference)
+
+        payload = PreviewFramePayload(seq=self.seq,
+                                      keyframe=keyframe,
+                                      fixtures=layout,
+                                      data=zlib.compress(data.tobytes(), compress_level)).get_bytes()
+
+        header = CommHeader(msgtype="preview_frame", payload_len=len(payload)).get_bytes()
+
+        self.reference = frame
+        self.layout = layout
+        self.seq = (self.seq + 1) & 0xffff
+        self.frames_sent += 1
+
+        return header + payload
+
+
+# streams a downsampled copy of what the fixtures are showing to any socket clients that subscribe to it
+class PreviewHandler:
+    def __init__(self, socket_server, backlog_limit=0, compress_level=1):
+        self._socket_server = socket_server
+        self._streams = dict()
+
+        # preview frames are only queued for clients with no more than this many bytes still to send,
+        # so a slow client sheds frames rather than falling behind on control traffic
+        self.backlog_limit = backlog_limit
+        self.compress_level = compress_level
+
+        self._bin_cache = dict()
+
+    def update(self, fixtures):
+        for name, request in self._socket_server.take_preview_requests().items():
+            if request["fps"] > 0:
+                print("PreviewHandler: streaming to {} at {}fps, {} bits per channel, up to {} pixels per fixture".format(
+                      name, request["fps"], request["bits"], request["max_pixels"]))
+                self._streams[name] = PreviewStream(request["fps"], request["bits"], request["max_pixels"])
+
+            elif name in self._streams.keys():
+                self._stop_stream(name)
+
+        for name in list(name for name in self._streams.keys() if not self._socket_server.is_connected(name)):
+            self._stop_stream(name)
+
+        if not self._streams:
+            return
+
+        now = time.time()
+
+        # clients asking for the same resolution share one sampled frame
+        frames = dict()
+
+        for name, stream in self._streams.items():
+            if stream.next_send > now:
+                continue
+
+            # don't try to make up for lost time with a burst of frames
+            stream.next_send = max(stream.next_send + stream.interval, now)
+
+            if self._socket_server.get_pending_bytes(name) > self.backlog_limit:
+                stream.frames_dropped += 1
+                continue
+
+            key = (stream.bits, stream.max_pixels)
+
+            if key not in frames.keys():
+                frames[key] = self._sample(fixtures, stream.bits, stream.max_pixels)
+
+            layout, frame = frames[key]
+            self._socket_server.send_bytes(name, stream.encode(layout, frame, self.compress_level))
+
+    def _stop_stream(self, name):
+        stream = self._streams.pop(name)
+        print("PreviewHandler: stopped streaming to {}, {} frames sent, {} dropped".format(name, stream.frames_sent, stream.frames_dropped))
+
+    def _get_bins(self, num_pixels, max_pixels):
+        key = (num_pixels, max_pixels)
+
+        if key not in self._bin_cache.keys():
+            starts = np.unique(np.linspace(0, num_pixels, min(num_pixels, max_pixels), endpoint=False).astype(np.intp))
+            counts = np.diff(np.append(starts, num_pixels)).reshape(-1, 1)
+            self._bin_cache[key] = (starts, counts)
+
+        return self._bin_cache[key]
+
+    def _sample(self, fixtures, bits, max_pixels):
+        layout = list()
+        chunks = list()
+        mask = (0xff << (8 - bits)) & 0xff
+
+        for fixture in fixtures:
+            colours = fixture.get_preview_colours()
+
+            if colours is None or len(colours) == 0:
+                continue
+
+            # average runs of neighbouring pixels down to the requested resolution
+            starts, counts = self._get_bins(len(colours), max_pixels)
+
+            if len(starts) < len(colours):
+                colours = np.add.reduceat(colours, starts, axis=0) / counts
+
+            # dropping the low bits keeps flicker out of the deltas, and they're invisible in a preview anyway
+            quantised = np.clip(colours, 0, 255).astype(np.uint8)
+            quantised &= mask
+
+            layout.append((fixture.name, len(quantised)))
+            chunks.append(quantised.reshape(-1))
+
+        frame = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint8)
+
+        return layout, frame
+
+
+# rebuilds preview frames on the client side
+class PreviewDecoder:
+    def __init__(self):
+        self.layout = None
+        self.frame = None
+        self.next_seq = None
+
+    def reset(self):
+        self.layout = None
+        self.frame = None
+        self.next_seq = None
+
+    # returns a list of (fixture name, num_pixels x 3 uint8 array) tuples, or None if the frame can't be decoded
+    # and the stream needs restarting from a keyframe
+    def decode(self, packet):
+        try:
+            data = np.frombuffer(zlib.decompress(packet["data"]), dtype=np.uint8)
+
+        except zlib.error:
+            self.reset()
+            return None
+
+        if len(data) != sum(num_pixels for _, num_pixels in packet["fixtures"]) * 3:
+            self.reset()
+            return None
+
+        if packet["keyframe"]:
+            frame = data
+
+        else:
+            if self.frame is None or packet["fixtures"] != self.layout or packet["seq"] != self.next_seq:
+                self.reset()
+                return None
+
+            frame = np.bitwise_xor(self.frame, data)
+
+        self.frame = frame
+        self.layout = packet["fixtures"]
+        self.next_seq = (packet["seq"] + 1) & 0xffff
+
+        fixture_colours = list()
+        offset = 0
+
+        for name, num_pixels in self.layout:
+            fixture_colours.append((name, frame[offset:offset + num_pixels * 3].reshape(-1, 3)))
+            offset += num_pixels * 3
+
+        return fixture_colours
@@ -0,0 +1,312 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import RawArray
+import multiprocessing
+import numpy as np
+import traceback
+import signal
+import time
+import gc
+import os
+
+
+class FixtureBuffers:
+    # output for one fixture, in memory shared with the workers. the main process only ever reads these
+    def __init__(self, fixture):
+        self.colours = self._shared_array(np.float32, (fixture.num_pixels, 3))
+
+    @staticmethod
+    def _shared_array(dtype, shape):
+        num_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return np.frombuffer(RawArray("b", max(num_bytes, 1)), dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+class RenderWorker:
+    # runs in a forked child, so it starts with its own copy of every fixture, pattern and handler. it only renders
+    # the fixtures it is assigned, but applies every command to all of them so it can take over any fixture later
+    def __init__(self, conn, fixtures, buffers, patch_map, overlay_handler, palette_handler, video_handlers, calibration_handler):
+        self.conn = conn
+        self.fixtures = fixtures
+        self.fixtures_by_name = dict((fixture.name, fixture) for fixture in fixtures)
+        self.buffers = buffers
+        self.patch_map = patch_map
+        self.overlay_handler = overlay_handler
+        self.palette_handler = palette_handler
+        self.video_handlers = video_handlers
+        self.calibration_handler = calibration_handler
+        self.assigned = list()
+
+    def run(self):
+        # ctrl-c is for the main process, which will tell us when to stop
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        # the main process's frame scheduler turned gc off before we forked, and it won't be running ours
+        gc.enable()
+
+        for fixture in self.fixtures:
+            fixture.scheduler = None
+
+        while True:
+            message = self.conn.recv()
+
+            if message[0] == "frame":
+                try:
+                    self.conn.send(("done", self.render(*message[1:])))
+
+                except Exception:
+                    self.conn.send(("error", traceback.format_exc()))
+
+            elif message[0] == "assign":
+                self.assigned = message[1]
+
+            elif message[0] == "stop":
+                break
+
+    def render(self, effective_time, smoothness, brightness, palette_settings, calibration, commands):
+        master_palette_name, palette_space_factor, palette_time_factor = palette_settings
+        self.palette_handler.master_palette_name = master_palette_name
+        self.palette_handler.palette_space_factor = palette_space_factor
+        self.palette_handler.palette_time_factor = palette_time_factor
+
+        angles, selection, calibrating = calibration
+        self.calibration_handler.config = angles
+        self.calibration_handler.current_selection = selection
+
+        for fixture, calibrate in zip(self.fixtures, calibrating):
+            fixture.calibrate = calibrate
+
+        for command in commands:
+            if command[0] == "fixture":
+                self.fixtures_by_name[command[1]].receive_command(command[2], command[3])
+
+            elif command[0] == "overlay":
+                self.overlay_handler.receive_command(command[1], effective_time)
+
+            elif command[0] == "video":
+                self.video_handlers[command[1]].receive_command(command[2])
+
+        assigned_fixtures = list(self.fixtures[index] for index in self.assigned)
+
+        # only step the videos our own fixtures are sampling
+        for video_handler in set(fixture.video_handler for fixture in assigned_fixtures if fixture.video_handler):
+            video_handler.update(effective_time)
+
+        costs = dict()
+
+        for index in self.assigned:
+            start = time.perf_counter()
+
+            fixture = self.fixtures[index]
+
+            # fixtures render straight into their shared buffers, see RenderPool
+            fixture.update(effective_time, self.palette_handler, smoothness, brightness)
+            self.patch_map.encode(fixture)
+
+            costs[index] = time.perf_counter() - start
+
+        self.overlay_handler.update(effective_time)
+
+        return costs
+
+
+# renders fixtures in a pool of worker processes. the main process hands out the frame clock, settings and commands,
+# waits for the workers to fill the shared output buffers, then sends them on
+class RenderPool:
+    def __init__(self, fixtures, patch_map, overlay_handler, palette_handler, video_handlers, calibration_handler,
+                 num_workers=None, timeout=5.0):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise Exception("RenderPool: process rendering needs fork, which this platform doesn't have")
+
+        self.fixtures = fixtures
+        self.patch_map = patch_map
+        self.palette_handler = palette_handler
+        self.calibration_handler = calibration_handler
+        self.timeout = timeout
+
+        self.num_workers = max(1, min(num_workers or os.cpu_count() or 1, len(fixtures)))
+
+        self.buffers = list(FixtureBuffers(fixture) for fixture in fixtures)
+
+        # the workers encode straight into the patch map's buffers, so sending is the same as when rendering in process
+        patch_map.share(FixtureBuffers._shared_array)
+
+        # the rest of pyzzazz reads fixture output from the shared buffers from now on, e.g. for previews
+        for fixture, buffers in zip(fixtures, self.buffers):
+            fixture.overlaid_colours = buffers.colours
+
+        self._commands = list()
+        self._video_handler_names = dict((id(handler), name) for name, handler in video_handlers.items())
+
+        # seconds per frame per fixture, smoothed. the patterns' cost hints are a fair guess until we've measured
+        self.costs = list(fixture.get_cost_hint() for fixture in fixtures)
+        self._cost_smoothing = 0.2
+        self._rebalance_threshold = 0.9
+
+        context = multiprocessing.get_context("fork")
+        self._connections = list()
+        self._processes = list()
+
+        for _ in range(self.num_workers):
+            parent_conn, child_conn = context.Pipe()
+            worker = RenderWorker(child_conn, fixtures, self.buffers, patch_map, overlay_handler, palette_handler, video_handlers,
+                                  calibration_handler)
+
+            process = context.Process(target=worker.run, daemon=True)
+            process.start()
+
+            self._connections.append(parent_conn)
+            self._processes.append(process)
+
+        self.assignments = self.partition(self.costs)
+        self._send_assignments()
+
+        print("RenderPool: rendering {} fixtures on {} worker processes".format(len(fixtures), self.num_workers))
+
+    def queue_fixture_command(self, fixture, command, value):
+        self._commands.append(("fixture", fixture.name, command, value))
+
+    def queue_overlay_command(self, command):
+        self._commands.append(("overlay", command))
+
+    def queue_video_command(self, video_handler, command):
+        self._commands.append(("video", self._video_handler_names[id(video_handler)], command))
+
+    def render(self, effective_time, smoothness, brightness):
+        palette_settings = (self.palette_handler.master_palette_name,
+                            self.palette_handler.palette_space_factor,
+                            self.palette_handler.palette_time_factor)
+
+        calibration = (dict(self.calibration_handler.config),
+                       self.calibration_handler.current_selection,
+                       list(fixture.calibrate for fixture in self.fixtures))
+
+        message = ("frame", effective_time, smoothness, brightness, palette_settings, calibration, self._commands)
+        self._commands = list()
+
+        for conn in self._connections:
+            conn.send(message)
+
+        for conn in self._connections:
+            if not conn.poll(self.timeout):
+                raise Exception("RenderPool: worker took longer than {}s to render a frame".format(self.timeout))
+
+            reply = conn.recv()
+
+            if reply[0] == "error":
+                raise Exception("RenderPool: worker failed to render a frame\n{}".format(reply[1]))
+
+            for index, cost in reply[1].items():
+                self.costs[index] += (cost - self.costs[index]) * self._cost_smoothing
+
+    def send(self):
+        self.patch_map.send()
+
+    def partition(self, costs):
+        # longest processing time first, each fixture onto whichever worker has the least work so far
+        loads = [0.0] * self.num_workers
+        assignments = list(list() for _ in range(self.num_workers))
+
+        for index in sorted(range(len(costs)), key=lambda i: costs[i], reverse=True):
+            worker = loads.index(min(loads))
+            assignments[worker].append(index)
+            loads[worker] += costs[index]
+
+        return assignments
+
+    def get_makespan(self, assignments):
+        return max(sum(self.costs[index] for index in assigned) for assigned in assignments)
+
+    def rebalance(self):
+        assignments = self.partition(self.costs)
+
+        # moving a fixture costs it whatever animation state the old worker had, so only move for a real gain
+        if self.get_makespan(assignments) < self.get_makespan(self.assignments) * self._rebalance_threshold:
+            self.assignments = assignments
+            self._send_assignments()
+
+    def _send_assignments(self):
+        for conn, assigned in zip(self._connections, self.assignments):
+            conn.send(("assign", assigned))
+
+    def shut_down(self):
+        for conn in self._connections:
+            try:
+                conn.send(("stop",))
+
+            except (BrokenPipeError, EOFError):
+                pass
+
+        for process in self._processes:
+            process.join(timeout=1.0)
+
+            if process.is_alive():
+                process.terminate()
+
+
+# renders fixtures on a thread pool in this process. cheaper to set up than the process pool and nothing needs copying,
+# but it only pays off once fixtures are big enough that numpy spends most of the frame with the gil released
+class ThreadRenderPool:
+    def __init__(self, fixtures, patch_map, overlay_handler, palette_handler, video_handlers, num_workers=None):
+        self.fixtures = fixtures
+        self.patch_map = patch_map
+        self.overlay_handler = overlay_handler
+        self.palette_handler = palette_handler
+        self.video_handlers = video_handlers
+
+        self.num_workers = max(1, min(num_workers or os.cpu_count() or 1, len(fixtures)))
+        self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="render")
+
+        # applied at the start of the next frame, same as the process pool
+        self._commands = list()
+
+        print("RenderPool: rendering {} fixtures on {} threads".format(len(fixtures), self.num_workers))
+
+    def queue_fixture_command(self, fixture, command, value):
+        self._commands.append(("fixture", fixture, command, value))
+
+    def queue_overlay_command(self, command):
+        self._commands.append(("overlay", command))
+
+    def queue_video_command(self, video_handler, command):
+        self._commands.append(("video", video_handler, command))
+
+    def render(self, effective_time, smoothness, brightness):
+        for command in self._commands:
+            if command[0] == "fixture":
+                command[1].receive_command(command[2], command[3])
+
+            elif command[0] == "overlay":
+                self.overlay_handler.receive_command(command[1], effective_time)
+
+            elif command[0] == "video":
+                command[1].receive_command(command[2])
+
+        self._commands.clear()
+
+        for video_handler in self.video_handlers.values():
+            video_handler.update(effective_time)
+
+        self.render_fixtures(effective_time, smoothness, brightness)
+
+        self.overlay_handler.update(effective_time)
+
+    def render_fixtures(self, effective_time, smoothness, brightness):
+        # the slowest fixtures go first so a long one doesn't start last and hold up the whole frame. patterns change, so
+        # this is worked out every frame
+        render_order = sorted(self.fixtures, key=lambda fixture: fixture.get_cost_hint(), reverse=True)
+
+        futures = list(self._executor.submit(fixture.update, effective_time, self.palette_handler, smoothness, brightness)
+                       for fixture in render_order)
+
+        # result() re-raises anything a render thread threw
+        for future in futures:
+            future.result()
+
+    def send(self):
+        # senders aren't thread safe, and want lines in a consistent order anyway
+        for fixture in self.fixtures:
+            fixture.send()
+
+        self.patch_map.send()
+
+    def shut_down(self):
+        self._executor.shutdown(wait=True)
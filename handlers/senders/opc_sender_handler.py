@@ -1,5 +1,5 @@
 from handlers.senders.sender_handler import SenderHandler
-import openpixelcontrol.python.opc as opc
+from common.lazy_loader import import_module
 import subprocess
 import json
 import os
@@ -14,6 +14,8 @@ class OpcSenderHandler(SenderHandler):
 
         self.ip = config.get("ip")
         self.port = config.get("port")
+        # a submodule, so a checkout without it can still run everything else
+        opc = import_module("openpixelcontrol.python.opc", "opc senders")
         self._client = opc.Client(":".join([self.ip, self.port]))
         self._previously_connected = False
 
@@ -32,13 +34,8 @@ class OpcSenderHandler(SenderHandler):
         if "ip" not in config.keys():
             raise Exception("Sender: config contains no ip")
 
-    def generate_layout_files(self, fixtures):
-        fixtures_list = dict()
-
-        for fix in fixtures:
-            for sender_info in fix.senders_info:
-                if sender_info.sender.name == self.name:
-                    fixtures_list[sender_info.line] = fix.get_coords()
+    def generate_layout_files(self, patch_map):
+        fixtures_list = patch_map.get_line_coords(self.name)
 
         print("generating layout...")
 
@@ -19,5 +19,8 @@ class SenderHandler:
     def try_connect(self):
         pass
 
+    def start_frame(self, now=None):
+        pass
+
     def send(self, line, byte_values):
         pass
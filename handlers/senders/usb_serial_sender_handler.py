@@ -1,51 +1,172 @@
 from handlers.senders.sender_handler import SenderHandler
 from handlers.packet_handler import CommHeader
+from collections import deque
+import numpy as np
+import time
 
 
 class UsbSerialSenderHandler(SenderHandler):
+    overload_policies = ("drop", "reduce_rate")
+
+    # how much of the link we plan to use when pacing frames, so a queue that has built up can drain
+    pacing_headroom = 0.9
+    smoothing = 0.3
+
     def __init__(self, config, serial_handler):
         SenderHandler.__init__(self, config)
         self.validate_config(config)
         self.num_lines = config.get("num_lines", "")
         self._serial_handler = serial_handler
 
-        self._last_send = [0.0 for _ in range(self.num_lines)]
-        self._send_interval = 1.0 / 30.0 / 8
+        # drop: skip whole frames while the queue holds more than max_queued_frames frames' worth of link time
+        # reduce_rate: pace frames to what the link can carry, and drop as well if the queue still builds up
+        self.overload_policy = config.get("overload_policy", "drop")
+        self.max_queued_frames = config.get("max_queued_frames", 2)
+
+        self._frame_interval = None
+        self._last_frame = None
+        self._sending = True
+
+        self._last_send = 0.0
+        self._send_interval = 0.0
+
+        self._frame_bytes = 0
+        self._typical_frame_bytes = None
+
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self._reported_drops = 0
+
+        # (time, bytes written to the port, frames sent) at each frame, for the achieved rates
+        self._history = deque(maxlen=60)
 
     def validate_config(self, config):
         if "num_lines" not in config.keys():
             raise Exception("Sender: config contains no num_lines")
 
+        if config.get("overload_policy", "drop") not in self.overload_policies:
+            raise Exception("Sender: unknown overload_policy {}, expected one of {}".format(config["overload_policy"], self.overload_policies))
+
     def is_connected(self):
         return self._serial_handler.is_connected(self.name)
 
+    # decide once per frame whether this board gets it, so its lines never end up showing different frames
+    def start_frame(self, now=None):
+        if now is None:
+            now = time.time()
+
+        if self._last_frame is not None:
+            interval = now - self._last_frame
+
+            if self._frame_interval is None:
+                self._frame_interval = interval
+            else:
+                self._frame_interval += (interval - self._frame_interval) * self.smoothing
+
+        self._last_frame = now
+
+        if self._frame_bytes:
+            if self._typical_frame_bytes is None:
+                self._typical_frame_bytes = self._frame_bytes
+            else:
+                self._typical_frame_bytes += (self._frame_bytes - self._typical_frame_bytes) * self.smoothing
+
+            self._frame_bytes = 0
+
+        self._history.append((now, self._serial_handler.get_bytes_written(self.name), self.frames_sent))
+
+        if not self.is_connected():
+            self._sending = False
+            return
+
+        self._sending = self._within_budget(now)
+
+        if self._sending:
+            self._last_send = now
+            self.frames_sent += 1
+        else:
+            self.frames_dropped += 1
+
+    def _within_budget(self, now):
+        link_rate = self._serial_handler.get_throughput(self.name)
+
+        # we haven't seen the link saturate, so it's keeping up with everything we've given it
+        if link_rate is None or self._frame_interval is None:
+            return True
+
+        if self.overload_policy == "reduce_rate" and self._typical_frame_bytes:
+            target_interval = max(self._frame_interval, self._typical_frame_bytes / (link_rate * self.pacing_headroom))
+            self._send_interval += (target_interval - self._send_interval) * self.smoothing
+
+            # half a frame of slack, or we'd skip every other frame whenever the two intervals are about equal
+            if now - self._last_send < self._send_interval - self._frame_interval / 2:
+                return False
+
+        frame_budget = link_rate * self._frame_interval
+
+        return self._serial_handler.get_pending_bytes(self.name) <= frame_budget * self.max_queued_frames
+
+    def get_stats(self):
+        link_rate = self._serial_handler.get_throughput(self.name)
+        queued_bytes = self._serial_handler.get_pending_bytes(self.name)
+
+        sent_rate = 0.0
+        fps = 0.0
+
+        if len(self._history) > 1:
+            (first_time, first_bytes, first_frames), (last_time, last_bytes, last_frames) = self._history[0], self._history[-1]
+
+            if last_time > first_time:
+                sent_rate = (last_bytes - first_bytes) / (last_time - first_time)
+                fps = (last_frames - first_frames) / (last_time - first_time)
+
+        return {"queued_bytes": queued_bytes,
+                "queued_ms": queued_bytes * 1000 / link_rate if link_rate else None,
+                "link_bytes_per_s": link_rate,
+                "sent_bytes_per_s": sent_rate,
+                "fps": fps,
+                "frames_sent": self.frames_sent,
+                "frames_dropped": self.frames_dropped}
+
+    # only worth a line when the link is holding us back
+    def report(self):
+        dropped = self.frames_dropped - self._reported_drops
+        self._reported_drops = self.frames_dropped
+
+        if not dropped:
+            return
+
+        stats = self.get_stats()
+
+        print("{}: link at {:.0f} kB/s, {:.1f} kB queued, sending {:.1f} fps, dropped {} frames".format(
+              self.name, (stats["link_bytes_per_s"] or 0) / 1000, stats["queued_bytes"] / 1000, stats["fps"], dropped))
+
     def send(self, line, byte_values):
         if not len(byte_values):
             return
 
-        byte_values = list(byte_values)
-        while len(byte_values) % 3:
-            byte_values.append(0)
-
         if line > self.num_lines - 1 or line < 0:
             raise Exception("Sender: send called on invalid line {}".format(line))
 
-        # if not connected, drop frame
-        if self.is_connected():
-            if ord('~') in byte_values:
-                print("BAD")
+        # if not connected, or this frame is over budget, drop it
+        if self.is_connected() and self._sending:
+            if isinstance(byte_values, (bytes, bytearray)):
+                byte_values = np.frombuffer(byte_values, dtype=np.uint8)
 
-            if ord('|') in byte_values:
-                print("BaaAD")
+            # whole pixels only, and a copy of the line that's ours to change
+            byte_values = np.pad(np.asarray(byte_values, dtype=np.uint8), (0, -len(byte_values) % 3))
 
-            # packet = [ord('~'), line, len(byte_values)/3]
-            header = [ord('~'), CommHeader.ops_by_str["frame_update"], line]
-            footer = [ord('|')]
+            # the fixtures keep colours off the frame markers, but power limiting scales them after, so nudge any that
+            # have landed back on one up a step, as the fixtures do
+            for sentinel in (ord('~'), ord('|')):
+                if np.any(byte_values == sentinel):
+                    byte_values[byte_values == sentinel] += 1
 
-            # header[-1:] = byte_values
-            # header[-1:] = footer
+            header = bytes([ord('~'), CommHeader.ops_by_str["frame_update"], line])
+            footer = bytes([ord('|')])
 
-            self._serial_handler.send_bytes(self.name, header + byte_values + footer)
+            self._frame_bytes += len(header) + len(byte_values) + len(footer)
+            self._serial_handler.send_bytes(self.name, header + byte_values.tobytes() + footer)
 
     def encapsulate(self, line, payload):
         header = [ord('~'), line]
@@ -0,0 +1,285 @@
+from collections import OrderedDict
+import threading
+import atexit
+import time
+import os
+import cv2
+
+
+# the (rows, cols) a video is decoded to, no bigger than max_dimension either way. leds sample a few hundred points of
+# a frame, so anything finer is only averaged away again
+def get_decoded_shape(width, height, max_dimension):
+    scale = min(1.0, max_dimension / max(width, height, 1)) if max_dimension else 1.0
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+
+def downscale(frame, shape):
+    if frame.shape[:2] == shape:
+        return frame
+
+    # area interpolation averages every source pixel into the smaller frame, where nearest or linear would skip some
+    return cv2.resize(frame, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+
+
+# Decodes one video on a background thread, keeping a ring of the frames just behind and ahead of where its readers
+# are. Frames are numbered from when the video started playing rather than from the start of the file, so a reader
+# asking for frame num_frames + 1 gets the file's second frame on its second time round.
+#
+# Frames are scaled down to frame_shape as they're decoded, once for every handler sharing the decoder.
+#
+# The video stays locked to the render clock rather than playing every frame. Frames the readers have already moved
+# past are grabbed rather than read, which skips converting and copying them, and a gap of more than seek_threshold
+# frames is seeked over. When readers step more than one frame per render, e.g. at triple speed, only every stride-th
+# frame is read, so there's about one read per rendered frame however fast the video is playing.
+class VideoDecoder:
+    def __init__(self, path, ring_size=8, seek_threshold=15, max_dimension=256, timeout=1.0):
+        self.path = path
+        self.ring_size = ring_size
+        self.seek_threshold = seek_threshold
+        self.timeout = timeout
+
+        self.vidcap = cv2.VideoCapture(path)
+
+        if not self.vidcap.isOpened():
+            raise Exception("VideoDecoder: failed to open {}".format(path))
+
+        self.width = self.vidcap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self.vidcap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.num_frames = max(1, int(self.vidcap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self.frame_shape = get_decoded_shape(self.width, self.height, max_dimension)
+
+        self.vidcap.set(cv2.CAP_PROP_POS_AVI_RATIO, 1)
+        self.vid_length = self.vidcap.get(cv2.CAP_PROP_POS_MSEC)
+        self.vidcap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+        self._reset()
+
+    # everything the decode thread owns. also run in a forked child, which gets our memory but not our thread
+    def _reset(self):
+        self._pid = os.getpid()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._error = None
+
+        # frame number -> frame, oldest first
+        self._ring = OrderedDict()
+        self._next_index = None
+        self._wanted = None
+
+        # frames the readers move on by each time they move, smoothed
+        self._stride = 1.0
+
+        # frame number the capture will return next
+        self._position = 0
+
+        self.frames_read = 0
+        self.frames_skipped = 0
+        self.seeks = 0
+
+    def _check_forked(self):
+        if self._pid != os.getpid():
+            self.vidcap = cv2.VideoCapture(self.path)
+            self._reset()
+
+    def _start_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="video decoder {}".format(os.path.basename(self.path)),
+                                            daemon=True)
+            self._thread.start()
+
+    def get_stride(self):
+        return max(1, round(self._stride))
+
+    def get_frame(self, index):
+        self._check_forked()
+
+        with self._condition:
+            if self._wanted is None:
+                self._wanted = index
+                self._start_thread()
+
+            elif index > self._wanted:
+                step = index - self._wanted
+
+                # a stall or a jump isn't the playback speed
+                if step < self.ring_size:
+                    self._stride += (step - self._stride) * 0.3
+
+            # moving on, or back past anything the ring still has
+            if index > self._wanted or index < next(iter(self._ring), self._wanted):
+                self._wanted = index
+                self._condition.notify_all()
+
+            deadline = time.monotonic() + self.timeout
+
+            while index not in self._ring:
+                if self._error is not None:
+                    raise Exception("VideoDecoder: failed to decode {}\n{}".format(self.path, self._error))
+
+                # a reader running a little ahead of the decoder, or between the frames a stride reads, gets the latest
+                # frame before its own rather than holding up the render
+                latest = max((i for i in self._ring.keys() if i < index), default=None)
+
+                if latest is not None and index - latest < self.ring_size * self.get_stride():
+                    return self._ring[latest]
+
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    raise Exception("VideoDecoder: timed out waiting for frame {} of {}".format(index % self.num_frames, self.path))
+
+                self._condition.wait(remaining)
+
+            return self._ring[index]
+
+    def _run(self):
+        try:
+            self._decode()
+
+        except Exception as e:
+            with self._condition:
+                self._error = str(e)
+                self._condition.notify_all()
+
+    def _decode(self):
+        while True:
+            with self._condition:
+                stride = self.get_stride()
+
+                # far enough ahead of every reader, wait for them to catch up or jump somewhere else
+                while not self._stopped and not self._jumped_back() and self._next_index > self._wanted + self.ring_size // 2 * stride:
+                    self._condition.wait()
+                    stride = self.get_stride()
+
+                if self._stopped:
+                    return
+
+                # nothing in the ring is any use
+                if self._jumped_back():
+                    self._ring.clear()
+                    self._next_index = self._wanted
+
+                # anything the readers have already moved past would never be shown, and striding from where they are
+                # now rather than from where we last read keeps us on the frames they'll ask for
+                if self._next_index <= self._wanted:
+                    index = self._wanted
+                else:
+                    index = self._wanted + -(-(self._next_index - self._wanted) // stride) * stride
+
+            self._skip_to(index)
+            frame = downscale(self._step(decode=True), self.frame_shape)
+
+            with self._condition:
+                self._ring[index] = frame
+                self._next_index = index + stride
+
+                while len(self._ring) > self.ring_size:
+                    self._ring.popitem(last=False)
+
+                self._condition.notify_all()
+
+    def _jumped_back(self):
+        return self._next_index is None or self._wanted < next(iter(self._ring), self._next_index)
+
+    def _skip_to(self, index):
+        gap = index - self._position
+
+        if gap < 0 or gap > self.seek_threshold:
+            self.vidcap.set(cv2.CAP_PROP_POS_FRAMES, index % self.num_frames)
+            self._position = index
+            self.seeks += 1
+            return
+
+        for _ in range(gap):
+            self._step(decode=False)
+
+    def _step(self, decode):
+        if decode:
+            success, frame = self.vidcap.read()
+        else:
+            success, frame = self.vidcap.grab(), None
+
+        if not success and self._position % self.num_frames:
+            # frame counts in container headers are only a guess, the file ended early so loop from here
+            self.num_frames = self._position % self.num_frames
+            self.vidcap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+            if decode:
+                success, frame = self.vidcap.read()
+            else:
+                success, frame = self.vidcap.grab(), None
+
+        if not success:
+            raise Exception("failed to read frame {}".format(self._position % self.num_frames))
+
+        if decode:
+            self.frames_read += 1
+        else:
+            self.frames_skipped += 1
+
+        self._position += 1
+
+        if self._position % self.num_frames == 0:
+            self.vidcap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+        return frame
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=1.0)
+
+
+# one decoder per video file however many handlers are playing it, so fixtures showing the same clip decode it once
+class VideoDecoderPool:
+    def __init__(self, ring_size=8, seek_threshold=15, max_dimension=256):
+        self.ring_size = ring_size
+        self.seek_threshold = seek_threshold
+        self.max_dimension = max_dimension
+        self._decoders = dict()
+        self._users = dict()
+        self._lock = threading.Lock()
+
+    def acquire(self, path):
+        path = os.path.abspath(path)
+
+        with self._lock:
+            if path not in self._decoders.keys():
+                self._decoders[path] = VideoDecoder(path, ring_size=self.ring_size, seek_threshold=self.seek_threshold,
+                                                     max_dimension=self.max_dimension)
+                self._users[path] = 0
+
+            self._users[path] += 1
+
+            return self._decoders[path]
+
+    def release(self, decoder):
+        with self._lock:
+            self._users[decoder.path] -= 1
+
+            if self._users[decoder.path]:
+                return
+
+            del self._decoders[decoder.path]
+            del self._users[decoder.path]
+
+        decoder.stop()
+
+    def shut_down(self):
+        with self._lock:
+            decoders = list(self._decoders.values())
+            self._decoders.clear()
+            self._users.clear()
+
+        for decoder in decoders:
+            decoder.stop()
+
+
+video_decoders = VideoDecoderPool()
+
+# a decode thread still inside opencv when the interpreter exits takes the whole process down with it
+atexit.register(video_decoders.shut_down)
@@ -1,11 +1,15 @@
-import time
+from handlers.video_decoder import video_decoders
+from handlers.video_decoder import downscale
+from handlers.video_sampling import SamplingPlan
+from functools import partial
 import os
-import cv2
 import numpy as np
 
 
 class VideoHandler:
-    def __init__(self, video_path):
+    max_plans = 32
+
+    def __init__(self, video_path, track_store=None):
         if not os.path.isdir(video_path):
             raise Exception("ERROR: the directory {} does not exist".format(video_path))
 
@@ -25,6 +29,18 @@ class VideoHandler:
         self._last_update = 0.0
         self._time_per_frame = 1.0 / 30.0
 
+        # decoding happens on the decoder's thread, shared with any other handler playing the same video. we only
+        # fetch a frame when a fixture first samples us, so handlers nothing is showing cost nothing
+        self._decoder = None
+        self.frame = None
+
+        # baked per led colour tracks, see video_track_store.py
+        self.track_store = track_store
+        self._video_hash = None
+
+        # (mapping, frame shape, scale) -> SamplingPlan
+        self._plans = dict()
+
         self._switch_to_video(list(self.videos.keys())[0])
 
         self._global_scaling_factor = 0.5
@@ -36,25 +52,25 @@ class VideoHandler:
         if name not in self.videos.keys():
             raise Exception("Unknown video ", name)
 
-        self.current_video = self.videos[name]
-        self.vidcap = cv2.VideoCapture(self.current_video)
+        decoder = video_decoders.acquire(self.videos[name])
 
-        self.vidcap.set(cv2.CAP_PROP_POS_AVI_RATIO, 1)
-        self.vid_length = self.vidcap.get(cv2.CAP_PROP_POS_MSEC)
-        self.num_frames = self.vidcap.get(cv2.CAP_PROP_FRAME_COUNT)
+        if self._decoder is not None:
+            video_decoders.release(self._decoder)
 
-        self._update_sampling_factors()
+        self._decoder = decoder
+        self.current_video = self.videos[name]
+        self._video_hash = None
 
-        self.vidcap.set(cv2.CAP_PROP_POS_MSEC, (self._last_update*1000) % self.vid_length)
+        self.vid_length = decoder.vid_length
+        self.num_frames = decoder.num_frames
 
-        success, self.frame = self.vidcap.read()
+        self._update_sampling_factors()
 
-        if not success:
-            raise Exception("Failed to read video frame")
+        self.frame = None
 
+    # in pixels of the frames as decoded, which are scaled down from the video's own
     def _update_sampling_factors(self):
-        width = self.vidcap.get(3)
-        height = self.vidcap.get(4)
+        height, width = self._decoder.frame_shape
 
         if width < height:
             self.height_offset = (height - width) / 2
@@ -69,15 +85,18 @@ class VideoHandler:
         self.scaling_factor = min(width, height) - 1
 
     def update(self, time):
-        while self._last_update + self._time_per_frame < time:
-            if self.vidcap.get(cv2.CAP_PROP_POS_FRAMES) >= self.num_frames - 1:
-                self.vidcap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self._last_update = time
+        self.frame = None
+
+    # the video plays on the render clock, a frame per _time_per_frame of it, looping
+    def get_frame_index(self):
+        return int(self._last_update / self._time_per_frame)
 
-            success, self.frame = self.vidcap.read()
-            self._last_update += self._time_per_frame
+    def get_frame(self):
+        if self.frame is None:
+            self.frame = self._decoder.get_frame(self.get_frame_index())
 
-            if not success:
-                raise Exception("Failed to read video frame")
+        return self.frame
 
     def receive_command(self, command):
         if command["type"] == "pattern" and command["name"] == "map_video":
@@ -85,10 +104,57 @@ class VideoHandler:
 
             self._switch_to_video(name)
 
-    def sample(self, flat_mappings):
-        centralised_x_mappings = flat_mappings[...,0] - 0.5
-        centralised_y_mappings = flat_mappings[...,1] - 0.5
-        x_mappings = np.minimum((centralised_x_mappings * self.scaling_factor * self._global_scaling_factor + self.frame.shape[0]/2).astype(int), self.frame.shape[0]-1)
-        y_mappings = np.minimum((centralised_y_mappings * self.scaling_factor * self._global_scaling_factor + self.frame.shape[1]/2).astype(int), self.frame.shape[1]-1)
+    # mappings change when fixtures are calibrated, and a frame's shape or scale when switching videos, so a plan is
+    # kept for each combination seen. pass a hash of the mappings if there is one, it's cheaper to look up
+    def get_plan(self, flat_mappings, mapping_hash=None):
+        scaling = self.scaling_factor * self._global_scaling_factor
+        key = (mapping_hash or id(flat_mappings), self._decoder.frame_shape, scaling)
+        plan = self._plans.get(key, None)
+
+        if plan is None:
+            if len(self._plans) >= self.max_plans:
+                self._plans.clear()
+
+            plan = self._plans[key] = SamplingPlan(flat_mappings, self._decoder.frame_shape, scaling)
+
+        return plan
+
+    # patterns that pass a hash of their mappings get the baked track once there is one, live samples until then
+    def sample(self, flat_mappings, mapping_hash=None):
+        plan = self.get_plan(flat_mappings, mapping_hash)
+
+        if self.track_store is not None and mapping_hash is not None:
+            track = self.track_store.get_track(self._get_track_key(mapping_hash), self.current_video, self._get_baker(plan))
+
+            if track is not None:
+                return track[self.get_frame_index() % len(track)].astype(np.float32)
+
+        return plan.sample(self.get_frame())
+
+    def _get_track_key(self, mapping_hash):
+        if self._video_hash is None:
+            self._video_hash = self.track_store.get_video_hash(self.current_video)
+
+        return "{}_{}_{:.4f}_{}x{}".format(self._video_hash, mapping_hash, self.scaling_factor * self._global_scaling_factor,
+                                           *self._decoder.frame_shape)
+
+    # the track store bakes from frames straight out of the file, so they need scaling down as the decoder would
+    def _get_baker(self, plan):
+        return partial(self.sample_frame, plan=plan, frame_shape=self._decoder.frame_shape)
+
+    @staticmethod
+    def sample_frame(frame, plan, frame_shape):
+        return plan.sample(downscale(frame, frame_shape))
+
+    # bake a fixture's tracks for every video now, rather than in the background once the show is running
+    def bake_tracks(self, flat_mappings, mapping_hash):
+        current_name = next(name for name, path in self.videos.items() if path == self.current_video)
+
+        for name in self.videos.keys():
+            self._switch_to_video(name)
+            key = self._get_track_key(mapping_hash)
+
+            if not os.path.exists(self.track_store.get_track_path(key)):
+                self.track_store.bake(key, self.current_video, self._get_baker(self.get_plan(flat_mappings, mapping_hash)))
 
-        return self.frame[x_mappings.astype(int), y_mappings.astype(int)].astype(np.float32)
+        self._switch_to_video(current_name)
@@ -0,0 +1,59 @@
+import numpy as np
+import hashlib
+import math
+
+
+# keys sampling plans and baked tracks, see video_track_store.py
+def get_mapping_hash(flat_mappings):
+    return hashlib.sha1(np.ascontiguousarray(flat_mappings, dtype=np.float64).tobytes()).hexdigest()[:16]
+
+
+# Where in a frame each of a fixture's leds takes its colour from, worked out once for a given mapping, frame size and
+# scale, so sampling a frame is a single gather. Each led averages a square of footprint x footprint pixels centred on
+# its position, sized so neighbouring leds' squares about tile the area the fixture covers, so detail finer than the
+# leds can show is averaged away rather than aliasing into flicker.
+#
+# Flat mappings run 0 to 1 in x and y with the centre of the frame at 0.5, 0.5. scaling is how many pixels 1 covers.
+class SamplingPlan:
+    max_footprint = 5
+
+    def __init__(self, flat_mappings, frame_shape, scaling):
+        rows, cols = frame_shape[:2]
+        num_leds = len(flat_mappings)
+
+        x = (flat_mappings[..., 0] - 0.5) * scaling + cols / 2
+        y = (flat_mappings[..., 1] - 0.5) * scaling + rows / 2
+
+        self.footprint = self.get_footprint(x, y, num_leds)
+
+        # pixel offsets of the footprint, centred on each led
+        offsets = np.arange(self.footprint) - (self.footprint - 1) / 2
+        dy, dx = (axis.reshape(-1) for axis in np.meshgrid(offsets, offsets, indexing="ij"))
+
+        sample_cols = np.clip((x[:, np.newaxis] + dx).astype(int), 0, cols - 1)
+        sample_rows = np.clip((y[:, np.newaxis] + dy).astype(int), 0, rows - 1)
+
+        # indices into the frame flattened to (pixels, 3)
+        self.indices = sample_rows * cols + sample_cols
+
+        if self.footprint == 1:
+            self.indices = self.indices[:, 0]
+
+    def get_footprint(self, x, y, num_leds):
+        if num_leds < 2:
+            return 1
+
+        # the side of the square of frame each led has to itself, if the fixture spread evenly over its extent
+        span_x = max(1.0, np.ptp(x))
+        span_y = max(1.0, np.ptp(y))
+        spacing = math.sqrt(span_x * span_y / num_leds)
+
+        return int(max(1, min(self.max_footprint, round(spacing))))
+
+    def sample(self, frame):
+        pixels = frame.reshape(-1, frame.shape[-1])
+
+        if self.footprint == 1:
+            return pixels[self.indices].astype(np.float32)
+
+        return pixels[self.indices].mean(axis=1, dtype=np.float32)
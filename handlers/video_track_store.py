@@ -0,0 +1,165 @@
+from numpy.lib.format import open_memmap
+import numpy as np
+import threading
+import hashlib
+import queue
+import time
+import os
+import cv2
+
+
+# Bakes what a fixture's leds show of a video, every frame of it, into a (frames, leds, 3) uint8 track on disk, so
+# playing it back is a slice of a memmap rather than decoding and sampling. Tracks are keyed by hashes of the video
+# file and of the led mapping, so an edited clip or a moved fixture gets a new track rather than a stale one.
+#
+# Tracks that don't exist yet are baked on a background thread, and until then get_track returns None and the video
+# is sampled live. With the process render pool every worker would want the same tracks, so a lock file next to the
+# track makes sure only one of them bakes it.
+class VideoTrackStore:
+    # a lock file this old belongs to a bake that died
+    stale_lock_age = 600.0
+    check_interval = 1.0
+
+    def __init__(self, cache_dir="video_tracks/"):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._video_hashes = dict()
+        self._tracks = dict()
+        self._lock = threading.Lock()
+        self._reset()
+
+    # the bake thread doesn't survive a fork, a render worker starts its own if it needs one
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._thread = None
+
+        # track key -> when to next look for it on disk
+        self._pending = dict()
+
+    def get_video_hash(self, video_path):
+        stat = os.stat(video_path)
+        cache_key = (video_path, stat.st_size, stat.st_mtime)
+
+        if cache_key not in self._video_hashes.keys():
+            digest = hashlib.sha1()
+
+            with open(video_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+
+            self._video_hashes[cache_key] = digest.hexdigest()[:16]
+
+        return self._video_hashes[cache_key]
+
+    def get_track_path(self, key):
+        return os.path.join(self.cache_dir, "{}.npy".format(key))
+
+    # the baked track for key, or None while it's still to come. sample_frame turns a decoded frame into the leds'
+    # colours, and is only called if the track needs baking
+    def get_track(self, key, video_path, sample_frame):
+        track = self._tracks.get(key, None)
+
+        if track is not None:
+            return track
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+
+            now = time.monotonic()
+
+            if now < self._pending.get(key, 0.0):
+                return None
+
+            self._pending[key] = now + self.check_interval
+
+            path = self.get_track_path(key)
+
+            if os.path.exists(path):
+                self._tracks[key] = np.load(path, mmap_mode="r")
+                del self._pending[key]
+
+                return self._tracks[key]
+
+            if self._claim(key):
+                self._start_thread()
+                self._queue.put((key, video_path, sample_frame))
+
+        return None
+
+    def _claim(self, key):
+        lock_path = self.get_track_path(key) + ".lock"
+
+        try:
+            if time.time() - os.path.getmtime(lock_path) > self.stale_lock_age:
+                os.remove(lock_path)
+
+        except FileNotFoundError:
+            pass
+
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+
+        except FileExistsError:
+            return False
+
+    def _start_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="video track baker", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            key, video_path, sample_frame = self._queue.get()
+
+            try:
+                self.bake(key, video_path, sample_frame)
+
+            except Exception as e:
+                print("VideoTrackStore: failed to bake {}: {}".format(os.path.basename(video_path), e))
+
+            finally:
+                try:
+                    os.remove(self.get_track_path(key) + ".lock")
+
+                except FileNotFoundError:
+                    pass
+
+    # reads the whole video once, so call it from the bake thread or before the show starts
+    def bake(self, key, video_path, sample_frame):
+        path = self.get_track_path(key)
+        vidcap = cv2.VideoCapture(video_path)
+
+        # frame counts in headers are only a guess, so read everything first and size the track after
+        colours = list()
+
+        while True:
+            success, frame = vidcap.read()
+
+            if not success:
+                break
+
+            colours.append(np.clip(sample_frame(frame), 0, 255).astype(np.uint8))
+
+        vidcap.release()
+
+        if not colours:
+            raise Exception("no frames in {}".format(video_path))
+
+        # written under another name and moved into place, so a reader never maps half a track
+        temp_path = "{}.{}.tmp.npy".format(path[:-len(".npy")], os.getpid())
+        track = open_memmap(temp_path, mode="w+", dtype=np.uint8, shape=(len(colours),) + colours[0].shape)
+
+        for index, frame_colours in enumerate(colours):
+            track[index] = frame_colours
+
+        track.flush()
+        del track
+
+        os.replace(temp_path, path)
+
+        print("VideoTrackStore: baked {} frames of {} for {} leds".format(len(colours), os.path.basename(video_path),
+                                                                          colours[0].shape[0]))
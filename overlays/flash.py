@@ -3,10 +3,20 @@ from common.utils import nonzero
 
 
 class Flash(Overlay):
+    blend = "multiply"
+
     def __init__(self, args):
+        Overlay.__init__(self, args)
         self.decay_factor = args["decay_factor"]
 
-    def get_overlaid_colours(self, colours, leds, time_since_start, fixture_name):
-        factor = min(2.0, 1.0 / nonzero((time_since_start + 0.25) * self.decay_factor))
+    # brightens everything up to double, back down to nothing over 1 / decay_factor seconds
+    def get_gain(self, time_since_start):
+        return max(1.0, min(2.0, 1.0 / nonzero((time_since_start + 0.25) * self.decay_factor)))
+
+    def get_layer(self, colours, leds, time_since_start, fixture_name):
+        gain = self.get_gain(time_since_start)
+
+        return gain if gain > 1.0 else None
 
-        return colours * max(factor, 1)
+    def get_envelope(self, time_since_start, max_delta):
+        return self.get_gain(time_since_start) - 1.0
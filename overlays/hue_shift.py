@@ -1,29 +1,47 @@
 from overlays.overlay import Overlay
-from common.utils import rgb_to_hsv, hsv_to_rgb
+from overlays.regions import RadialBand
+from common.colour_kernels import rotate_hue
 
 
 class HueShift(Overlay):
+    blend = "replace"
+
+    front_speed = 0.5
+    band_width = 2.5
+    headstart = 0.75  # flip first fixture straight away
+
     def __init__(self, args):
+        Overlay.__init__(self, args)
         self.min_deltas = {}
 
-    def get_overlaid_colours(self, colours, leds, time_since_start, fixture_name):
+    def get_layer(self, colours, leds, time_since_start, fixture_name):
         if fixture_name not in self.min_deltas.keys():
             self.min_deltas[fixture_name] = min(list(led.coord.get_delta("global") for led in leds))
 
-        front_speed = 0.5
-        band_width = 2.5
-        headstart = 0.75  # flip first fixture straight away
+        front_progress = self.front_speed * time_since_start + self.headstart
 
-        front_progress = front_speed * time_since_start + headstart
-
-        if front_progress - band_width < self.min_deltas[fixture_name] < front_progress:
-            proportion_through_band = (front_progress - self.min_deltas[fixture_name]) / band_width
+        if front_progress - self.band_width < self.min_deltas[fixture_name] < front_progress:
+            proportion_through_band = (front_progress - self.min_deltas[fixture_name]) / self.band_width
 
             shift_amount = 0.5 * (1.0 - proportion_through_band)
 
-            hsv = rgb_to_hsv(colours)
-            hsv[..., 0] = (hsv[..., 0]+shift_amount) % 1.0
-            return hsv_to_rgb(hsv).astype('float32')
+            # straight round the colour wheel in rgb, written over the buffer
+            return rotate_hue(colours, shift_amount, out=colours)
+
+        return None
+
+    # the band only shifts a fixture while it's passing the fixture's nearest led, so it can't reach any fixture it
+    # doesn't overlap
+    def get_region(self, time_since_start):
+        front_progress = self.front_speed * time_since_start + self.headstart
+
+        return RadialBand(front_progress - self.band_width, front_progress)
+
+    # done once the band has passed the furthest led, by which time it's passed every fixture's nearest
+    def get_envelope(self, time_since_start, max_delta):
+        if max_delta is None:
+            return 1.0
+
+        front_progress = self.front_speed * time_since_start + self.headstart
 
-        else:
-            return colours
+        return 1.0 if front_progress - self.band_width < max_delta else 0.0
@@ -1,7 +1,50 @@
+from common.plugin_registry import PluginRegistry
+
+
 class Overlay:
+    # see Pattern
+    requires = ()
+    cost = 1.0
+    batched = True
+
+    # how get_layer's result goes onto the colours under it: "multiply", "add", "max" or "replace"
+    blend = "replace"
+
+    # seconds of render time, for overlays that don't have an envelope of their own
+    lifetime = 5.0
+
+    # whether get_layer takes indices, and works on just those leds when get_region narrows things down
+    subset = False
+
     def __init__(self, args):
         self.expired = False
         pass
 
+    # what to blend onto colours, or None to leave them be this frame. a scalar, (leds, 1) or (leds, 3) array. colours
+    # is the composition buffer, so replace overlays can write it in place and return it rather than a new array
+    def get_layer(self, colours, leds, time_since_start, fixture_name):
+        return self.get_overlaid_colours(colours, leds, time_since_start, fixture_name)
+
+    # the most the overlay can still change a led by, as a fraction of full strength. overlays are dropped once it's
+    # close to 0, so this has to be cheap, it's asked every frame. max_delta is how far the furthest led we've drawn on
+    # is from the origin, None before we've drawn on anything
+    def get_envelope(self, time_since_start, max_delta):
+        return 1.0 if time_since_start < self.lifetime else 0.0
+
+    # where anything could change this frame, see overlays/regions.py. fixtures outside it are skipped, and subset
+    # overlays only get the leds inside it. None for everywhere
+    def get_region(self, time_since_start):
+        return None
+
+    # overlays written before blend modes return the whole result
     def get_overlaid_colours(self, colours, leds, time_since_start, fixture_name):
-        pass
+        return None
+
+
+# overlays run over every fixture, so they can't need anything a fixture might not have
+overlay_types = PluginRegistry("overlay", "pyzzazz.overlays")
+overlay_types.register("flash", "overlays.flash:Flash", requires=(), cost=0.01, batched=True)
+overlay_types.register("star_drive", "overlays.star_drive:StarDrive", requires=(), cost=0.1, batched=True)
+overlay_types.register("ripple", "overlays.ripple:Ripple", requires=(), cost=0.05, batched=True)
+overlay_types.register("spark_shower", "overlays.spark_shower:SparkShower", requires=(), cost=0.04, batched=True)
+overlay_types.register("hue_shift", "overlays.hue_shift:HueShift", requires=(), cost=0.5, batched=True)
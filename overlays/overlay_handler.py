@@ -1,71 +1,154 @@
 from operator import add
-from overlays.flash import Flash
-from overlays.star_drive import StarDrive
-from overlays.ripple import Ripple
-from overlays.spark_shower import SparkShower
-from overlays.hue_shift import HueShift
+from overlays.overlay import overlay_types
+from overlays.regions import FixtureBounds
+from common.profiler import profiler
 import numpy as np
-import time
+import threading
+
+
+# how a layer goes onto the composition buffer. replace overlays write the buffer themselves, or hand back what
+# should be in it
+blend_modes = {"multiply": np.multiply,
+               "add": np.add,
+               "max": np.maximum,
+               "replace": None}
 
 
 class OverlayInfo:
     # FIXME add keyword?
-    def __init__(self, overlay):
+    def __init__(self, overlay, start_time):
         self.overlay = overlay
-        self.max_contribution_per_led = 0.0
-        self.start_time = time.time()
+        self.blend = blend_modes[overlay.blend]
+
+        # on the render clock, so overlays keep pace with the patterns and agree across render workers
+        self.start_time = start_time
+
+        # fixtures can be rendered on several threads at once
+        self._lock = threading.Lock()
+        self._seen_fixtures = set()
+
+    # get_bounds gives the fixture's FixtureBounds, only asked for by overlays that have a region
+    def blend_into(self, buffer, leds, time, fixture_name, get_bounds):
+        time_since_start = time - self.start_time
+        region = self.overlay.get_region(time_since_start)
+        indices = None
+
+        if region is not None:
+            bounds = get_bounds(leds, fixture_name)
+
+            if region.misses(bounds):
+                return
+
+            if self.overlay.subset:
+                indices = region.get_indices(bounds)
+
+                if indices is not None and len(indices) == 0:
+                    return
+
+        # subset overlays work on a copy of just the leds in their region, which goes back into the buffer after
+        target = buffer if indices is None else buffer[indices]
+
+        if fixture_name in self._seen_fixtures:
+            layer = self.get_layer(target, leds, time_since_start, fixture_name, indices)
+
+        else:
+            # the first call for a fixture fills in the overlay's per fixture caches, so don't let those race
+            with self._lock:
+                layer = self.get_layer(target, leds, time_since_start, fixture_name, indices)
+                self._seen_fixtures.add(fixture_name)
+
+        if layer is None:
+            return
+
+        if self.blend is not None:
+            self.blend(target, layer, out=target)
 
-    def get_overlaid_colours(self, colours, leds, fixture_name):
-        overlaid_colours = self.overlay.get_overlaid_colours(colours, leds, time.time() - self.start_time, fixture_name)
+        elif layer is not target:
+            np.copyto(target, layer)
 
-        total_contribution = np.sum(np.abs((overlaid_colours - colours).flatten()))
+        if indices is not None:
+            buffer[indices] = target
 
-        self.max_contribution_per_led = max(total_contribution / len(leds), self.max_contribution_per_led)
+    def get_layer(self, colours, leds, time_since_start, fixture_name, indices):
+        if self.overlay.subset:
+            return self.overlay.get_layer(colours, leds, time_since_start, fixture_name, indices)
 
-        return overlaid_colours
+        return self.overlay.get_layer(colours, leds, time_since_start, fixture_name)
 
-    def get_max_contribution_per_led(self):
-        max_contribution_per_led = self.max_contribution_per_led
-        self.max_contribution_per_led = 0.0
-        return max_contribution_per_led
+    def get_envelope(self, time, max_delta):
+        return self.overlay.get_envelope(time - self.start_time, max_delta)
 
 
 class OverlayHandler:
     def __init__(self):
-        self.epsilon = 10
-        self.min_time = 5
+        # overlays this far into their envelope are finished
+        self.min_envelope = 0.05
         self.active_overlays = list()
 
-    def update(self):
-        self.active_overlays = list(overlay for overlay in self.active_overlays if time.time() - overlay.start_time < self.min_time or overlay.get_max_contribution_per_led() > self.epsilon)
+        # name -> the implementation the registry chose
+        self.implementations = dict()
 
-    def receive_command(self, command):
-        if command["type"] == "overlay":
-            if command["name"] == "flash":
-                self.active_overlays.append(OverlayInfo(Flash(command["args"])))
+        # fixture name -> FixtureBounds, filled in the first time an overlay is drawn on a fixture
+        self.bounds = dict()
+        self._bounds_lock = threading.Lock()
 
-            elif command["name"] == "star_drive":
-                self.active_overlays.append(OverlayInfo(StarDrive(command["args"])))
+        # furthest led from the origin of any fixture we know the bounds of
+        self.max_delta = None
 
-            elif command["name"] == "ripple":
-                self.active_overlays.append(OverlayInfo(Ripple(command["args"])))
+    def update(self, effective_time):
+        self.active_overlays = list(overlay for overlay in self.active_overlays
+                                    if overlay.get_envelope(effective_time, self.max_delta) >= self.min_envelope)
 
-            elif command["name"] == "spark_shower":
-                self.active_overlays.append(OverlayInfo(SparkShower(command["args"])))
+    def get_bounds(self, leds, fixture_name):
+        bounds = self.bounds.get(fixture_name, None)
 
-            elif command["name"] == "hue_shift":
-                self.active_overlays.append(OverlayInfo(HueShift(command["args"])))
+        if bounds is None:
+            with self._bounds_lock:
+                if fixture_name not in self.bounds.keys():
+                    self.bounds[fixture_name] = FixtureBounds(leds)
+                    self.max_delta = max(self.max_delta or 0.0, self.bounds[fixture_name].max_delta)
 
-            else:
-                raise Exception("OverlayHandler: unknown overlay {}".format(command["name"]))
+                bounds = self.bounds[fixture_name]
+
+        return bounds
+
+    # a fixture's leds have moved, e.g. it's been recalibrated, so work its bounds out again next time they're needed
+    def invalidate_bounds(self, fixture_name):
+        with self._bounds_lock:
+            self.bounds.pop(fixture_name, None)
+            self.max_delta = max((bounds.max_delta for bounds in self.bounds.values()), default=None)
+
+    # looks the overlay up at boot, so the first time it's triggered doesn't stall on an import
+    def register_command(self, command):
+        if command["type"] == "overlay":
+            if command["name"] not in self.implementations.keys():
+                implementation = overlay_types.get(command["name"], owner="the overlay handler")
+
+                if implementation.blend not in blend_modes.keys():
+                    raise Exception("OverlayHandler: overlay {} has unknown blend mode {}".format(command["name"], implementation.blend))
+
+                self.implementations[command["name"]] = implementation
 
         else:
             raise Exception("OverlayHandler: unknown command type {}".format(command["type"]))
 
-    def calculate_overlaid_colours(self, leds, colours, fixture_name):
-        overlaid_colours = colours
+    def receive_command(self, command, effective_time):
+        if command["type"] == "overlay":
+            self.register_command(command)
+            self.active_overlays.append(OverlayInfo(self.implementations[command["name"]](command["args"]), effective_time))
+
+        else:
+            raise Exception("OverlayHandler: unknown command type {}".format(command["type"]))
+
+    # composes colours and every active overlay into out, which is written in place
+    def calculate_overlaid_colours(self, leds, colours, fixture_name, effective_time, out):
+        np.copyto(out, colours)
 
         for overlay in self.active_overlays:
-            overlaid_colours = overlay.get_overlaid_colours(overlaid_colours, leds, fixture_name)
+            if profiler.enabled:
+                profiler.timed("overlay", "{} {}".format(fixture_name, type(overlay.overlay).__name__),
+                               overlay.blend_into, out, leds, effective_time, fixture_name, self.get_bounds)
+            else:
+                overlay.blend_into(out, leds, effective_time, fixture_name, self.get_bounds)
 
-        return overlaid_colours
+        return out
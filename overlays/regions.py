@@ -0,0 +1,93 @@
+import numpy as np
+
+
+# Where a fixture's leds are, worked out once for every overlay to share. Leds are indexed in order of their distance
+# from the global origin and of each coordinate, so the leds inside a band or slab are one searchsorted away rather
+# than a comparison against every led.
+class FixtureBounds:
+    def __init__(self, leds):
+        self.positions = np.array(list(list(led.coord.get("global", "cartesian")) for led in leds), dtype=float).reshape(-1, 3)
+        self.deltas = np.array(list(led.coord.get_delta("global") for led in leds), dtype=float)
+        self.num_leds = len(self.deltas)
+
+        self.low = np.min(self.positions, axis=0, initial=np.inf)
+        self.high = np.max(self.positions, axis=0, initial=-np.inf)
+        self.min_delta = np.min(self.deltas, initial=np.inf)
+        self.max_delta = np.max(self.deltas, initial=0.0)
+
+        # "delta" or an axis -> (led indices in order, the values in that order)
+        self._orders = {"delta": self._sort(self.deltas)}
+
+    @staticmethod
+    def _sort(values):
+        order = np.argsort(values, kind="stable")
+        return order, values[order]
+
+    def _get_order(self, key):
+        if key not in self._orders.keys():
+            self._orders[key] = self._sort(self.positions[:, key])
+
+        return self._orders[key]
+
+    # indices of the leds with low <= value <= high, or None for all of them
+    def get_range(self, key, low, high):
+        order, values = self._get_order(key)
+
+        start = np.searchsorted(values, low, side="left")
+        end = np.searchsorted(values, high, side="right")
+
+        if start == 0 and end == self.num_leds:
+            return None
+
+        return order[start:end]
+
+
+# Regions say where an overlay can change anything this frame. misses is whether a fixture can be skipped altogether,
+# and get_indices which of its leds are inside, None meaning all of them.
+
+# distances from the global origin, for fronts spreading out from it
+class RadialBand:
+    def __init__(self, inner, outer):
+        self.inner = inner
+        self.outer = outer
+
+    def misses(self, bounds):
+        return self.outer < bounds.min_delta or self.inner > bounds.max_delta
+
+    def get_indices(self, bounds):
+        return bounds.get_range("delta", self.inner, self.outer)
+
+
+# between two values of one global axis, 0, 1 or 2 for x, y or z
+class Slab:
+    def __init__(self, axis, low, high):
+        self.axis = axis
+        self.low = low
+        self.high = high
+
+    def misses(self, bounds):
+        return self.high < bounds.low[self.axis] or self.low > bounds.high[self.axis]
+
+    def get_indices(self, bounds):
+        return bounds.get_range(self.axis, self.low, self.high)
+
+
+class BoundingBox:
+    def __init__(self, low, high):
+        self.low = np.asarray(low, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+
+    def misses(self, bounds):
+        return bool(np.any(self.high < bounds.low) or np.any(self.low > bounds.high))
+
+    def get_indices(self, bounds):
+        # narrow down along x, then check the rest of the box on what's left
+        indices = bounds.get_range(0, self.low[0], self.high[0])
+        positions = bounds.positions if indices is None else bounds.positions[indices]
+
+        inside = np.all((positions >= self.low) & (positions <= self.high), axis=1)
+
+        if indices is None:
+            return None if np.all(inside) else np.flatnonzero(inside)
+
+        return indices[inside]
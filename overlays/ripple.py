@@ -1,38 +1,62 @@
 from overlays.overlay import Overlay
+from overlays.regions import RadialBand
 import numpy as np
 
 
 class Ripple(Overlay):
+    blend = "multiply"
+    subset = True
+
+    front_speed = 3.0
+
+    # leds further behind the front than where the ripple's this weak are skipped. a multiply of 1 +- 1/255 moves a
+    # full channel by at most one byte value, so skipping them doesn't show
+    faintest = 1.0 / 255
+
     def __init__(self, args):
         Overlay.__init__(self, args)
         self.deltas = {}
         self.intensities = {}
 
-    def get_overlaid_colours(self, colours, leds, time_since_start, fixture_name):
+    def get_layer(self, colours, leds, time_since_start, fixture_name, indices=None):
         if fixture_name not in self.deltas.keys():
             self.deltas[fixture_name] = np.array(list(led.coord.get_delta("global") for led in leds))
             self.intensities[fixture_name] = np.zeros(len(leds))
 
-        front_speed = 3.0
+        deltas = self.deltas[fixture_name] if indices is None else self.deltas[fixture_name][indices]
+
+        front_speed = self.front_speed
         front_progress = front_speed * time_since_start
 
         delay = 0.0
 
         front_progress -= delay
 
-        time_since_front = front_progress - self.deltas[fixture_name]
+        time_since_front = front_progress - deltas
         time_since_front = np.maximum(1, time_since_front)
 
         front_intensity = 1.0 / (time_since_front / 4.5)
 
-        front_intensity[self.deltas[fixture_name] > time_since_front] = 0
+        front_intensity[deltas > time_since_front] = 0
 
-        ripple_level = np.sin(self.deltas[fixture_name]*7.5 - time_since_start*front_speed)
+        ripple_level = np.sin(deltas*7.5 - time_since_start*front_speed)
         ripple_level *= front_intensity
         ripple_level *= -1
 
         ripple_level += 1
 
-        ripple_level = ripple_level[:len(colours)]
+        return ripple_level[:,np.newaxis]
+
+    # leds further out than half the front are left alone, see the zeroing in get_layer, and ones far enough behind it
+    # are too faint to change
+    def get_region(self, time_since_start):
+        front_progress = self.front_speed * time_since_start
+
+        return RadialBand(front_progress - 4.5 / self.faintest, max(1.0, front_progress / 2))
+
+    # the ripples are strongest just behind the front, and die away once it's passed everything
+    def get_envelope(self, time_since_start, max_delta):
+        if max_delta is None:
+            return 1.0
 
-        return colours * ripple_level[:,np.newaxis]
+        return min(1.0, 4.5 / max(1.0, self.front_speed * time_since_start - max_delta))
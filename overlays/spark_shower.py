@@ -1,54 +1,123 @@
 from overlays.overlay import Overlay
+from overlays.regions import RadialBand
 import numpy as np
-import random
-import time
+
+
+# everything the shower keeps for one fixture, allocated the first time it's drawn on
+class ShowerState:
+    def __init__(self, leds):
+        num_leds = len(leds)
+
+        self.deltas = np.array(list(led.coord.get_delta("global") for led in leds))
+
+        # fixtures render on their own threads, and generators aren't thread safe
+        self.rng = np.random.default_rng()
+        self.colour_factors = self.rng.normal(1.0, 0.1, (num_leds, 3)).astype(np.float32)
+
+        # render time since the shower started that each led last sparkled, never to begin with
+        self.last_sparkles = np.full(num_leds, -np.inf)
+
+        # only the first however many leds are inside the shower get used of these
+        self.subset_deltas = np.zeros(num_leds)
+        self.subset_last_sparkles = np.zeros(num_leds)
+        self.subset_colour_factors = np.zeros((num_leds, 3), dtype=np.float32)
+        self.time_since_front = np.zeros(num_leds)
+        self.unreached = np.zeros(num_leds, dtype=bool)
+        self.draws = np.zeros(num_leds)
+        self.spawned = np.zeros(num_leds, dtype=bool)
+        self.scratch = np.zeros(num_leds)
+        self.layer = np.zeros((num_leds, 3), dtype=np.float32)
 
 
 class SparkShower(Overlay):
+    blend = "max"
+    subset = True
+
+    front_speed = 1.0
+    head_start = 0.5
+
+    # how far behind the front sparkles are still drawn. past this they're a twentieth as bright as at the front, which
+    # is when the overlay's dropped
+    trail = 20.0
+
+    # orange, going yellow for the leds the front has just passed
+    spark_colour = np.array([246.0, 101.0, 74.0], dtype=np.float32)
+
     def __init__(self, args):
-        self.last_sparkles = {}
+        Overlay.__init__(self, args)
         self._sparkle_probability = args.get("sparkle_probability", 0.025)
-        self.deltas = {}
-        self.colour_factors = {}
+        self.states = {}
 
-    def get_overlaid_colours(self, colours, leds, time_since_start, fixture_name):
+    def get_layer(self, colours, leds, time_since_start, fixture_name, indices=None):
         # TODO cache colours and calc mode over all fixtures
         # todo k means clustering dominant colours
 
-        if fixture_name not in self.last_sparkles.keys():
-            self.deltas[fixture_name] = np.array(list(led.coord.get_delta("global") for led in leds))
-            self.last_sparkles[fixture_name] = np.zeros(len(leds))
-            self.colour_factors[fixture_name] = np.random.normal(1.0, 0.1, (len(leds), 3))
+        if fixture_name not in self.states.keys():
+            self.states[fixture_name] = ShowerState(leds)
 
-        # determine sparkle front probability
-        front_speed = 1.0
-        head_start = 0.5
-        front_progress = front_speed * time_since_start + head_start
+        state = self.states[fixture_name]
+
+        if indices is None:
+            num_leds = len(state.deltas)
+            deltas = state.deltas
+            last_sparkles = state.last_sparkles
+            colour_factors = state.colour_factors
 
-        time_since_front = front_progress - self.deltas[fixture_name]
-        time_since_front = np.maximum(1, time_since_front)
+        else:
+            num_leds = len(indices)
+            deltas = np.take(state.deltas, indices, out=state.subset_deltas[:num_leds])
+            last_sparkles = np.take(state.last_sparkles, indices, out=state.subset_last_sparkles[:num_leds])
+            colour_factors = np.take(state.colour_factors, indices, axis=0, out=state.subset_colour_factors[:num_leds])
 
-        front_intensity = 1.0 / (time_since_front * 0.5)
+        # determine sparkle front probability
+        front_progress = self.front_speed * time_since_start + self.head_start
+
+        time_since_front = state.time_since_front[:num_leds]
+        unreached = state.unreached[:num_leds]
+        np.subtract(front_progress, deltas, out=time_since_front)
+        np.less(time_since_front, 0.0, out=unreached)
+        np.maximum(time_since_front, 1.0, out=time_since_front)
 
-        front_intensity[self.deltas[fixture_name] > front_progress] = 0
+        # spawn new sparkles, with a probability that fades behind the front
+        faded_probability = state.scratch[:num_leds]
+        np.divide(self._sparkle_probability * 2.0, time_since_front, out=faded_probability)
+        faded_probability[unreached] = 0.0
 
-        # spawn new sparkles
-        faded_probability = self._sparkle_probability * front_intensity
+        draws = state.draws[:num_leds]
+        spawned = state.spawned[:num_leds]
+        state.rng.random(out=draws)
+        np.less(draws, faded_probability, out=spawned)
+        last_sparkles[spawned] = time_since_start
 
-        for i in range(len(leds)):
-            if random.random() < faded_probability[i]:
-                self.last_sparkles[fixture_name][i] = time.time()
+        if indices is not None:
+            state.last_sparkles[indices[spawned]] = time_since_start
 
-        time_since_sparkles = np.maximum(1.0, time.time() - self.last_sparkles[fixture_name])
-        sparkle_intensities = 1.0 / np.maximum(0.5, time_since_sparkles / 1.5)
-        sparkle_intensities *= (1.0 / np.maximum(1.0, time_since_front / 1))
+        # each sparkle fades over a second and a half, and they all dim as the front moves on
+        sparkle_intensities = state.scratch[:num_leds]
+        np.subtract(time_since_start, last_sparkles, out=sparkle_intensities)
+        np.maximum(sparkle_intensities, 1.0, out=sparkle_intensities)
+        sparkle_intensities /= 1.5
+        np.maximum(sparkle_intensities, 0.5, out=sparkle_intensities)
+        np.reciprocal(sparkle_intensities, out=sparkle_intensities)
+        sparkle_intensities /= time_since_front
 
-        sparkle_colours = np.array(list([246, 101 + 101 * (1.0 / max(1.0, time_since_front[i] / 2)), 74] for i in range(len(leds))))
-        sparkle_colours *= self.colour_factors[fixture_name]
+        sparkle_colours = state.layer[:num_leds]
+        sparkle_colours[:] = self.spark_colour
+        sparkle_colours[:, 1] += 101.0 / np.maximum(1.0, time_since_front / 2)
+        sparkle_colours *= colour_factors
         sparkle_colours *= sparkle_intensities[:,np.newaxis]
 
-        np.clip(255, 0, sparkle_colours)
+        return sparkle_colours
+
+    # nothing sparkles ahead of the front, and sparkles far enough behind it are too dim to bother with
+    def get_region(self, time_since_start):
+        front_progress = self.front_speed * time_since_start + self.head_start
+
+        return RadialBand(front_progress - self.trail, front_progress)
 
-        sparkle_colours = sparkle_colours[:len(colours)]
+    # sparkles fade with how long the front has been past them, so the last leds it reaches set how long we last
+    def get_envelope(self, time_since_start, max_delta):
+        if max_delta is None:
+            return 1.0
 
-        return np.maximum(colours, sparkle_colours)
+        return 1.0 / max(1.0, self.front_speed * time_since_start + self.head_start - max_delta)
@@ -6,34 +6,39 @@ import math
 
 
 class StarDrive(Overlay):
+    # writes the buffer in place, it's a brighten and a fade at once
+    blend = "replace"
+
     def __init__(self, args):
         Overlay.__init__(self, args)
-        self.intensity = 0.0
         self.global_z = {}
 
-    def get_overlaid_colours(self, colours, leds, time_since_start, fixture_name):
+    def get_intensity(self, time_since_start):
+        return min(1.0, 1.0/nonzero((time_since_start * 0.5) ** 2))
+
+    def get_layer(self, colours, leds, time_since_start, fixture_name):
         if fixture_name not in self.global_z.keys():
             self.global_z[fixture_name] = np.array(list(led.coord.get("global", "cartesian").z for led in leds))
 
-        self.intensity = 1.0/nonzero((time_since_start * 0.5) ** 2)
-
-        effective_intensity = min(1.0, self.intensity)
+        effective_intensity = self.get_intensity(time_since_start)
 
         fade_level = np.sin(self.global_z[fixture_name]*2 - time_since_start*1.0 + math.pi*1.5) + 1.0
-        np.clip(1.0, 0.0, fade_level)
 
         warp_core_level = np.sin(self.global_z[fixture_name] * 25 - time_since_start*8) / 1.5 + 0.5
-        np.clip(1.0, 0.0, warp_core_level)
 
         fade_level *= effective_intensity
 
         warp_core_level *= fade_level * 1.4
 
-        fade_level = fade_level[:len(colours)]
-        warp_core_level = warp_core_level[:len(colours)]
+        # colours * (1 - fade) + (colours + 16 * intensity) * fade * warp, without the temporaries
+        warp_core_level *= fade_level
+        gain = 1.0 - fade_level
+        gain += warp_core_level
 
-        fade_level = fade_level[:,np.newaxis]
-        warp_core_level = warp_core_level[:,np.newaxis]
+        colours *= gain[:,np.newaxis]
+        colours += (warp_core_level * (16*effective_intensity))[:,np.newaxis]
 
-        return colours * (1-fade_level) + (colours + 16*effective_intensity) * fade_level * warp_core_level
+        return colours
 
+    def get_envelope(self, time_since_start, max_delta):
+        return self.get_intensity(time_since_start)
@@ -6,22 +6,34 @@ import math
 
 
 class Fire(Pattern):
-    def __init__(self, leds, sample_radial=False):
+    def __init__(self, leds, sample_radial=False, reference_leds=()):
+        # fixtures may render on different threads, and the module level generator's gauss() isn't thread safe
+        self._random = random.Random()
+
         self.next_spark = 0.0
         self.spark_interval = 0.2
-        self.fixture_offset = random.random() * 10
+        self.fixture_offset = self._random.random() * 10
         self.pixel_info = list()
         self.sample_radial = sample_radial
+        self.reference_leds = reference_leds
 
         self.cache_positions(leds)
 
+    # fixtures mapped by polar position, e.g. bunting, burn outwards from their centre rather than up from the bottom
+    @classmethod
+    def from_fixture(cls, fixture):
+        return cls(fixture.leds, fixture.pattern_map_by_polar, fixture.reference_leds)
+
     def cache_positions(self, leds):
-        max_delta = max(led.coord.get_delta("local") for led in leds)
-        min_delta = min(led.coord.get_delta("local") for led in leds)
+        # the flames are scaled to the reference points as well, so fixtures that share one burn to the same height
+        extent = list(leds) + list(self.reference_leds)
+
+        max_delta = max(led.coord.get_delta("local") for led in extent)
+        min_delta = min(led.coord.get_delta("local") for led in extent)
         delta_conversion_factor = 1.0 / (max_delta - min_delta)
 
-        max_z = max(led.coord.get("local", "cartesian").z for led in leds)
-        min_z = min(led.coord.get("local", "cartesian").z for led in leds)
+        max_z = max(led.coord.get("local", "cartesian").z for led in extent)
+        min_z = min(led.coord.get("local", "cartesian").z for led in extent)
         z_conversion_factor = 1.0 / (max_z - min_z)
 
         self.spark_intensity = np.zeros(len(leds))
@@ -36,10 +48,10 @@ class Fire(Pattern):
 
     def update(self, leds, time, palette_handler, palette_name):
         if time > self.next_spark:
-            self.next_spark = time + random.gauss(self.spark_interval, self.spark_interval / 4.0)
-            spark = random.randrange(0,len(leds))
+            self.next_spark = time + self._random.gauss(self.spark_interval, self.spark_interval / 4.0)
+            spark = self._random.randrange(0,len(leds))
             self.last_sparked[spark] = time
-            self.spark_intensity[spark] = random.gauss(1.0/8.0, 1.0/16.0)
+            self.spark_intensity[spark] = self._random.gauss(1.0/8.0, 1.0/16.0)
 
     def get_pixel_colours(self, leds, time, palette_handler, palette_name):
         time_since_spark = np.maximum(1.0, time - self.last_sparked)
@@ -6,6 +6,8 @@ import math
 
 class MakeMeOneWithEverything(Pattern):
     def __init__(self, pixels):
+        self._random = random.Random()
+
         self._active_swooshes = []
 
         # sane defaults
@@ -16,7 +18,7 @@ class MakeMeOneWithEverything(Pattern):
         self._time_factor = 1.0/50
         self._space_factor = 1.0
 
-        self._next_swoosh = random.gauss(self._swoosh_interval, self._swoosh_interval / 4)
+        self._next_swoosh = self._random.gauss(self._swoosh_interval, self._swoosh_interval / 4)
 
         self.cache_positions(pixels)
 
@@ -33,13 +35,13 @@ class MakeMeOneWithEverything(Pattern):
 
     def update(self, leds, time, palette_handler, palette_name):
         if time > self._next_swoosh:
-            self._next_swoosh = time + random.gauss(self._swoosh_interval, self._swoosh_interval)
+            self._next_swoosh = time + self._random.gauss(self._swoosh_interval, self._swoosh_interval)
 
             # TODO add starting angle
             # time, direction (phi or theta), swoosh speed between 2 and 5
             # only do theta swooshes for now
-            self._active_swooshes.append((time, 1, random.random()*1 + 0.25, random.random()*2*math.pi))
-            # self._active_swooshes.append((time, random.randrange(0, 2), random.random()*1 + 0.25, random.random()*2*math.pi))
+            self._active_swooshes.append((time, 1, self._random.random()*1 + 0.25, self._random.random()*2*math.pi))
+            # self._active_swooshes.append((time, self._random.randrange(0, 2), self._random.random()*1 + 0.25, self._random.random()*2*math.pi))
 
         self._active_swooshes = list(swoosh for swoosh in self._active_swooshes if time - swoosh[0] < 30)
         pass
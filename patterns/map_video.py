@@ -1,4 +1,5 @@
 from patterns.pattern import Pattern
+from handlers.video_sampling import get_mapping_hash
 import numpy as np
 
 
@@ -7,8 +8,13 @@ class MapVideo(Pattern):
         self.video_handler = image_src
         self.cache_positions(pixels)
 
+    @classmethod
+    def from_fixture(cls, fixture):
+        return cls(fixture.leds, fixture.video_handler)
+
     def cache_positions(self, pixels):
         self.flat_mappings = np.array(list(pixel.flat_mapping for pixel in pixels))
+        self.mapping_hash = get_mapping_hash(self.flat_mappings)
 
     def get_pixel_colours(self, leds, time, palette_handler, palette_name):
-        return self.video_handler.sample(self.flat_mappings)
+        return self.video_handler.sample(self.flat_mappings, self.mapping_hash)
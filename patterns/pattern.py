@@ -1,4 +1,17 @@
+from common.plugin_registry import PluginRegistry
+
+
 class Pattern:
+    # defaults for anything registered without saying, see common/plugin_registry.py
+    requires = ()
+    cost = 1.0
+    batched = True
+
+    # fixtures build patterns through this, so ones that want more than the leds can take it from the fixture
+    @classmethod
+    def from_fixture(cls, fixture):
+        return cls(fixture.leds)
+
     def set_vars(self, args):
         pass
 
@@ -10,3 +23,15 @@ class Pattern:
 
     def get_pixel_colours(self, leds, time, palette, palette_name):
         pass
+
+
+# costs are microseconds per led per frame, measured on a 4000 led cylinder
+pattern_types = PluginRegistry("pattern", "pyzzazz.patterns")
+pattern_types.register("smooth", "patterns.smooth:Smooth", requires=(), cost=2.3, batched=False)
+pattern_types.register("swirl", "patterns.swirl:Swirl", requires=(), cost=0.35, batched=True)
+pattern_types.register("sparkle", "patterns.sparkle:Sparkle", requires=(), cost=0.4, batched=True)
+pattern_types.register("fizzy_lifting_drink", "patterns.fizzy_lifting_drink:FizzyLiftingDrink", requires=(), cost=0.4, batched=True)
+pattern_types.register("make_me_one_with_everything", "patterns.make_me_one_with_everything:MakeMeOneWithEverything",
+                       requires=(), cost=0.6, batched=True)
+pattern_types.register("fire", "patterns.fire:Fire", requires=(), cost=0.25, batched=True)
+pattern_types.register("map_video", "patterns.map_video:MapVideo", requires=("video",), cost=0.2, batched=True)
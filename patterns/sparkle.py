@@ -12,6 +12,9 @@ class SparkleRecord:
 
 class Sparkle(Pattern):
     def __init__(self, leds):
+        # our own generator rather than the shared module one, see Fire
+        self._random = random.Random()
+
         # sane defaults
         self._max_sparkles_percent = 4
         self._sparkle_probability = 0.025
@@ -46,8 +49,8 @@ class Sparkle(Pattern):
         normalised_sparkle_probability = self._sparkle_probability * frame_duration_proportion
 
         for i in range(max_sparkles):
-            if random.random() < normalised_sparkle_probability:
-                index = random.randrange(0, len(leds))
+            if self._random.random() < normalised_sparkle_probability:
+                index = self._random.randrange(0, len(leds))
                 self._sparkle_times[index]= time - 0.5  # reduce time at full brightness
                 self._sparkle_colours[index] = palette_handler.sample_radial(self._led_deltas[index], time, self._space_factor, self._time_factor, palette_name)
 
@@ -1,50 +1,77 @@
 from handlers.config_handler import ConfigHandler
 from handlers.connections.usb_serial_handler import UsbSerialHandler
-from handlers.senders.usb_serial_sender_handler import UsbSerialSenderHandler
-from handlers.controllers.gui_controller_handler import GuiControllerHandler
-from handlers.controllers.usb_serial_controller_handler import UsbSerialControllerHandler
-from handlers.senders.opc_sender_handler import OpcSenderHandler
 from handlers.palette_handler import PaletteHandler
-from handlers.video_handler import VideoHandler
 from handlers.connections.socket_server import SocketServer
 from fixtures.dodecahedron import Dodecahedron
 from fixtures.cylinder import Cylinder
 from fixtures.bunting_polygon import BuntingPolygon
 from handlers.setting_handler import SettingHandler
+from handlers.calibration_handler import CalibrationHandler
+from handlers.hotkey_handler import HotKeyHandler
+from handlers.preview_handler import PreviewHandler
+from handlers.event_router import EventRouter
+from handlers.render_pool import RenderPool
+from handlers.render_pool import ThreadRenderPool
+from handlers.patch_map import Patch
+from handlers.patch_map import PatchMap
 from overlays.overlay_handler import OverlayHandler
 from common.graceful_killer import GracefulKiller
+from common.frame_scheduler import FrameScheduler
+from common.profiler import profiler
+from common.line_planner import plan_lines
+from common.line_planner import format_report
+from common.lazy_loader import LazyRegistry
+from common.lazy_loader import import_module
+from common.lazy_loader import load_report
 
 import time
 import traceback
+import sys
+import termios
+import tty
 from pathlib import Path
 
 # TODO fixture groups
 
+# only the types a config uses get imported, see common/lazy_loader.py
+sender_types = LazyRegistry("sender")
+sender_types.register("usb_serial", "handlers.senders.usb_serial_sender_handler:UsbSerialSenderHandler")
+sender_types.register("opc", "handlers.senders.opc_sender_handler:OpcSenderHandler")
+
+controller_types = LazyRegistry("controller")
+controller_types.register("usb_serial", "handlers.controllers.usb_serial_controller_handler:UsbSerialControllerHandler")
+controller_types.register("gui", "handlers.controllers.gui_controller_handler:GuiControllerHandler")
+
 start_pattern = "smooth"
 start_palette = "auto"
 default_port = 48945
 
 conf_file = "conf/elephant_conf.json"
+usb_port_cache_file = "conf/usb_port_names.json"
+calibration_file = "conf/calibration.json"
 
 class Pyzzazz:
-    def __init__(self, conf_path, palette_path, video_path):
+    # the device dir and file paths can be pointed elsewhere to run against stand in hardware, see benchmarks/
+    def __init__(self, conf_path, palette_path, video_path, device_dir="/dev/", port_keyword=None,
+                 port_cache_path=usb_port_cache_file, calibration_path=calibration_file):
         self._src_dir = Path(__file__).parent
         self.config_parser = ConfigHandler(conf_path)
         self.palette_handler = PaletteHandler(palette_path)
 
         self.video_handlers = dict()
+        self.track_store = None
+        self.init_video_handlers(video_path)
 
-        self.video_handlers["icosahedron"] = VideoHandler(video_path)
-        self.video_handlers["cylinder"] = VideoHandler(video_path)
-        self.video_handlers["bunting"] = VideoHandler(video_path)
-
-        self.usb_serial_manager = UsbSerialHandler()
+        self.usb_serial_manager = UsbSerialHandler(device_dir=device_dir, port_keyword=port_keyword, name_cache_path=port_cache_path)
         self.effective_time = 0.0
         self.last_update = time.time()
         self.subprocesses = list()
 
         self.fps = 30.0
         self.time_per_frame = 1.0 / self.fps
+        self.frame_scheduler = FrameScheduler(self.fps)
+
+        self.calibration_handler = CalibrationHandler(calibration_path, self.frame_scheduler)
 
         self.senders = dict()
         self.fixtures = []
@@ -53,19 +80,67 @@ class Pyzzazz:
         self.setting_handlers = {}
 
         if self.needs_socket_server():
-            self.socket_server = SocketServer(port=default_port)
+            # never block in the server, the frame scheduler does our waiting
+            self.socket_server = SocketServer(port=default_port, timeout=0)
+            self.preview_handler = PreviewHandler(self.socket_server)
         else:
             self.socket_server = None
+            self.preview_handler = None
 
         self.overlay_handler = OverlayHandler()
+        self.event_router = EventRouter()
 
         # these must be done in this order
         self.init_setting_handlers()
         self.init_senders()
+        self.plan_lines()
         self.init_fixtures()
+        self.init_patch_map()
         self.init_controllers()
         self.register_commands()
         self.generate_opc_layout_files()
+        self.bake_video_tracks()
+        self.init_render_pool()
+
+        self.hotkey_handler = HotKeyHandler(self.fixtures, self.calibration_handler)
+
+        self.frame_scheduler.add_idle_task("usb port scan", self.usb_serial_manager.scan_ports, 1.0)
+        self.frame_scheduler.add_idle_task("serial link report", self.report_serial_links, 10.0)
+
+        # off unless the config asks for it, p toggles it and t captures a trace
+        profiler.configure(self.config_parser.get_profiler_settings())
+        self.frame_scheduler.add_idle_task("profiler report", profiler.report, 10.0)
+
+        print("Lazily loaded modules:")
+        load_report.report()
+
+    # opencv is the slowest thing we import, and only map_video needs it
+    def needs_video(self):
+        for fixture_conf in self.config_parser.get_fixtures():
+            if fixture_conf.get("default_pattern", "") == "map_video":
+                return True
+
+        for controller_conf in self.config_parser.get_controllers():
+            for button in controller_conf.get("buttons", []):
+                if "map_video" in str(button.get("command", "")):
+                    return True
+
+        return False
+
+    def init_video_handlers(self, video_path):
+        if not self.needs_video():
+            return
+
+        VideoHandler = import_module("handlers.video_handler", "map_video").VideoHandler
+        track_settings = self.config_parser.get_video_track_settings()
+
+        if track_settings.get("enabled", False):
+            VideoTrackStore = import_module("handlers.video_track_store", "video tracks").VideoTrackStore
+            self.track_store = VideoTrackStore(track_settings.get("cache_dir", "video_tracks/"))
+
+        self.video_handlers["icosahedron"] = VideoHandler(video_path, self.track_store)
+        self.video_handlers["cylinder"] = VideoHandler(video_path, self.track_store)
+        self.video_handlers["bunting"] = VideoHandler(video_path, self.track_store)
 
     def needs_socket_server(self):
         for controller_conf in self.config_parser.get_controllers():
@@ -74,12 +149,45 @@ class Pyzzazz:
 
         return False
 
+    def get_wait_fds(self):
+        fds = self.usb_serial_manager.get_fds()
+
+        if self.socket_server:
+            fds.extend(self.socket_server.get_fds())
+
+        if sys.stdin.isatty():
+            fds.append(sys.stdin)
+
+        return fds
+
     def update(self):
+        self.hotkey_handler.poll()
+
         if self.socket_server:
             self.socket_server.poll()
 
         self.usb_serial_manager.update()
 
+        # pick up controller input as soon as it arrives, but only act on it once per frame
+        for controller in self.controllers:
+            if not controller.is_connected():
+                controller.try_connect()
+
+            if controller.is_connected():
+                controller.update()
+
+        # prevent senders and video updating too often
+        if not self.frame_scheduler.frame_due():
+            return
+
+        self.frame_scheduler.start_frame()
+        profiler.start_frame()
+
+        if profiler.enabled:
+            profiler.timed("events", "dispatch", self.dispatch_events)
+        else:
+            self.dispatch_events()
+
         smoothness = self.setting_handlers["master_settings"].get_value("smoothness", 0.5)
         brightness = self.setting_handlers["master_settings"].get_value("brightness", 0.5)
         speed = self.setting_handlers["master_settings"].get_value("speed", 0.5)
@@ -88,60 +196,86 @@ class Pyzzazz:
         self.palette_handler.set_palette_space_factor(self.setting_handlers["master_settings"].get_value("space_per_palette", 0.5))
         self.palette_handler.set_palette_time_factor(self.setting_handlers["master_settings"].get_value("time_per_palette", 0.5))
 
-        for controller in self.controllers:
-            if not controller.is_connected():
-                controller.try_connect()
+        self.effective_time += (time.time() - self.last_update) * speed * 3  # we want to go from 0 to triple speed
+        self.last_update = time.time()
 
-            if controller.is_connected():
-                controller.update()
 
-                events = controller.get_events()
-                for event in events:
-                    if event.is_overlay():
-                        self.overlay_handler.receive_command(event.command, self.effective_time)
+        for sender in self.senders.values():
+            if not sender.is_connected():
+                sender.try_connect()
 
-                    else:
-                        if event.is_video():
-                            matching_vid_handlers = list(handler_name for handler_name in self.video_handlers.keys()
-                                                         if event.target_keyword in handler_name)
+            sender.start_frame()
 
-                            for handler_name in matching_vid_handlers:
-                                self.video_handlers[handler_name].receive_command(event.command)
+        if self.render_pool:
+            if profiler.enabled:
+                profiler.timed("render", "pool", self.render_pool.render, self.effective_time, smoothness, brightness)
+                profiler.timed("send", "pool", self.render_pool.send)
+            else:
+                self.render_pool.render(self.effective_time, smoothness, brightness)
+                self.render_pool.send()
 
-                        matching_fixtures = list(fixture for fixture in self.fixtures
-                                                 if event.target_keyword in fixture.name)
+        else:
+            for name, video_handler in self.video_handlers.items():
+                if profiler.enabled:
+                    profiler.timed("video", name, video_handler.update, self.effective_time)
+                else:
+                    video_handler.update(self.effective_time)
 
-                        for fixture in matching_fixtures:
-                            fixture.receive_command(event.command, event.value)
+            for fixture in self.fixtures:
+                if profiler.enabled:
+                    profiler.timed("fixture", fixture.name, fixture.update, self.effective_time, self.palette_handler, smoothness, brightness)
+                else:
+                    fixture.update(self.effective_time, self.palette_handler, smoothness, brightness)
 
-                        matching_setts = list(sett for sett in self.setting_handlers.keys()
-                                              if event.target_keyword in sett)
+                fixture.send()
 
-                        for sett in matching_setts:
-                            self.setting_handlers[sett].receive_command(event.command, event.value)
+            self.patch_map.send()
 
-                controller.clear_events()
+            self.overlay_handler.update(self.effective_time)
 
-        # prevent senders and video updating too often
-        if self.last_update + self.time_per_frame > time.time():
-            return
+        if self.preview_handler:
+            if profiler.enabled:
+                profiler.timed("preview", "update", self.preview_handler.update, self.fixtures)
+            else:
+                self.preview_handler.update(self.fixtures)
 
-        self.effective_time += (time.time() - self.last_update) * speed * 3  # we want to go from 0 to triple speed
-        self.last_update = time.time()
+        # flush anything the frame queued up for the socket clients before we go back to sleep
+        if self.socket_server:
+            self.socket_server.poll()
 
+        profiler.end_frame()
+        self.frame_scheduler.end_frame()
+        self.frame_scheduler.run_idle_tasks()
 
-        for sender in self.senders.values():
-            if not sender.is_connected():
-                sender.try_connect()
+    def dispatch_events(self):
+        for controller in self.controllers:
+            for event in controller.get_events():
+                route = self.event_router.get_route(event.control)
 
-        for video_handler in self.video_handlers.values():
-            video_handler.update(self.effective_time)
+                # a render pool applies commands itself at the start of its next frame, so they can't land mid render
+                if route.is_overlay:
+                    if self.render_pool:
+                        self.render_pool.queue_overlay_command(event.command)
+                    else:
+                        self.overlay_handler.receive_command(event.command, self.effective_time)
+                    continue
 
-        for fixture in self.fixtures:
-            fixture.update(self.effective_time, self.palette_handler, smoothness, brightness)
-            fixture.send()
+                for video_handler in route.video_handlers:
+                    if self.render_pool:
+                        self.render_pool.queue_video_command(video_handler, event.command)
+                    else:
+                        video_handler.receive_command(event.command)
+
+                for fixture in route.fixtures:
+                    if self.render_pool:
+                        self.render_pool.queue_fixture_command(fixture, event.command, event.value)
+                    else:
+                        fixture.receive_command(event.command, event.value)
 
-        self.overlay_handler.update(self.effective_time)
+                for setting_handler in route.setting_handlers:
+                    setting_handler.receive_command(event.command, event.value)
+
+            controller.clear_events()
 
     def init_senders(self):
         for sender_conf in self.config_parser.get_senders():
@@ -152,17 +286,39 @@ class Pyzzazz:
 
             if sender_conf.get("type", "") == "usb_serial":
                 print("Creating usb serial sender handler {}".format(name))
-                self.senders[name] = UsbSerialSenderHandler(sender_conf, self.usb_serial_manager)
+                self.senders[name] = sender_types.get("usb_serial")(sender_conf, self.usb_serial_manager)
 
             elif sender_conf.get("type", "") == "opc":
                 print("Creating opc sender {} on port {}".format(name, sender_conf.get("port", "")))
-                self.senders[name] = OpcSenderHandler(sender_conf, self._src_dir)
+                self.senders[name] = sender_types.get("opc")(sender_conf, self._src_dir)
 
             else:
                 raise Exception("Unknown sender type {}".format(sender_conf.get("type", "")))
 
         print("\n")
 
+    # boards whose links couldn't keep up since the last report
+    def report_serial_links(self):
+        for sender in self.senders.values():
+            if sender.type == "usb_serial":
+                sender.report()
+
+    # lay the fixtures out across the boards' lines ourselves, rather than as the config has them
+    def plan_lines(self):
+        settings = self.config_parser.get_line_plan_settings()
+
+        if not settings.get("enabled", False):
+            return
+
+        plan = plan_lines(self.config_parser.get_senders(), self.config_parser.get_fixtures(), split=settings.get("split", True))
+        self.config_parser.set_fixtures(plan.fixture_confs)
+
+        print("Planned fixture lines:")
+        print(format_report(plan.boards))
+
+        for fixture_conf in plan.fixture_confs:
+            print("  {}: {}".format(fixture_conf.get("name", ""), fixture_conf.get("senders", [])))
+
     def init_fixtures(self):
         # TODO create extra settings fixtures in the conf, specify them in led fixtures, and pass them in
 
@@ -170,21 +326,19 @@ class Pyzzazz:
             self.sanity_check_fixture_conf(fixture_conf)
 
             if fixture_conf.get("type", "") == "led":
-                fixture_senders = list()
-                for sender_info in fixture_conf.get("senders", []):
-                    fixture_senders.append((self.senders[sender_info[0]], sender_info[1]))
+                fixture_senders = list(Patch.from_conf(entry, self.senders) for entry in fixture_conf.get("senders", []))
 
                 if fixture_conf.get("geometry", "") == "dodecahedron":
                     print("Creating dodecahedron {} with senders {}".format(fixture_conf.get("name", ""), fixture_conf.get("senders", [])))
-                    self.fixtures.append(Dodecahedron(fixture_conf, fixture_senders, self.overlay_handler, self.video_handlers["icosahedron"]))
+                    self.fixtures.append(Dodecahedron(fixture_conf, fixture_senders, self.overlay_handler, self.video_handlers.get("icosahedron", None), self.calibration_handler))
 
                 elif fixture_conf.get("geometry", "") == "cylinder":
                     print("Creating cylinder {} with senders {}".format(fixture_conf.get("name", ""), fixture_conf.get("senders", [])))
-                    self.fixtures.append(Cylinder(fixture_conf, fixture_senders, self.overlay_handler, self.video_handlers["cylinder"]))
+                    self.fixtures.append(Cylinder(fixture_conf, fixture_senders, self.overlay_handler, self.video_handlers.get("cylinder", None), self.calibration_handler))
 
                 elif fixture_conf.get("geometry", "") == "bunting_polygon":
                     print("Creating bunting polygon {} with senders {}".format(fixture_conf.get("name", ""), fixture_conf.get("senders", [])))
-                    self.fixtures.append(BuntingPolygon(fixture_conf, fixture_senders, self.overlay_handler, self.video_handlers["bunting"]))
+                    self.fixtures.append(BuntingPolygon(fixture_conf, fixture_senders, self.overlay_handler, self.video_handlers.get("bunting", None), self.calibration_handler))
 
                 else:
                     raise Exception("Unknown fixture geometry {}".format(fixture_conf.get("geometry", "")))
@@ -192,8 +346,18 @@ class Pyzzazz:
             else:
                 raise Exception("Unknown fixture type {}".format(fixture_conf.get("type", "")))
 
+        for fixture in self.fixtures:
+            fixture.scheduler = self.frame_scheduler
+
         print("\n")
 
+    # where every fixture's pixels land on the senders' lines, checked for overlaps once here rather than every frame
+    def init_patch_map(self):
+        self.patch_map = PatchMap(self.fixtures)
+
+        for fixture in self.fixtures:
+            fixture.patch_map = self.patch_map
+
     def init_controllers(self):
         for controller_conf in self.config_parser.get_controllers():
             # check for duplicate names
@@ -201,11 +365,11 @@ class Pyzzazz:
 
             if controller_conf.get("type", "") == "usb_serial":
                 print("Creating usb serial controllers {} on port {}".format(controller_conf.get("name", ""), controller_conf.get("port", "")))
-                self.controllers.append(UsbSerialControllerHandler(controller_conf, self.usb_serial_manager))
+                self.controllers.append(controller_types.get("usb_serial")(controller_conf, self.usb_serial_manager))
 
             elif controller_conf.get("type", "") == "gui":
                 print("Creating gui controllers {} on port {}".format(controller_conf.get("name", ""), controller_conf.get("port", "")))
-                self.controllers.append(GuiControllerHandler(controller_conf, self.socket_server))
+                self.controllers.append(controller_types.get("gui")(controller_conf, self.socket_server))
 
             else:
                 raise Exception("Unknown controllers type {}".format(controller_conf.get("type", "")))
@@ -219,24 +383,57 @@ class Pyzzazz:
         # TODO add configurable ones here
 
     def register_commands(self):
-        for controller in self.controllers:
-            for control in controller.get_controls():
-                # FIXME this is hacky also
-                if control.command["type"] != "overlay":
-                    matching_fixtures = list(fixture for fixture in self.fixtures if control.target_keyword in fixture.name)
+        self.event_router.build(self.controllers, self.fixtures, self.video_handlers, self.setting_handlers)
+
+        # patterns are built here rather than on first use, which would stall that frame
+        for fixture in self.fixtures:
+            fixture.register_command({"type": "pattern", "name": fixture.pattern})
+
+        for control, route in self.event_router.get_routes():
+            if route.is_overlay:
+                self.overlay_handler.register_command(control.command)
+
+            for fixture in route.fixtures:
+                fixture.register_command(control.command)
+
+            for setting_handler in route.setting_handlers:
+                setting_handler.register_command(control.command, control.default)
+
+    def bake_video_tracks(self):
+        if self.track_store is None or not self.config_parser.get_video_track_settings().get("bake_on_start", False):
+            return
 
-                    for fixture in matching_fixtures:
-                        fixture.register_command(control.command)
+        for fixture in self.fixtures:
+            pattern = fixture.patterns.get("map_video", None)
+
+            if pattern is not None:
+                print("Baking video tracks for {}...".format(fixture.name))
+                fixture.video_handler.bake_tracks(pattern.flat_mappings, pattern.mapping_hash)
+
+    def init_render_pool(self):
+        render_settings = self.config_parser.get_render_settings()
+        mode = render_settings.get("mode", "serial")
+
+        self.render_pool = None
 
-                    matching_setts = list(sett for sett in self.setting_handlers.keys() if control.target_keyword in sett)
+        if mode == "processes":
+            # workers fork from here, so everything they need must already be set up
+            self.render_pool = RenderPool(self.fixtures, self.patch_map, self.overlay_handler, self.palette_handler, self.video_handlers,
+                                          self.calibration_handler, num_workers=render_settings.get("workers", None))
 
-                    for sett in matching_setts:
-                        self.setting_handlers[sett].register_command(control.command, control.default)
+            self.frame_scheduler.add_idle_task("render rebalance", self.render_pool.rebalance, 5.0)
+
+        elif mode == "threads":
+            self.render_pool = ThreadRenderPool(self.fixtures, self.patch_map, self.overlay_handler, self.palette_handler, self.video_handlers,
+                                                num_workers=render_settings.get("workers", None))
+
+        elif mode != "serial":
+            raise Exception("Pyzzazz: unknown render mode {}".format(mode))
 
     def generate_opc_layout_files(self):
         for sender in self.senders.values():
             if sender.type == "opc":
-                sender.generate_layout_files(self.fixtures)
+                sender.generate_layout_files(self.patch_map)
                 opc_server_started = sender.start()
 
                 if opc_server_started:
@@ -253,15 +450,10 @@ class Pyzzazz:
             if fixture_conf.get("name", "") == fixture.name:
                 raise Exception("Pyzzazz: config specifies one or more fixtures with identical name {}".format(fixture_conf.get("name", "")))
 
-            for new_sender_info in fixture_conf.get("senders", []):
-                for existing_sender_info in fixture.senders_info:
-                    if new_sender_info[0] == existing_sender_info.sender.name and new_sender_info[1] == existing_sender_info.line:
-                        raise Exception("Pyzzazz: config specifies one or more fixtures with identical senders {} and lines {}".format(new_sender_info[0], new_sender_info[1]))
-
-        # check sender exists
-        for sender_info in fixture_conf.get("senders", []):
-            if sender_info[0] not in list(sender.name for sender in self.senders.values()):
-                raise Exception("Pyzzazz: Fixture {} specified with undefined sender {}".format(fixture_conf.get("name", ""), sender_info[0]))
+        # check sender exists, fixtures sharing a line are checked for overlaps when the patch map is built
+        for entry in fixture_conf.get("senders", []):
+            if Patch.get_sender_name(entry) not in list(sender.name for sender in self.senders.values()):
+                raise Exception("Pyzzazz: Fixture {} specified with undefined sender {}".format(fixture_conf.get("name", ""), Patch.get_sender_name(entry)))
 
     def sanity_check_controller_conf(self, controller_conf):
         button_ids = list(button["id"] for button in controller_conf.get("buttons", []))
@@ -274,6 +466,15 @@ class Pyzzazz:
 
     def shut_down(self):
         print("Shutting down...")
+        self.frame_scheduler.shut_down()
+
+        if self.render_pool:
+            self.render_pool.shut_down()
+
+        # only loaded if a fixture might show video
+        if self.video_handlers:
+            import_module("handlers.video_decoder", "map_video").video_decoders.shut_down()
+
         for p in self.subprocesses:
             p.kill()
 
@@ -285,7 +486,7 @@ if __name__ == "__main__":
     try:
         old_settings = termios.tcgetattr(sys.stdin)
         tty.setcbreak(sys.stdin.fileno())
-        term_saved = False
+        term_saved = True
     except:
         pass
 
@@ -303,15 +504,11 @@ if __name__ == "__main__":
 
         print("Running...")
         while True:
+            # sleep until the next frame is due or there's input to deal with
+            pyzzazz.frame_scheduler.wait(pyzzazz.get_wait_fds(), pyzzazz.usb_serial_manager.get_write_fds())
             pyzzazz.update()
 
             if killer.kill_now or pyzzazz.hotkey_handler.exit:
-                if term_saved:
-                    termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
-
-                if pyzzazz:
-                    pyzzazz.shut_down()
-
                 break
 
     except Exception as e:
@@ -319,6 +516,10 @@ if __name__ == "__main__":
         traceback.print_exc()
 
     finally:
-        pyzzazz.shut_down()
+        if term_saved:
+            termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
+
+        if pyzzazz:
+            pyzzazz.shut_down()
 
     print("have a nice day :)")